@@ -0,0 +1,75 @@
+"""
+    Benchmark for the insert/update classification performed by the SetStmtPerNewRow activity.\n
+    The vectorized hash-join engine (SetStmtPerNewRow.classify_rows) is timed for increasing sizes,
+    and the time per row is reported so linear scaling can be checked (it should stay roughly flat).\n
+    The legacy per-pk scan is also timed for the smaller sizes as a reference.
+
+    Usage (from the repository root):
+        python -m benchmarks.classify_rows --sizes 10000 100000 1000000 --legacy-max 10000
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from functions.SetStmtPerNewRow import classify_rows, DF_SQL_STMT_COL
+
+EXISTING_KEYS_FRACTION = 0.5
+
+
+def build_data(rows: int, seed: int = 0) -> Tuple[pd.DataFrame, List[List[str]]]:
+    rng = np.random.default_rng(seed)
+    ids = np.char.add('rs', rng.integers(0, rows * 10, rows).astype(str))
+    df = pd.DataFrame({
+        'ID': ids,
+        'MUESTRA': np.char.add('M', rng.integers(0, 100, rows).astype(str)),
+        'RESULTADO': np.char.add('R', rng.integers(0, 3, rows).astype(str)),
+    }).drop_duplicates(ignore_index=True)
+
+    # Half of the database pks match new rows, the other half do not
+    existing = df.sample(frac=EXISTING_KEYS_FRACTION, random_state=seed)
+    unmatched = existing.assign(ID=existing['ID'] + 'x')
+    db_unique_pks = pd.concat([existing, unmatched]).values.tolist()
+    return df, db_unique_pks
+
+
+def legacy_classify_rows(df: pd.DataFrame, db_unique_pks: List[List[str]]) -> List[List[str]]:
+    df[DF_SQL_STMT_COL] = ''
+    dup_pks = []
+    for db_pk in db_unique_pks:
+        i_rows_to_update = df.loc[(df['ID'] == db_pk[0]) & (df['MUESTRA'] == db_pk[1]) & (df['RESULTADO'] == db_pk[2])].index.tolist()
+        if i_rows_to_update:
+            dup_pks.append(db_pk)
+            for i_row in i_rows_to_update:
+                df.loc[i_row, DF_SQL_STMT_COL] = 'update'
+    df.loc[df[DF_SQL_STMT_COL] == '', DF_SQL_STMT_COL] = 'insert'
+    return dup_pks
+
+
+def timed(func, df: pd.DataFrame, db_unique_pks: List[List[str]]) -> Tuple[float, List[List[str]]]:
+    start = time.perf_counter()
+    dup_pks = func(df, db_unique_pks)
+    return time.perf_counter() - start, dup_pks
+
+
+def run(sizes: List[int], legacy_max: int) -> None:
+    print(f'{"engine":<10}{"rows":>12}{"db_pks":>12}{"seconds":>12}{"us/row":>12}')
+    for size in sizes:
+        df, db_unique_pks = build_data(size)
+        elapsed, dup_pks = timed(classify_rows, df.copy(), db_unique_pks)
+        print(f'{"hash-join":<10}{len(df):>12}{len(db_unique_pks):>12}{elapsed:>12.3f}{elapsed / len(df) * 1e6:>12.3f}')
+
+        if size <= legacy_max:
+            legacy_elapsed, legacy_dup_pks = timed(legacy_classify_rows, df.copy(), db_unique_pks)
+            assert legacy_dup_pks == dup_pks, 'Both engines must return the same duplicated pks'
+            print(f'{"legacy":<10}{len(df):>12}{len(db_unique_pks):>12}{legacy_elapsed:>12.3f}{legacy_elapsed / len(df) * 1e6:>12.3f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max', type=int, default=10_000, help='Largest size for which the legacy engine is timed')
+    args = parser.parse_args()
+    run(args.sizes, args.legacy_max)
@@ -0,0 +1,62 @@
+"""
+    Parse throughput of the new data csv per engine (RetrieveAndSaveDf CSV_ENGINES) and number of cores.\n
+    - pandas: pandas C parser, single threaded (the number of cores does not apply)\n
+    - arrow: pyarrow multithreaded reader, limited to every number of cores given with --cores\n
+    Both engines produce the same typed dataframe (check `utils.schema`), so the conversion is timed as well.
+
+    Usage (from the repository root):
+        python -m benchmarks.csv_engines --rows 1000000 --cores 1 2 4 8
+"""
+import os
+import time
+import logging
+import argparse
+import tempfile
+from typing import List
+
+import pyarrow as pa
+
+from benchmarks.synthetic import build_csv
+from functions.RetrieveAndSaveDf import read_source
+
+
+def timed_parse(path: str, engine: str, repeat: int) -> float:
+    kwargs = {'url': path, 'delimiter': ',', 'quotechar': '"', 'csv_engine': engine}
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read_source(kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(rows: int, cores: List[int], repeat: int) -> None:
+    # The csv is read as a local url (no spool file), which read_source warns about on every parse
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'nuevas_filas.csv')
+        build_csv(path, rows)
+        size = os.path.getsize(path) / 2**20
+        print(f'{rows} rows, {size:.1f} MB, {os.cpu_count()} cores available')
+
+        print(f'{"engine":<10}{"cores":>6}{"parse s":>10}{"rows/s":>12}{"MB/s":>8}')
+        elapsed = timed_parse(path, 'pandas', repeat)
+        print(f'{"pandas":<10}{1:>6}{elapsed:>10.2f}{rows / elapsed:>12.0f}{size / elapsed:>8.1f}')
+
+        default_cores = pa.cpu_count()
+        try:
+            for n in cores:
+                pa.set_cpu_count(n)
+                elapsed = timed_parse(path, 'arrow', repeat)
+                print(f'{"arrow":<10}{n:>6}{elapsed:>10.2f}{rows / elapsed:>12.0f}{size / elapsed:>8.1f}')
+        finally:
+            pa.set_cpu_count(default_cores)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--cores', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3, help='Best of this many parses per configuration')
+    args = parser.parse_args()
+    run(args.rows, args.cores, args.repeat)
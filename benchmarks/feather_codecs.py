@@ -0,0 +1,85 @@
+"""
+    Benchmark of the intermediate feather files compression codecs (BlobManager.upload_by_chunks).\n
+    For every codec the transformed new data is written as feather record batches and read back, reporting the
+    bytes that would go to/from blob storage and the write, full read and pk-columns read (SetStmtPerNewRow) times.\n
+    If --storage is given, the dataframe is also uploaded and downloaded through BlobManager against the storage
+    account of MyStorageConnectionAppSetting (Azurite by default), timing the activity round-trip end to end.
+
+    Usage (from the repository root):
+        python -m benchmarks.feather_codecs --rows 1000000
+        python -m benchmarks.feather_codecs --rows 1000000 --storage
+"""
+import io
+import argparse
+import time
+from typing import List, Optional, Tuple
+
+import pyarrow as pa
+
+from benchmarks.statement_building import build_data
+from functions.utils.blob_manager import build_ipc_write_options, ROWS_PER_BATCH, STORAGE_CONTAINER
+
+PK_COLUMNS = ['ID', 'MUESTRA', 'RESULTADO']
+CODECS: List[Tuple[str, Optional[int]]] = [('none', None), ('lz4', None), ('zstd', None), ('zstd', 3), ('zstd', 9)]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def write(table: pa.Table, codec: str, level: Optional[int]) -> bytes:
+    sink = io.BytesIO()
+    with pa.ipc.new_file(sink, table.schema, options=build_ipc_write_options(codec, level)) as writer:
+        for batch in table.to_batches(max_chunksize=ROWS_PER_BATCH):
+            writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def read(data: bytes, columns: Optional[List[str]] = None):
+    # Only the buffers of the requested columns are read (and decompressed), as BlobManager.download_blob_as_df does
+    options = None
+    if columns:
+        names = pa.ipc.open_file(pa.BufferReader(data)).schema.names
+        options = pa.ipc.IpcReadOptions(included_fields=sorted(names.index(c) for c in columns))
+    return pa.ipc.open_file(pa.BufferReader(data), options=options).read_all().to_pandas()
+
+
+def run(rows: int, storage: bool) -> None:
+    df = build_data(rows)
+    # Repetitive genomic text columns, as found within the source csv
+    df['INFO'] = 'DP=' + df['QUAL'] + ';AF=0.5;MQ=60;DB;SOMATIC;VT=SNP'
+    df['FORMAT'] = 'GT:AD:DP:GQ:PL'
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    bm = None
+    if storage:
+        from functions.utils.blob_manager import BlobManager
+        bm = BlobManager()
+
+    header = f'{"codec":<12}{"MB":>10}{"ratio":>8}{"write s":>10}{"read s":>10}{"pk read s":>11}'
+    print(header + (f'{"upload s":>10}{"download s":>12}' if storage else ''))
+    raw_size = None
+    for codec, level in CODECS:
+        data, write_s = timed(lambda: write(table, codec, level))
+        _, read_s = timed(lambda: read(data))
+        _, pk_read_s = timed(lambda: read(data, PK_COLUMNS))
+        raw_size = raw_size or len(data)
+
+        name = codec + (f'-{level}' if level else '')
+        line = f'{name:<12}{len(data) / 2**20:>10.1f}{raw_size / len(data):>8.2f}{write_s:>10.3f}{read_s:>10.3f}{pk_read_s:>11.3f}'
+        if bm is not None:
+            blob = f'benchmark_{name}.ftr'
+            _, upload_s = timed(lambda: bm.upload_by_chunks(df, STORAGE_CONTAINER, blob, compression=codec, compression_level=level))
+            _, download_s = timed(lambda: bm.download_blob_as_df(STORAGE_CONTAINER, blob))
+            line += f'{upload_s:>10.3f}{download_s:>12.3f}'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--storage', action='store_true', help='Also time the upload and download through blob storage')
+    args = parser.parse_args()
+    run(args.rows, args.storage)
@@ -0,0 +1,268 @@
+"""
+    Reproducible end to end benchmark of the ingest and ModifyDB activities, run against the local stand-ins of
+    docker-compose.yaml: Azurite (blob storage) and the SQL Server container (working and logging databases).\n
+    - Synthetic new data (check `benchmarks.synthetic`) is written to a csv, and its registers are seeded into a
+      dedicated table of the working database (--table, dropped and created with the columns of the working table
+      and its indexes of tools/migrate.py)\n
+    - Every activity `main` runs within a fresh process, handing its JSON result over to the next one as the
+      orchestrators do: RetrieveAndSaveDf -> Transformations -> GetUniqueSetOfPksFromDb -> SetStmtPerNewRow ->
+      GenerateInsUpdStmt -> UploadNewData, followed by the ModifyDB chain of DEDUP_MODE\n
+    - Wall time, rows, rows per second, peak RSS, blob bytes and database round-trips of every stage are saved
+      into a JSON results file, along with the data parameters and the pipeline settings, so runs can be
+      compared (--baseline)\n
+    The SQL_DRIVER_* environment variables have to point to the SQL Server container (and MyStorageConnectionAppSetting
+    to Azurite, the default). Pipeline settings (CSV_ENGINE, INSERT_STRATEGY, FEATHER_COMPRESSION, DEDUP_MODE...) are
+    read from the environment, as within the functions app. Never run it against a shared database: besides its
+    own table, the 'window' dedup mode records its watermark within the logging database.
+
+    Usage (from the repository root):
+        docker compose up -d
+        python tools/create_logs_db.py
+        python -m benchmarks.pipeline --size 1m --output pipeline_1m.json
+        CSV_ENGINE=arrow python -m benchmarks.pipeline --size 1m --baseline pipeline_1m.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import argparse
+import platform
+import importlib
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+from azure.core.exceptions import ResourceExistsError
+
+from benchmarks.synthetic import SIZES, EXISTING_FRACTION, DUPLICATE_RATE, CSV_DUPLICATE_RATE, iter_chunks
+from functions.utils.schema import SCHEMA
+from functions.utils.metrics import COUNTERS, RESULT_KEY, METRICS_KEY
+from functions.utils.db_manager import DBManager
+from functions.utils.blob_manager import BlobManager, STORAGE_CONTAINER
+from functions.ScheduledIngest import DELIMITER, QUOTECHAR, CSV_ENGINE, WORK_TABLE
+from functions.ModifyDB import DB, DEDUP_MODE
+from tools.migrate import MIGRATIONS
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows (peak RSS is not reported)
+    resource = None
+
+BENCHMARK_TABLE = 'Unificado_benchmark'
+# Environment variables recorded within the results file (the ones changing how the stages perform)
+SETTINGS = [
+    'CSV_ENGINE', 'CSV_BLOCK_SIZE', 'FEATHER_COMPRESSION', 'FEATHER_COMPRESSION_LEVEL', 'BLOB_MAX_CONCURRENCY',
+    'CLAIM_CHECK_THRESHOLD', 'INSERT_STRATEGY', 'UPLOAD_CONCURRENCY', 'SQL_BULK_ROWS_PER_BATCH',
+    'SQL_BULK_ROWS_PER_TRANSACTION', 'SQL_POOL_MAX_SIZE', 'SQL_MAX_CONCURRENCY', 'DEDUP_MODE', 'DEDUP_CHUNK_IDS'
+]
+
+
+class BenchmarkTableError(Exception):
+    pass
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def run_activity(name: str, payload: str) -> Dict[str, Any]:
+    # Runs within a fresh process (check `run_stage`). The module is imported before the clock starts,
+    # as the functions host keeps it loaded across invocations
+    main = importlib.import_module(f'functions.{name}').main
+    base_rss = peak_rss_mb()
+    start = time.perf_counter()
+    result = main(json.loads(payload))
+    if inspect.iscoroutine(result):
+        result = asyncio.run(result)
+    seconds = time.perf_counter() - start
+    # Activities wrap their result along with their own metrics (check `utils.metrics.metered`)
+    return {'result': json.dumps(result[RESULT_KEY]), 'metrics': result[METRICS_KEY], 'seconds': seconds, 'base_rss_mb': base_rss, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_stage(name: str, payload: Any) -> Dict[str, Any]:
+    """
+        This function runs an activity `main` within a fresh process, so the peak RSS of every stage is measured
+        on its own. The payload and the result go through JSON, as between the orchestrator and its activities.
+
+        Args:
+            name (str): Activity name (folder within functions)
+            payload (any): Activity input
+
+        Returns:
+            dict: Activity result (result) and metrics (metrics), wall time (seconds), RSS before running main and
+                peak RSS (base_rss_mb and peak_rss_mb, in MB) and size of the JSON result (result_bytes)
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        out = executor.submit(run_activity, name, json.dumps(payload)).result()
+    out['result_bytes'] = len(out['result'])
+    out['result'] = json.loads(out['result'])
+    return out
+
+
+def seed_table(dbm: DBManager, table: str, chunks) -> Dict[str, int]:
+    """
+        This function seeds the working table registers of every chunk into table (dropped and created again with
+        the column definitions and the indexes of the working table), consuming the chunks as they are generated.
+
+        Args:
+            dbm (DBManager): Working database manager
+            table (str): Benchmark table
+            chunks (iterable): Pairs of new data and seeded registers (check `benchmarks.synthetic.iter_chunks`)
+
+        Returns:
+            dict: Number of new data rows (csv_rows) and seeded registers (seeded_rows)
+    """
+    if table == WORK_TABLE:
+        raise BenchmarkTableError(f'The benchmark table is dropped on every run, it cannot be the working table {WORK_TABLE}')
+
+    columns = [col.name for col in SCHEMA] + ['MOST_RECENT']
+    dbm.execute_sql_command(f"IF OBJECT_ID('dbo.{table}') IS NOT NULL DROP TABLE dbo.{table}")
+    # Only the column definitions of the working table are copied (no rows), so its types and lengths are the real ones
+    dbm.execute_sql_command(f'SELECT TOP 0 * INTO dbo.{table} FROM dbo.{WORK_TABLE}')
+
+    insert = f'INSERT INTO {table} ({",".join(columns)}) VALUES ({",".join("?" for _ in columns)})'
+    counts = {'csv_rows': 0, 'seeded_rows': 0}
+    for new, seed in chunks:
+        counts['csv_rows'] += len(new)
+        counts['seeded_rows'] += dbm.bulk_write(insert, pa.Table.from_pandas(seed[columns], preserve_index=False))
+
+    # Same indexes as the working table, so the query plans match the ones of the pipeline
+    for _, database, _, sql in MIGRATIONS:
+        if database == 'work':
+            dbm.execute_sql_command(sql.replace('Unificado', table))
+    return counts
+
+
+def run_pipeline(csv_path: str, table: str, rows: int, seeded_rows: int) -> List[Dict[str, Any]]:
+    stages = []
+
+    def stage(name: str, payload: Any, stage_rows: int) -> Any:
+        out = run_stage(name, payload)
+        stages.append({
+            'stage': name,
+            'seconds': round(out['seconds'], 4),
+            'rows': stage_rows,
+            'rows_per_second': round(stage_rows / out['seconds'], 1) if out['seconds'] else None,
+            'base_rss_mb': out['base_rss_mb'],
+            'peak_rss_mb': out['peak_rss_mb'],
+            'result_bytes': out['result_bytes'],
+            # Blob bytes and database round-trips recorded by the activity itself
+            **{counter: out['metrics'][counter] for counter in COUNTERS if counter != 'rows'}
+        })
+        print(f'{name:<40}{out["seconds"]:>10.2f}{stage_rows:>12}{stages[-1]["rows_per_second"] or 0:>14.0f}{out["peak_rss_mb"] or 0:>12.0f}')
+        return out['result']
+
+    print(f'{"stage":<40}{"seconds":>10}{"rows":>12}{"rows/s":>14}{"peak MB":>12}')
+    # Ingest (ScheduledIngest, 'activities' pipeline mode and 'statements' ingest mode)
+    df_location = stage('RetrieveAndSaveDf', {'url': csv_path, 'spool': None, 'delimiter': DELIMITER, 'quotechar': QUOTECHAR, 'csv_engine': CSV_ENGINE}, rows)
+    df_transformed = stage('Transformations', df_location, rows)
+    db_unique_pks = stage('GetUniqueSetOfPksFromDb', table, seeded_rows)
+    df_stmts = stage('SetStmtPerNewRow', {'df': df_transformed, 'db_unique_pks': db_unique_pks}, rows)
+    statements = stage('GenerateInsUpdStmt', {'df': df_stmts['df'], 'source': df_transformed, 'table': table}, rows)
+    upload_resume = stage('UploadNewData', statements, rows)
+
+    # ModifyDB over the table as left by the ingest
+    table_rows = seeded_rows + upload_resume['insert_rows_uploaded']
+    db_config = {'database': DB, 'table': table}
+    if DEDUP_MODE == 'window':
+        stage('DedupMostRecent', {**db_config, 'full_rescan': True}, table_rows)
+    else:
+        dup_pks = stage('GetDupPksFromDb', db_config, table_rows)
+        dup_data = stage('GetRegsWithDupPks', {'db_config': db_config, 'dup_pks': dup_pks}, len(dup_pks))
+        if dup_data:
+            queries = stage('BuildUpdateQueriesForEachDupRegInBackup', {'db_config': db_config, 'dup_data': dup_data}, len(dup_data))
+            stage('UpdateBackupData', queries, len(queries))
+    return stages
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path) as f:
+        baseline = {s['stage']: s for s in json.load(f)['stages']}
+
+    print(f'\nAgainst {baseline_path}')
+    print(f'{"stage":<40}{"baseline s":>12}{"seconds":>10}{"speedup":>10}{"peak MB delta":>15}')
+    for s in results['stages']:
+        b = baseline.get(s['stage'])
+        if b is None:
+            print(f'{s["stage"]:<40}{"-":>12}{s["seconds"]:>10.2f}')
+            continue
+        rss_delta = (s['peak_rss_mb'] or 0) - (b['peak_rss_mb'] or 0)
+        print(f'{s["stage"]:<40}{b["seconds"]:>12.2f}{s["seconds"]:>10.2f}{b["seconds"] / s["seconds"]:>10.2f}{rss_delta:>15.0f}')
+
+
+def run(args: argparse.Namespace) -> None:
+    rows = SIZES[args.size]
+    results = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'size': args.size,
+        'seed': args.seed,
+        'existing_fraction': args.existing_fraction,
+        'duplicate_rate': args.duplicate_rate,
+        'csv_duplicate_rate': args.csv_duplicate_rate,
+        'table': args.table,
+        'settings': {name: os.environ.get(name) for name in SETTINGS}
+    }
+
+    try:
+        BlobManager().blob_service_client.create_container(STORAGE_CONTAINER)
+    except ResourceExistsError:
+        pass
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'nuevas_filas.csv')
+        start = time.perf_counter()
+        chunks = iter_chunks(rows, args.seed, args.existing_fraction, args.duplicate_rate, args.csv_duplicate_rate)
+
+        def write_csv():
+            for i, (new, seed) in enumerate(chunks):
+                new.to_csv(csv_path, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+                yield new, seed
+
+        results.update(seed_table(DBManager(_type=DB), args.table, write_csv()))
+        results['setup_seconds'] = round(time.perf_counter() - start, 2)
+        print(f'{results["csv_rows"]} new rows and {results["seeded_rows"]} seeded registers ready in {results["setup_seconds"]} seconds')
+
+        start = time.perf_counter()
+        results['stages'] = run_pipeline(csv_path, args.table, results['csv_rows'], results['seeded_rows'])
+        results['total_seconds'] = round(time.perf_counter() - start, 2)
+
+    output = args.output or f'pipeline_{args.size}_{datetime.now():%Y%m%d_%H%M%S}.json'
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results saved into {output}')
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=list(SIZES), default='10k')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--existing-fraction', type=float, default=EXISTING_FRACTION, help='Fraction of the new data pks already within the table')
+    parser.add_argument('--duplicate-rate', type=float, default=DUPLICATE_RATE, help='Fraction of the seeded pks with duplicated registers to deduplicate')
+    parser.add_argument('--csv-duplicate-rate', type=float, default=CSV_DUPLICATE_RATE, help='Fraction of the new data rows repeating a pk')
+    parser.add_argument('--table', default=BENCHMARK_TABLE, help='Table of the working database to seed and ingest into (dropped on every run)')
+    parser.add_argument('--output', help='Results file (pipeline_<size>_<timestamp>.json by default)')
+    parser.add_argument('--baseline', help='Results file of a previous run to compare against')
+    run(parser.parse_args())
@@ -0,0 +1,51 @@
+"""
+    Memory per row and parse time of the new data, before and after the typed schema (functions/utils/schema.py).\n
+    - legacy: every field parsed as a python string object and cast afterwards (one astype copy per field)\n
+    - typed: fields parsed straight into their dtypes (Int64 POS, float QUAL, categoricals and Arrow backed strings)
+
+    Usage (from the repository root):
+        python -m benchmarks.schema_memory --rows 1000000
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import pandas as pd
+
+from benchmarks.synthetic import build_csv
+from functions.utils.schema import read_csv_kwargs, memory_per_row
+
+LEGACY_DTYPES = {c: object for c in ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', 'MUESTRA', 'VALOR', 'ORIGEN', 'RESULTADO']}
+
+
+def legacy(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, dtype=LEGACY_DTYPES)
+    df['FECHA_COPIA'] = df['FECHA_COPIA'].astype('datetime64[ns]')
+    return df
+
+
+def typed(path: str) -> pd.DataFrame:
+    return pd.read_csv(path, **read_csv_kwargs())
+
+
+def run(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'nuevas_filas.csv')
+        build_csv(path, rows)
+
+        print(f'{"schema":<10}{"rows":>12}{"parse s":>10}{"bytes/row":>12}{"total MB":>10}')
+        for name, parse in [('legacy', legacy), ('typed', typed)]:
+            start = time.perf_counter()
+            df = parse(path)
+            elapsed = time.perf_counter() - start
+            per_row = memory_per_row(df)
+            print(f'{name:<10}{rows:>12}{elapsed:>10.2f}{per_row:>12.0f}{per_row * rows / 2**20:>10.1f}')
+            del df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+    run(args.rows)
@@ -0,0 +1,68 @@
+"""
+    Throughput benchmark for the sharded ingest (ScheduledIngest with PIPELINE_MODE=sharded).\n
+    The new data is partitioned with ShardDf.assign_shards and every shard is handled by its own process
+    (standing in for a function instance running an IngestShard activity): classification and statement building,
+    plus the upload to the working database if --upload is given (SQL_DRIVER_* environment variables required).\n
+    Rows per second are reported for every shard count.
+
+    Usage (from the repository root):
+        python -m benchmarks.shard_throughput --rows 1000000 --shards 1 2 4 8
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import pandas as pd
+
+from benchmarks.classify_rows import build_data
+from functions.ShardDf import assign_shards
+from functions.SetStmtPerNewRow import build_pk_index, label_rows, TABLE_PK, DF_SQL_STMT_COL
+from functions.GenerateInsUpdStmt import build_parameterized_statements, DF_MOST_UPDATED_COL
+
+TABLE = 'Unificado'
+
+
+def ingest_shard(df: pd.DataFrame, db_unique_pks: List[tuple], upload: bool) -> Dict[str, int]:
+    df_stmts = df[TABLE_PK].copy()
+    label_rows(df_stmts, build_pk_index(db_unique_pks))
+    df[DF_MOST_UPDATED_COL] = 1
+    statements = build_parameterized_statements(TABLE, TABLE_PK, df, df_stmts.loc[df_stmts[DF_SQL_STMT_COL] == 'update', TABLE_PK])
+
+    if upload:
+        from functions.utils.db_manager import DBManager
+        from functions.UploadNewData import upload_statements
+        return upload_statements(DBManager(_type='work'), statements)
+    return {'update_rows_uploaded': len(statements['update']['columns']['ID']), 'insert_rows_uploaded': len(statements['insert']['columns']['ID'])}
+
+
+def run(rows: int, shard_counts: List[int], upload: bool) -> None:
+    df, db_unique_pks = build_data(rows)
+    df['FECHA_COPIA'] = pd.Timestamp.now()
+    df['INFO'] = 'DP=10;AF=0.5'
+    db_pks = pd.DataFrame(db_unique_pks, columns=TABLE_PK)
+
+    print(f'{"shards":>8}{"rows":>12}{"seconds":>12}{"rows/s":>14}')
+    for shard_count in shard_counts:
+        start = time.perf_counter()
+        shards = assign_shards(df, shard_count)
+        db_shards = assign_shards(db_pks, shard_count)
+        with ProcessPoolExecutor(max_workers=shard_count) as executor:
+            futures = [
+                executor.submit(ingest_shard, df[shards == i].copy(), [tuple(pk) for pk in db_pks[db_shards == i].values], upload)
+                for i in range(shard_count)
+            ]
+            resumes = [f.result() for f in futures]
+        elapsed = time.perf_counter() - start
+
+        inserted = sum(r['insert_rows_uploaded'] for r in resumes)
+        print(f'{shard_count:>8}{inserted:>12}{elapsed:>12.3f}{inserted / elapsed:>14.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--upload', action='store_true', help='Upload every shard to the working database')
+    args = parser.parse_args()
+    run(args.rows, args.shards, args.upload)
@@ -0,0 +1,101 @@
+"""
+    Before/after benchmark for the statement building stage.\n
+    - legacy: every value quoted with `.map("'{}'".format)` and one literal INSERT/UPDATE string rendered per row with
+      `df.agg(str.format, axis=1)` (the former SetStmtPerNewRow + GenerateInsUpdStmt code)\n
+    - columnar: `GenerateInsUpdStmt.build_parameterized_statements` (typed parameter arrays, as used by the fused and
+      sharded pipelines), plus `to_json_columns` (the payload returned by the GenerateInsUpdStmt activity)\n
+    Both end up with what is sent to the database: the legacy engine with the statement strings and the columnar one
+    with the parameter rows of every `executemany` batch (`db_manager.iter_row_batches`, as `DBManager.bulk_write` does)
+
+    Usage (from the repository root):
+        python -m benchmarks.statement_building --rows 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from functions.GenerateInsUpdStmt import build_parameterized_statements, to_json_columns, TABLE_PK, DF_MOST_UPDATED_COL
+from functions.utils.db_manager import iter_row_batches, BULK_ROWS_PER_BATCH
+
+TABLE = 'Unificado'
+UPDATE_FRACTION = 0.3
+
+
+def build_data(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CHROM': np.char.add('chr', rng.integers(1, 23, rows).astype(str)),
+        'POS': rng.integers(1, 250_000_000, rows).astype(str),
+        'ID': np.char.add('rs', np.arange(rows).astype(str)),
+        'REF': rng.choice(['A', 'C', 'G', 'T'], rows),
+        'ALT': rng.choice(['A', 'C', 'G', 'T'], rows),
+        'QUAL': rng.integers(0, 100, rows).astype(str),
+        'FILTER': 'PASS',
+        'INFO': np.char.add('DP=', rng.integers(1, 100, rows).astype(str)),
+        'FORMAT': 'GT:AD:DP',
+        'MUESTRA': np.char.add('M', rng.integers(0, 1000, rows).astype(str)),
+        'VALOR': rng.choice(['0/1', '1/1', '0/0'], rows),
+        'ORIGEN': 'LAB',
+        'FECHA_COPIA': pd.Timestamp.now(),
+        'RESULTADO': rng.choice(['POS', 'NEG'], rows),
+    })
+
+
+def legacy(df: pd.DataFrame, is_update: np.ndarray) -> int:
+    df = df.copy()
+    df['sql_stmt'] = np.where(is_update, 'update', 'insert')
+    df[DF_MOST_UPDATED_COL] = 1
+    for c in df.select_dtypes(include=['object', 'string']).columns:
+        if c == 'sql_stmt':
+            continue
+        df[c] = df[c].map("'{}'".format)
+    for c in df.select_dtypes(include=['datetime64']).columns:
+        df[c] = df[c].map("CAST('{}' AS DATETIME2)".format)
+
+    cols = [c for c in df.columns if c != 'sql_stmt']
+    agg_str = '(' + ','.join('{0[' + c + ']}' for c in cols) + ')'
+    df['insert_stmt'] = df.agg(agg_str.format, axis=1)
+
+    insert_str_fmt = f'INSERT INTO {TABLE} ({",".join(cols)}) VALUES ' + '{0[insert_stmt]};'
+    update_str_fmt = f'UPDATE {TABLE} SET MOST_RECENT=0 WHERE ' + ' AND '.join(c + '={0[' + c + ']}' for c in TABLE_PK) + ';'
+    ins = df.agg(insert_str_fmt.format, axis=1).tolist()
+    upd = df.loc[df['sql_stmt'] == 'update'].agg(update_str_fmt.format, axis=1).tolist()
+    return len(ins) + len(upd)
+
+
+def columnar(df: pd.DataFrame, is_update: np.ndarray, json_payload: bool) -> int:
+    df = df.copy()
+    df[DF_MOST_UPDATED_COL] = 1
+    statements = build_parameterized_statements(TABLE, TABLE_PK, df, df.loc[is_update, TABLE_PK])
+    rows = 0
+    for stmt in statements.values():
+        columns = to_json_columns(stmt['columns']) if json_payload else stmt['columns']
+        # Parameter rows are materialized batch by batch, as they are bound by the writer
+        for batch in iter_row_batches(columns, BULK_ROWS_PER_BATCH):
+            rows += len(batch)
+    return rows
+
+
+def run(rows: int) -> None:
+    df = build_data(rows)
+    is_update = np.random.default_rng(1).random(rows) < UPDATE_FRACTION
+
+    print(f'{"engine":<22}{"rows":>12}{"seconds":>12}{"rows/s":>14}')
+    for name, func in [
+        ('columnar (arrays)', lambda: columnar(df, is_update, json_payload=False)),
+        ('columnar (json lists)', lambda: columnar(df, is_update, json_payload=True)),
+        ('legacy (row-wise agg)', lambda: legacy(df, is_update)),
+    ]:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        print(f'{name:<22}{rows:>12}{elapsed:>12.3f}{rows / elapsed:>14.0f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+    run(args.rows)
@@ -0,0 +1,140 @@
+"""
+    Synthetic Unificado-shaped data for the benchmarks (VCF-like fields, in the csv order of `utils.schema`).\n
+    Every row of the new data gets its own composed pk (ID, MUESTRA, RESULTADO), besides:\n
+    - existing_fraction: fraction of the new data pks also seeded into the working table (with an older FECHA_COPIA),
+      so they are classified as updates\n
+    - csv_duplicate_rate: fraction of the new data rows repeating the pk of the previous row (re-sent registers)\n
+    - duplicate_rate: fraction of the seeded pks not present within the new data that are seeded DUPLICATE_COPIES
+      times with no MOST_RECENT register, so the ModifyDB chain has groups to deduplicate\n
+    Data is generated in chunks (every chunk with its own random generator), so the same arguments always produce
+    the same data and 10M rows can be written without holding them in memory.
+
+    Usage (from the repository root):
+        python -m benchmarks.synthetic --size 1m --output nuevas_filas.csv
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from functions.utils.schema import pandas_dtypes
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+CHUNK_ROWS = 500_000
+EXISTING_FRACTION = 0.3
+CSV_DUPLICATE_RATE = 0.01
+DUPLICATE_RATE = 0.05
+DUPLICATE_COPIES = 3
+# FECHA_COPIA of the seeded registers (older than any ingest, so the new data is always the most recent)
+SEED_COPY_DATE = datetime(2021, 1, 1)
+TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
+
+
+def new_data_chunk(start: int, rows: int, rng: np.random.Generator, csv_duplicate_rate: float = CSV_DUPLICATE_RATE) -> pd.DataFrame:
+    """
+        This function generates rows [start, start + rows) of the new data, as found within the source csv
+        (missing QUAL marked with '.' and an empty FECHA_COPIA, filled up by `Transformations`).
+
+        Args:
+            start (int): Index of the first row (IDs are unique across chunks)
+            rows (int): Number of rows
+            rng (np.random.Generator): Random generator of the chunk
+            csv_duplicate_rate (float, default=CSV_DUPLICATE_RATE): Fraction of rows repeating the pk of the previous row
+
+        Returns:
+            pd.DataFrame: New data chunk (every field as a string, but POS)
+    """
+    df = pd.DataFrame({
+        'CHROM': np.char.add('chr', rng.integers(1, 23, rows).astype(str)),
+        'POS': rng.integers(1, 250_000_000, rows),
+        'ID': np.char.add('rs', np.arange(start, start + rows).astype(str)),
+        'REF': rng.choice(['A', 'C', 'G', 'T', 'AT', 'GC'], rows),
+        'ALT': rng.choice(['A', 'C', 'G', 'T', 'ATT', '<DEL>'], rows),
+        'QUAL': np.where(rng.random(rows) < 0.1, '.', rng.uniform(0, 100, rows).round(2).astype(str)),
+        'FILTER': rng.choice(['PASS', 'LowQual'], rows),
+        'INFO': np.char.add('DP=', rng.integers(1, 100, rows).astype(str)),
+        'FORMAT': 'GT:AD:DP:GQ:PL',
+        'MUESTRA': np.char.add('M', rng.integers(0, 1000, rows).astype(str)),
+        'VALOR': rng.choice(['0/1', '1/1', '0/0'], rows),
+        'ORIGEN': rng.choice(['LAB1', 'LAB2'], rows),
+        'FECHA_COPIA': '',
+        'RESULTADO': rng.choice(['POS', 'NEG'], rows),
+    })
+
+    dup = np.flatnonzero(rng.random(rows) < csv_duplicate_rate)
+    dup = dup[dup > 0]
+    for col in TABLE_PK:
+        values = df[col].to_numpy()
+        values[dup] = values[dup - 1]
+        df[col] = values
+    return df
+
+
+def seed_chunk(new: pd.DataFrame, rng: np.random.Generator, existing_fraction: float = EXISTING_FRACTION,
+               duplicate_rate: float = DUPLICATE_RATE) -> pd.DataFrame:
+    """
+        This function generates the working table registers for a new data chunk: the matched pks (existing_fraction
+        of the chunk rows, one MOST_RECENT register each) and as many pks not present within the new data, duplicate_rate
+        of them seeded DUPLICATE_COPIES times with no MOST_RECENT register.
+
+        Args:
+            new (pd.DataFrame): New data chunk (check `new_data_chunk`)
+            rng (np.random.Generator): Random generator of the chunk
+            existing_fraction (float, default=EXISTING_FRACTION): Fraction of the new data pks within the working table
+            duplicate_rate (float, default=DUPLICATE_RATE): Fraction of the unmatched pks with duplicated registers
+
+        Returns:
+            pd.DataFrame: Registers typed as the working table (schema columns plus MOST_RECENT)
+    """
+    matched = new.loc[rng.random(len(new)) < existing_fraction].copy()
+    matched['FECHA_COPIA'] = SEED_COPY_DATE
+    matched['MOST_RECENT'] = True
+
+    unmatched = matched.assign(ID=matched['ID'] + 'x')
+    dup = rng.random(len(unmatched)) < duplicate_rate
+    copies = [unmatched.loc[~dup]]
+    for i in range(DUPLICATE_COPIES):
+        copies.append(unmatched.loc[dup].assign(FECHA_COPIA=SEED_COPY_DATE - timedelta(days=i + 1), MOST_RECENT=False))
+
+    seed = pd.concat([matched] + copies, ignore_index=True)
+    seed['QUAL'] = seed['QUAL'].replace('.', np.nan)
+    return seed.astype({**pandas_dtypes(), 'MOST_RECENT': bool})
+
+
+def iter_chunks(rows: int, seed: int = 0, existing_fraction: float = EXISTING_FRACTION, duplicate_rate: float = DUPLICATE_RATE,
+                csv_duplicate_rate: float = CSV_DUPLICATE_RATE, chunk_rows: int = CHUNK_ROWS) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+        This function generates the new data along with the working table registers, chunk by chunk.
+
+        Args:
+            rows (int): Number of new data rows
+            seed (int, default=0): Seed of the random generators (the same seed produces the same data)
+            existing_fraction (float, default=EXISTING_FRACTION): Check `seed_chunk`
+            duplicate_rate (float, default=DUPLICATE_RATE): Check `seed_chunk`
+            csv_duplicate_rate (float, default=CSV_DUPLICATE_RATE): Check `new_data_chunk`
+            chunk_rows (int, default=CHUNK_ROWS): Number of new data rows per chunk
+
+        Yields:
+            tuple: New data chunk (as written to the csv) and its working table registers
+    """
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        rng = np.random.default_rng([seed, i])
+        new = new_data_chunk(start, min(chunk_rows, rows - start), rng, csv_duplicate_rate)
+        yield new, seed_chunk(new, rng, existing_fraction, duplicate_rate)
+
+
+def build_csv(path: str, rows: int, seed: int = 0, **kwargs) -> None:
+    # Only the new data is written (kwargs as `iter_chunks`)
+    for i, (new, _) in enumerate(iter_chunks(rows, seed, **kwargs)):
+        new.to_csv(path, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=list(SIZES), default='1m')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='nuevas_filas.csv')
+    args = parser.parse_args()
+    build_csv(args.output, SIZES[args.size], args.seed)
@@ -2,6 +2,8 @@ import logging
 from datetime import datetime
 from typing import Dict, List
 
+from ..utils.metrics import metered, record_rows
+
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
 PK_CONFIG = {
     'ID': {'type': 'str', 'index': 0},
@@ -30,6 +32,7 @@ def build_update_stmt(pk: List[str], table: str, date: str, is_most_recent: bool
     q_string = f'UPDATE {table} SET MOST_RECENT={imr} WHERE {_where}'
     return q_string
 
+@metered
 def main(kwargs: Dict[Dict[str, str], List[List[list]]]) -> bool:
     """
         This activity generates a query string for every most recent tuple
@@ -59,5 +62,6 @@ def main(kwargs: Dict[Dict[str, str], List[List[list]]]) -> bool:
         is_most_recent = True
             
         queries.append(build_update_stmt(pk, kwargs['db_config']['table'], date, is_most_recent))
+    record_rows(len(queries))
 
     return queries
@@ -1,21 +1,47 @@
 import os
-import pyodbc
 import logging
+from typing import Dict, List, Optional
 
+from ..utils import hash_cache
 from ..utils.db_manager import DBManager
+from ..utils.metrics import metered
 
-def main(currentHash: str) -> bool:
+# Backed by the IX_Executions_file_hash index (check tools/migrate.py)
+HASH_EXISTS_QUERY = 'SELECT CASE WHEN EXISTS (SELECT 1 FROM Executions WHERE file_hash IN ({placeholders})) THEN 1 ELSE 0 END'
+
+def discard_spool(spool: Optional[str]) -> None:
+    # The spool file is only read by the ingest, which will not run (it is named after its digest, so it may not exist within this worker)
+    if spool and os.path.exists(spool):
+        os.remove(spool)
+        logging.debug(f'Spool file {spool} removed')
+
+@metered
+def main(kwargs: Dict[str, List[str]]) -> bool:
     """
-        This activity checks if the current hash was already loaded in the database.
+        This activity checks if the current blob was already loaded in the database.\n
+        Hashes already known by this worker are answered without querying the database.
+        If the blob was already loaded, its spool file is removed.
 
         Args:
-            currentHash (str): Hash of the current blob
+            kwargs (dict): In binding with schema:
+                - hashes (list): Digests of the current blob (raw and legacy digests, check `GetBlobHash`). None items are ignored
+                - spool (str, optional): Local spool file written by `GetBlobHash`
         
         Returns:
-            bool: True if the current hash exists within loaded hashes, otherwise False
+            bool: True if any of the current hashes exists within loaded hashes, otherwise False
     """
-    dbm = DBManager(_type='test')
+    hashes = list(dict.fromkeys(h for h in kwargs['hashes'] if h))
 
-    unique_hashes_already_loaded = [t[0] for t in dbm.execute_sql_command("SELECT DISTINCT file_hash FROM Executions", ret=True)]
+    if any(hash_cache.is_known(h) for h in hashes):
+        logging.debug(f'Hash {hashes} found in worker cache')
+        already_loaded = True
+    else:
+        dbm = DBManager(_type='test')
+        query = HASH_EXISTS_QUERY.format(placeholders=','.join('?' for _ in hashes))
+        already_loaded = bool(dbm.execute_sql_command(query, ret=True, params=hashes)[0][0])
 
-    return True if currentHash in unique_hashes_already_loaded else False
+    if already_loaded:
+        for h in hashes:
+            hash_cache.remember(h)
+        discard_spool(kwargs.get('spool'))
+    return already_loaded
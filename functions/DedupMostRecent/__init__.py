@@ -0,0 +1,202 @@
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple, Union
+
+import pyodbc
+
+from ..utils.db_manager import DBManager
+from ..utils.metrics import metered, record_rows
+
+TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
+# Maximum number of distinct IDs whose groups are deduplicated (and commited) at once
+DEDUP_CHUNK_IDS = int(os.environ.get('DEDUP_CHUNK_IDS', 50000))
+# Session temporary table the composed pks loaded since the last watermark are gathered into
+TOUCHED_PKS_TEMP_TABLE = '#touched_pks'
+
+def build_range_clause(lower: Optional[str], alias: str = 't') -> str:
+    # The first chunk has no lower bound
+    return f'{alias}.ID <= ?' if lower is None else f'{alias}.ID > ? AND {alias}.ID <= ?'
+
+def build_ranked_update(source: str, where: str = '') -> str:
+    # Window functions rank every group once: ROW_NUMBER() picks the latest register, COUNT() keeps the
+    # duplicated groups only and MAX(MOST_RECENT) skips the groups with a register already marked
+    _partition = ','.join(f't.{pk}' for pk in TABLE_PK)
+    return f"""
+        WITH ranked AS (
+            SELECT
+                t.MOST_RECENT,
+                ROW_NUMBER() OVER (PARTITION BY {_partition} ORDER BY t.FECHA_COPIA DESC) AS rn,
+                COUNT(*) OVER (PARTITION BY {_partition}) AS regs,
+                ISNULL(MAX(CAST(t.MOST_RECENT AS INT)) OVER (PARTITION BY {_partition}), 0) AS marked
+            FROM {source}
+            {where}
+        )
+        UPDATE ranked SET MOST_RECENT=1 WHERE rn=1 AND regs>1 AND marked=0
+    """
+
+def build_dedup_stmt(table: str, lower: Optional[str]) -> str:
+    """
+        This function builds the set-based statement that marks the latest register (by FECHA_COPIA) of every
+        duplicated composed pk within an ID range as MOST_RECENT, skipping the composed pks for which a
+        register is already marked.\n
+        The groups are ranked with window functions, so every register is read once.
+
+        Args:
+            table (str): SQL table name
+            lower (str, optional): Exclusive lower bound of the ID range (None for the first chunk)
+
+        Returns:
+            str: Parameterized update statement (bound to the range bounds)
+    """
+    return build_ranked_update(f'{table} t', f'WHERE {build_range_clause(lower)}')
+
+def build_touched_pks_stmt(table: str, bounded: bool) -> str:
+    # Composed pks with registers loaded after the watermark (and up to the high-water mark, if bounded)
+    _where = 'FECHA_COPIA > ?' + (' AND FECHA_COPIA <= ?' if bounded else '')
+    return f'SELECT DISTINCT {",".join(TABLE_PK)} INTO {TOUCHED_PKS_TEMP_TABLE} FROM {table} WHERE {_where}'
+
+def build_touched_dedup_stmt(table: str) -> str:
+    # Set-based deduplication of the composed pks loaded into TOUCHED_PKS_TEMP_TABLE only
+    _join = ' AND '.join(f't.{pk}=k.{pk}' for pk in TABLE_PK)
+    return build_ranked_update(f'{table} t INNER JOIN {TOUCHED_PKS_TEMP_TABLE} k ON {_join}')
+
+def next_upper_bound(curr: pyodbc.Cursor, table: str, lower: Optional[str], chunk_ids: int) -> Optional[str]:
+    # Keyset pagination over the distinct IDs (every group of a composed pk falls within a single range)
+    if lower is None:
+        curr.execute(f'SELECT MAX(ID) FROM (SELECT DISTINCT TOP (?) ID FROM {table} ORDER BY ID) c', chunk_ids)
+    else:
+        curr.execute(f'SELECT MAX(ID) FROM (SELECT DISTINCT TOP (?) ID FROM {table} WHERE ID > ? ORDER BY ID) c', chunk_ids, lower)
+    return curr.fetchone()[0]
+
+def dedup_by_ranges(dbm: DBManager, table: str, chunk_ids: int = DEDUP_CHUNK_IDS) -> int:
+    """
+        This function runs the set-based deduplication (check `build_dedup_stmt`) over consecutive ID ranges
+        of, at most, chunk_ids distinct IDs, commiting every range on its own (so locks and transaction log
+        usage are bounded by the chunk size).
+
+        Args:
+            dbm (DBManager): Database manager for the desired database
+            table (str): SQL table name
+            chunk_ids (int, default=DEDUP_CHUNK_IDS): Maximum number of distinct IDs per range
+
+        Returns:
+            int: Number of registers marked as MOST_RECENT (one per fixed duplicated composed pk)
+    """
+    updated = 0
+    lower = None
+    with dbm.connection() as conn, conn.cursor() as curr:
+        while True:
+            upper = next_upper_bound(curr, table, lower, chunk_ids)
+            if upper is None:
+                break
+
+            params = (upper,) if lower is None else (lower, upper)
+            curr.execute(build_dedup_stmt(table, lower), *params)
+            logging.debug(f'{curr.rowcount} registers marked as MOST_RECENT for IDs in ({lower}, {upper}]')
+            updated += curr.rowcount
+            curr.commit()
+
+            lower = upper
+
+    return updated
+
+def dedup_since(dbm: DBManager, table: str, since: datetime, until: Optional[datetime]) -> int:
+    """
+        This function runs the set-based deduplication only over the composed pks with registers loaded after
+        the since watermark (and up to until, if provided), as only those can have new duplicates.\n
+        The composed pks are gathered into a session temporary table and joined against table, so the cost
+        depends on the size of the loads since the watermark instead of the size of table.
+
+        Args:
+            dbm (DBManager): Database manager for the desired database
+            table (str): SQL table name
+            since (datetime): Exclusive lower bound for FECHA_COPIA
+            until (datetime, optional): Inclusive upper bound for FECHA_COPIA
+
+        Returns:
+            int: Number of registers marked as MOST_RECENT
+    """
+    params = (since, until) if until else (since,)
+
+    with dbm.connection() as conn, conn.cursor() as curr:
+        curr.execute(build_touched_pks_stmt(table, bool(until)), *params)
+        logging.debug(f'{curr.rowcount} composed pks loaded since {since}')
+
+        curr.execute(build_touched_dedup_stmt(table))
+        updated = curr.rowcount
+        curr.execute(f'DROP TABLE {TOUCHED_PKS_TEMP_TABLE}')
+        curr.commit()
+
+    return updated
+
+def get_watermarks(dbm_logs: DBManager, dbm: DBManager, table: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+        This function retrieves the watermark recorded by the last dedup run over table and the FECHA_COPIA
+        high-water mark recorded by the last ingest into it (or the one within table, if the ingest did not record it).\n
+        Both are recorded per table, so deduplicating another table (e.g. a benchmark copy) does not move them.
+
+        Args:
+            dbm_logs (DBManager): Database manager for the logging database
+            dbm (DBManager): Database manager for the desired database
+            table (str): SQL table name
+
+        Returns:
+            tuple: Last dedup watermark (None if unknown) and current high-water mark
+    """
+    try:
+        r = dbm_logs.execute_sql_command('SELECT TOP 1 watermark FROM DedupRuns WHERE table_name = ? ORDER BY run_date DESC', ret=True, params=(table,))
+        watermark = r[0][0] if r else None
+        high_mark = dbm_logs.execute_sql_command('SELECT MAX(max_copy_date) FROM Executions WHERE table_name = ?', ret=True, params=(table,))[0][0]
+    except pyodbc.Error as e:
+        logging.warning(f'Dedup watermarks could not be retrieved from logging database, the whole table will be rescanned: {e}')
+        watermark, high_mark = None, None
+
+    if high_mark is None:
+        high_mark = dbm.execute_sql_command(f'SELECT MAX(FECHA_COPIA) FROM {table}', ret=True)[0][0]
+    return watermark, high_mark
+
+def save_dedup_run(dbm_logs: DBManager, table: str, watermark: Optional[datetime], full_rescan: bool, rows_updated: int) -> None:
+    run = {'id': str(uuid.uuid4()), 'run_date': datetime.now(), 'table_name': table, 'watermark': watermark, 'full_rescan': full_rescan, 'rows_updated': rows_updated}
+    insert_run = 'INSERT INTO DedupRuns ({cols}) VALUES ({placeholders})'.format(cols=','.join(run), placeholders=','.join('?' for _ in run))
+    try:
+        dbm_logs.bulk_write(insert_run, {col: [value] for col, value in run.items()})
+    except pyodbc.Error as e:
+        # The dedup is already commited. Without this run, the next one starts from the previous watermark (or rescans the whole table)
+        logging.warning(f'Dedup run could not be saved within logging database: {e}')
+
+@metered
+def main(kwargs: Dict[str, Union[str, bool]]) -> Dict[str, int]:
+    """
+        This activity is the set-based alternative to the `GetDupPksFromDb` -> `GetRegsWithDupPks` ->
+        `BuildUpdateQueriesForEachDupRegInBackup` -> `UpdateBackupData` chain: the latest register of every duplicated
+        composed pk without a MOST_RECENT register is marked within SQL Server, without retrieving any group.\n
+        Only the composed pks loaded after the watermark of the last dedup run are re-evaluated (check `dedup_since`).
+        The whole table is rescanned, range by range, if full_rescan is requested or no watermark was recorded yet.
+        The FECHA_COPIA high-water mark is recorded as the watermark for the next run over table (DedupRuns table).
+
+        Args:
+            kwargs (dict): In binding with schema:
+                database (str): Type of database wanted to initialize a new DBManager instance
+                table (str): Desired table to deduplicate within selected database
+                full_rescan (bool, optional): If True, every composed pk within table is re-evaluated
+
+        Returns:
+            dict: A dictionary with the number of updated registers (as `UpdateBackupData`)
+    """
+    dbm = DBManager(_type=kwargs['database'])
+    dbm_logs = DBManager(_type='test')
+    watermark, high_mark = get_watermarks(dbm_logs, dbm, kwargs['table'])
+
+    full_rescan = bool(kwargs.get('full_rescan')) or watermark is None
+    if full_rescan:
+        logging.info(f'Deduplicating the whole {kwargs["table"]} table')
+        updated = dedup_by_ranges(dbm, kwargs['table'])
+    else:
+        logging.info(f'Deduplicating the composed pks loaded into {kwargs["table"]} since {watermark}')
+        updated = dedup_since(dbm, kwargs['table'], watermark, high_mark)
+
+    save_dedup_run(dbm_logs, kwargs['table'], high_mark or watermark, full_rescan, updated)
+    record_rows(updated)
+    return {'update_rows_uploaded': updated}
@@ -0,0 +1,131 @@
+import logging
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Union
+
+import pyodbc
+import pandas as pd
+
+from ..utils.blob_manager import BlobManager, STORAGE_CONTAINER
+from ..utils.db_manager import DBManager
+from ..RetrieveAndSaveDf import read_source, iter_source
+from ..Transformations import apply_transformations
+from ..GetUniqueSetOfPksFromDb import query_unique_pks
+from ..SetStmtPerNewRow import build_pk_index, label_rows, TABLE_PK, DF_SQL_STMT_COL
+from ..GenerateInsUpdStmt import build_parameterized_statements, DF_MOST_UPDATED_COL
+from ..UploadNewData import upload_statements
+from ..UpsertFromStaging import upsert_through_staging
+from ..utils.metrics import metered, record_rows
+
+
+def save_checkpoint(bm: Optional[BlobManager], df: pd.DataFrame, filename: str) -> None:
+    # Intermediate results are only written to blob storage when checkpoints are requested (debugging purposes)
+    if bm is not None:
+        logging.debug(f'Saving checkpoint {filename}')
+        bm.upload_by_chunks(df, STORAGE_CONTAINER, filename)
+
+def ingest_df(dbm: DBManager, bm: Optional[BlobManager], df: pd.DataFrame, kwargs: Dict[str, Union[str, bool]],
+              db_pks: Optional[pd.MultiIndex] = None, suffix: str = '', conn: Optional[pyodbc.Connection] = None) -> Dict[str, int]:
+    """
+        This function classifies, builds the statements for and uploads transformed new data
+        (or upserts it through a staging table in 'staging' ingest mode).
+
+        Args:
+            dbm (DBManager): Database manager for the working database
+            bm (BlobManager, optional): Blob manager to save checkpoints with (None if checkpoints are not requested)
+            df (pd.DataFrame): Transformed new data
+            kwargs (dict): Activity parameters (check `main`)
+            db_pks (pd.MultiIndex, optional): Index built over the composed pks within database with `build_pk_index`
+                ('statements' ingest mode). Only the rows of df are probed against it, so it is built once for every chunk
+            suffix (str): Suffix for the checkpoints filenames
+            conn (pyodbc.Connection, optional): Opened connection to upload through ('statements' ingest mode). If provided,
+                nothing is commited and the caller handles the transaction
+
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows
+    """
+    save_checkpoint(bm, df, f'df_transformed{suffix}.ftr')
+
+    if kwargs['ingest_mode'] == 'staging':
+        return upsert_through_staging(dbm, kwargs['table'], df)
+
+    df_stmts = df[TABLE_PK].copy()
+    label_rows(df_stmts, db_pks)
+    save_checkpoint(bm, df_stmts, f'df_stmts{suffix}.ftr')
+
+    # All the new registers are the most recent ones (check `GenerateInsUpdStmt`)
+    df[DF_MOST_UPDATED_COL] = 1
+    statements = build_parameterized_statements(kwargs['table'], TABLE_PK, df, df_stmts.loc[df_stmts[DF_SQL_STMT_COL] == 'update', TABLE_PK])
+
+    return upload_statements(dbm, statements, conn)
+
+def transformed_chunks(bm: Optional[BlobManager], kwargs: Dict[str, Union[str, bool]], copy_date: datetime) -> Iterator[pd.DataFrame]:
+    for i, chunk in enumerate(iter_source(kwargs, kwargs['chunk_rows'])):
+        logging.debug(f'Ingesting chunk {i} ({len(chunk)} rows)')
+        record_rows(len(chunk))
+        save_checkpoint(bm, chunk, f'df_{i}.ftr')
+        df = apply_transformations(chunk, copy_date)
+        if kwargs['ingest_mode'] == 'staging':
+            # `ingest_df` saves it otherwise
+            save_checkpoint(bm, df, f'df_transformed_{i}.ftr')
+        yield df
+
+@metered
+def main(kwargs: Dict[str, Union[str, bool]]) -> Dict[str, int]:
+    """
+        This activity runs the whole ingest pipeline within a single activity, handing the dataframe
+        over in memory between stages instead of saving and retrieving it from blob storage:\n
+        `RetrieveAndSaveDf` -> `Transformations` -> `GetUniqueSetOfPksFromDb` -> `SetStmtPerNewRow` ->
+        `GenerateInsUpdStmt` -> `UploadNewData` (or `UpsertFromStaging` in 'staging' ingest mode).\n
+        The intermediate feather files (df.ftr, df_transformed.ftr, df_stmts.ftr) are only written if checkpoint is set.\n
+        If chunk_rows is set, the csv is streamed in chunks and every chunk goes through all the stages (and is uploaded)
+        before the next one is read, so the memory used depends on the chunk size instead of the file size.
+        Every chunk is uploaded within the same transaction, commited once the last one is uploaded (in 'staging'
+        ingest mode every chunk is loaded into the staging table and classified at once, check `upsert_through_staging`),
+        so a failed chunk leaves nothing loaded and the whole source is ingested again on the next run.
+        The counts of every chunk are added up.
+
+        Args:
+            kwargs (dict): In binding with schema:
+                - url (str): Remote data url
+                - spool (str, optional): Local spool file written by `GetBlobHash`
+                - delimiter (str): Remote data delimiter
+                - quotechar (str): Remote data quotechar
+                - csv_engine (str, optional): 'pandas' or 'arrow' csv parser
+                - table (str): SQL table name
+                - ingest_mode (str): 'statements' or 'staging' (check the `ScheduledIngest` orchestrator)
+                - checkpoint (bool): If True, intermediate results are saved within blob storage
+                - chunk_rows (int, optional): Number of csv rows per chunk (the whole csv is read at once if not provided)
+
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows
+    """
+    bm = BlobManager() if kwargs.get('checkpoint') else None
+    dbm = DBManager(_type='work')
+
+    db_pks = None
+    if kwargs['ingest_mode'] != 'staging':
+        db_pks = build_pk_index(query_unique_pks(dbm, kwargs['table']))
+
+    if not kwargs.get('chunk_rows'):
+        df = read_source(kwargs)
+        record_rows(len(df))
+        save_checkpoint(bm, df, 'df.ftr')
+        return ingest_df(dbm, bm, apply_transformations(df), kwargs, db_pks)
+
+    # Every chunk gets the same copy date, as all of them belong to the same load
+    copy_date = datetime.now()
+    chunks = transformed_chunks(bm, kwargs, copy_date)
+    if kwargs['ingest_mode'] == 'staging':
+        return upsert_through_staging(dbm, kwargs['table'], chunks)
+
+    resume = {'update_rows_uploaded': 0, 'insert_rows_uploaded': 0}
+    with dbm.connection() as conn:
+        for i, chunk in enumerate(chunks):
+            chunk_resume = ingest_df(dbm, bm, chunk, kwargs, db_pks, suffix=f'_{i}', conn=conn)
+            for k in resume:
+                resume[k] += chunk_resume[k]
+
+        conn.commit()
+    logging.debug('Every chunk commited')
+
+    return resume
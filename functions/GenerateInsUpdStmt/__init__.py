@@ -1,79 +1,181 @@
+import os
+import math
 import logging
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from typing import Dict, Union, List, Tuple
 
 from ..utils.blob_manager import BlobManager
+from ..utils.db_manager import max_rows_per_values
+from ..utils.claim_check import check_in
+from ..utils.metrics import metered, record_rows
 
 TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
+DF_SQL_STMT_COL = 'sql_stmt'
+DF_MOST_UPDATED_COL = 'MOST_RECENT'
+# %S renders the fractional seconds of microsecond timestamps (DATETIME2 accepts up to 7 fractional digits)
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 'executemany': one single-row insert bound per row; 'multirow': several rows packed per insert (multi-row VALUES)
+INSERT_STRATEGIES = ('executemany', 'multirow')
+INSERT_STRATEGY = os.environ.get('INSERT_STRATEGY', 'executemany')
+# Session temporary table the composed pks to update are bulk loaded into (check `UploadNewData`)
+UPDATE_PKS_TEMP_TABLE = '#update_pks'
+
+
+class InsertStrategyError(Exception):
+    pass
+
 
 def build_df_upd_ins_str_format(cols: Union[List[str], Tuple[str]], sep: str = ',') -> str:
     """
         This function recreates the insert or update sections used by the SET, WHERE, INTO and VALUES SQL commands.\n
-        The recreated format satisfies the interface provided by Pandas, since DataFrame is the data structure used in this solution.\n 
-        The format will be '{0[<col_name>]}'\n
+        Every column is bound to a `?` parameter marker, so the values travel apart from the statement text.\n
         The final format will be:\n
-        \t- 'col_name = {0[<col_name>]}, col_name = {0[<col_name>]}, ...'\n
-        Every {0[<col_name>]} will take the value of the column indicated for every row in where the format is rendered.
+        \t- 'col_name=?, col_name=?, ...'
 
         Args:
             cols (list, tuple): An iterable with all the column names for which the format string will be rendered
             sep (str): The string used for join every format string into the final format to return
 
         Returns:
-            str: Fully format string to build a SQL query string
+            str: Fully format string to build a parameterized SQL query string
+    """
+    return sep.join(col + '=?' for col in cols)
+
+def to_param_arrays(df: pd.DataFrame) -> pa.Table:
     """
-    aux = []
-    for col in cols:
-        aux.append(col + '={0[' + col + ']}')
+        This function converts the dataframe columns into typed (Arrow) parameter arrays, column by column
+        and without any per-row Python call. Missing values become nulls (bound as SQL NULL).
 
-    return sep.join(aux)
+        Args:
+            df (pd.DataFrame): Values to bind
 
-def build_proper_statement_for_each_row_in(table: str, pks: list, df: pd.DataFrame) -> pd.DataFrame:
+        Returns:
+            pa.Table: A table with a typed array per column
     """
-        This functions generates the insert or update query for each row in a dataframe.\n
-        Una fila puede contener o un insert o un update.\n
-        Every row will contain an insert query, and the ones previously identified will also have an update one.\n
-        El dataframe objetivo debería tener un formato tal que:\n
-        The argument dataframe should have an schema like (check the `SetStmtPerNewRow` activity function):
-            +-------------------+-------------+----------------------------------------------+-------------+\n
-            | <original fields> | MOST_RECENT | sql_stmt (agregada con check_pk_duplication) | insert_stmt |\n
-            +-------------------+-------------+----------------------------------------------+-------------+\n
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def to_json_columns(table: pa.Table) -> Dict[str, list]:
+    """
+        This function converts typed parameter arrays into lists that can be serialized to JSON
+        (activity functions can only return JSON serializable objects).\n
+        Timestamps are rendered as strings with a vectorized kernel (SQL Server casts them implicitly).
 
         Args:
-            table (str): Name of the SQL table for which the queries will be created
-            df_curr_values (pd.DataFrame): New data to prepare
+            table (pa.Table): Typed parameter arrays (check `to_param_arrays`)
+
+        Returns:
+            dict: Values per column
+    """
+    columns = {}
+    for name, col in zip(table.column_names, table.columns):
+        if pa.types.is_timestamp(col.type):
+            col = pc.strftime(col.cast(pa.timestamp('us'), safe=False), format=DATE_FORMAT)
+        columns[name] = col.to_pylist()
+    return columns
+
+def build_insert_batches(table: str, df: pd.DataFrame, insert_strategy: str) -> Dict[str, Union[str, int, pa.Table]]:
+    """
+        This function describes how the new rows will be inserted.\n
+        With the 'multirow' strategy no statement text is rendered here: the description holds the number of rows packed
+        per statement (within the SQL Server limits, check `max_rows_per_values`) and the statements are built on upload
+        (check `DBManager.multirow_insert`).
+
+        Args:
+            table (str): Name of the SQL table
+            df (pd.DataFrame): New data to insert
+            insert_strategy (str): One of INSERT_STRATEGIES
+
+        Returns:
+            dict: A dictionary with schema:
+                - strategy (str): Insert strategy
+                - sql (str): Parameterized single-row statement ('executemany' strategy)
+                - table (str): SQL table name ('multirow' strategy)
+                - rows_per_statement (int): Rows packed per statement ('multirow' strategy)
+                - statements (int): Number of statements to execute ('multirow' strategy)
+                - columns (pa.Table): Typed arrays to bind per column (in the statement parameters order)
+
+        Raises:
+            InsertStrategyError: This exception is raised when the requested strategy is not supported
+    """
+    if insert_strategy not in INSERT_STRATEGIES:
+        raise InsertStrategyError(f'Insert strategy {insert_strategy} not supported. Choose one of {INSERT_STRATEGIES}')
+
+    if insert_strategy == 'executemany':
+        cols = ','.join(df.columns)
+        placeholders = ','.join('?' for _ in df.columns)
+        return {'strategy': insert_strategy, 'sql': f'INSERT INTO {table} ({cols}) VALUES ({placeholders})', 'columns': to_param_arrays(df)}
+
+    rows_per_statement = max_rows_per_values(len(df.columns))
+    return {
+        'strategy': insert_strategy,
+        'table': table,
+        'rows_per_statement': rows_per_statement,
+        'statements': math.ceil(len(df) / rows_per_statement),
+        'columns': to_param_arrays(df)
+    }
+
+def build_update_batch(table: str, pks: list, df_update: pd.DataFrame) -> Dict[str, Union[str, list, pa.Table]]:
+    """
+        This function describes the MOST_RECENT reset of the registers already within database for the new composed pks.\n
+        Instead of an update per composed pk, the composed pks are meant to be bulk loaded into a session temporary table
+        and every matching register is reset by a single set-based statement:\n
+        \t- 'UPDATE t SET t.MOST_RECENT=0 FROM table t INNER JOIN #update_pks k ON t.pk=k.pk AND ...'
+
+        Args:
+            table (str): Name of the SQL table
             pks (list): List of defined pks within table schema
+            df_update (pd.DataFrame): Composed pks of the new rows marked as "update"
 
         Returns:
-            pd.DataFrame: Se retorna el DataFrame recibido con una nueva columna, la cual contendrá la query de insert
-                o update correspondiente a cada fila:
-                The argument dataframe is returned with new columns added ():
-                +-----------------------+-------------+----------+---------+---------+
-                | <columnas originales> | MOST_RECENT | sql_stmt | ins_stm | upd_stm |
-                +-----------------------+-------------+----------+---------+---------+
+            dict: A dictionary with schema:
+                - sql (str): Set-based update statement
+                - table (str): SQL table name
+                - temp_table (str): Temporary table name
+                - pks (list): Composed pk fields (the temporary table columns)
+                - columns (pa.Table): Typed arrays with the composed pks to load
     """
-    org_df_cols = df.drop(['insert_stmt', 'sql_stmt'], axis=1).columns
+    _join = ' AND '.join(f't.{pk}=k.{pk}' for pk in pks)
+    return {
+        'sql': f'UPDATE t SET t.{DF_MOST_UPDATED_COL}=0 FROM {table} t INNER JOIN {UPDATE_PKS_TEMP_TABLE} k ON {_join}',
+        'table': table,
+        'temp_table': UPDATE_PKS_TEMP_TABLE,
+        'pks': list(pks),
+        'columns': to_param_arrays(df_update[pks])
+    }
 
-    cols = ','.join(org_df_cols)
-    insert_str_fmt = f'INSERT INTO {table} ({cols}) VALUES ' + '{0[insert_stmt]};'
-    _set = build_df_upd_ins_str_format(set(org_df_cols).difference(set(pks)))
-    _where = build_df_upd_ins_str_format(pks, sep=' AND ')
-    # update_str_fmt = f'UPDATE {table} SET {_set} WHERE {_where};'
-    update_str_fmt = f'UPDATE {table} SET MOST_RECENT=0 WHERE {_where};'
+def build_parameterized_statements(table: str, pks: list, df: pd.DataFrame, df_update: pd.DataFrame,
+                                   insert_strategy: str = INSERT_STRATEGY) -> Dict[str, Dict[str, Union[str, int, pa.Table]]]:
+    """
+        This function generates the parameterized insert and update statements for the new data, along with
+        the column arrays to bind to them.\n
+        Every row will be inserted, and the ones previously identified as "update" will also reset the MOST_RECENT
+        field of the registers already within database for the same composed pk.
 
-    df['ins_stm'] = ''
-    df['upd_stm'] = ''
-    update_value = 'update'
-    if update_value in set(df['sql_stmt']):
-        df.loc[df['sql_stmt'] == update_value, 'upd_stm'] = df.loc[df['sql_stmt'] == update_value, :].agg(update_str_fmt.format, axis=1)
+        Args:
+            table (str): Name of the SQL table for which the queries will be created
+            pks (list): List of defined pks within table schema
+            df (pd.DataFrame): New data to insert (with the MOST_RECENT field)
+            df_update (pd.DataFrame): Composed pks of the new rows marked as "update" (check the `SetStmtPerNewRow` activity function)
+            insert_strategy (str, default=INSERT_STRATEGY): One of INSERT_STRATEGIES
 
-    df.loc[:, 'ins_stm'] = df.loc[:, :].agg(insert_str_fmt.format, axis=1)
+        Returns:
+            dict: A dictionary with schema:
+                - insert (dict): Insert batch description (check `build_insert_batches`)
+                - update (dict): MOST_RECENT reset description (check `build_update_batch`)
+    """
+    logging.debug(f'{len(df)} rows to insert, {len(df_update)} of them update older registers')
 
-    return df
+    return {
+        'insert': build_insert_batches(table, df, insert_strategy),
+        'update': build_update_batch(table, pks, df_update)
+    }
 
+@metered
 def main(kwargs: Dict[str, str]) -> bool:
     """
-        This activity will gather all the insert and update queries previously rendered.
+        This activity will gather all the insert and update queries (and their parameters) for the new data.
         Considerations:\n
         - Data within the provided csv per week DOES NOT CONTAIN duplicated composed pks\n
         \n\t-If this occurs, this implies that the provided dataset is malformed and therefore the execution would stop
@@ -82,19 +184,31 @@ def main(kwargs: Dict[str, str]) -> bool:
 
         Args:
             kwargs (dict): In binding with schema:
-                - df (dict): {'container': str, 'blob': str}
+                - df (dict): {'container': str, 'blob': str} (composed pks marked by `SetStmtPerNewRow`)
+                - source (dict): {'container': str, 'blob': str} (transformed new data)
                 - table (str): SQL table name
+
+        Returns:
+            dict: Parameterized insert and update statements (check `build_parameterized_statements`), with
+                the values to bind as lists per column (or a claim check for them, if they are too large to go
+                through the orchestration history)
     """
-    # Retrieve df from feather blob (instructions in kwargs)
+    # Retrieve dfs from feather blobs (instructions in kwargs)
     bm = BlobManager()
-    df = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'])
+    df = bm.download_blob_as_df(kwargs['source']['container'], kwargs['source']['blob'])
+    record_rows(len(df))
+    # Only the composed pks of the rows marked as update are needed
+    df_update = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'], columns=TABLE_PK, filters=[(DF_SQL_STMT_COL, '==', 'update')])
+
+    # Those registers with update statement will have to update the older dbs
+    # registers with MOST_UPDATED field as 0 (not the most updated register).
+    # On the other hand, all the registers within the new data will be inserted, and so,
+    # all these will be the newest ones.
+    # Therefore... All the new registers need to be marked as the most recent ones
+    df[DF_MOST_UPDATED_COL] = 1
 
     # Assemble insert and update statements
-    df = build_proper_statement_for_each_row_in(kwargs['table'], TABLE_PK, df)
-
-    # Return the assembled statements
-    res = {
-        'insert_stmts': df[~(df['ins_stm'] == '')]['ins_stm'].values.tolist(),
-        'update_stmts': df[~(df['upd_stm'] == '')]['upd_stm'].values.tolist() if 'update' in set(df['sql_stmt']) else []
-    }
-    return res
+    statements = build_parameterized_statements(kwargs['table'], TABLE_PK, df, df_update)
+    for stmt in statements.values():
+        stmt['columns'] = to_json_columns(stmt['columns'])
+    return check_in(statements, bm)
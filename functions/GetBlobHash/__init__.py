@@ -1,18 +1,191 @@
+import os
+import codecs
 import logging
 import hashlib
+import tempfile
+from typing import Dict, Optional, Union
+
+import pyodbc
 import requests
+import chardet
+
+from ..utils.db_manager import DBManager
+from ..utils.metrics import metered, add
+
+DEFAULT_HASH_ALGORITHM = 'sha256'
+HASH_ALGORITHMS = ('sha256', 'blake2b')
+DOWNLOAD_CHUNK_SIZE = 1024*1024
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), 'etl-spool')
+# Also compute the digest executions were logged with before the source was hashed as raw bytes (check `LegacyDigest`),
+# so a source loaded before that change is not loaded again. Turn it off (LEGACY_HASH_CHECK=false) once no logged
+# hash needs it, that is, once the current source was logged with its raw bytes digest
+LEGACY_HASH_CHECK = os.environ.get('LEGACY_HASH_CHECK', 'true').lower() == 'true'
+# Backed by the IX_Executions_execution_date index (check tools/migrate.py)
+LAST_EXECUTION_VALIDATORS_QUERY = 'SELECT TOP 1 file_hash, source_etag, source_last_modified FROM Executions ORDER BY execution_date DESC'
+
+
+class HashAlgorithmError(Exception):
+    pass
+
+
+def get_last_execution_validators(dbm: DBManager) -> Dict[str, str]:
+    """
+        This function retrieves the source validators (ETag and Last-Modified headers) and the hash
+        recorded by the last execution within logging database.
+
+        Args:
+            dbm (DBManager): Database manager for the logging database
 
-def main(url: str) -> str:
+        Returns:
+            dict: A dictionary with 'blob_hash', 'etag' and 'last_modified' keys (empty if nothing was recorded yet)
+    """
+    try:
+        r = dbm.execute_sql_command(LAST_EXECUTION_VALIDATORS_QUERY, ret=True)
+    except pyodbc.Error as e:
+        logging.warning(f'Source validators could not be retrieved from logging database, the source will be fully downloaded: {e}')
+        return {}
+
+    if not r:
+        return {}
+    return {'blob_hash': r[0][0], 'etag': r[0][1], 'last_modified': r[0][2]}
+
+def build_conditional_headers(validators: Dict[str, str]) -> Dict[str, str]:
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def format_digest(digest: str, algorithm: str) -> str:
+    # sha256 digests are kept bare (as logged so far), other algorithms are prefixed so they never collide with them
+    return digest if algorithm == DEFAULT_HASH_ALGORITHM else f'{algorithm}:{digest}'
+
+def make_decoder(encoding: Optional[str]) -> codecs.IncrementalDecoder:
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        # requests falls back to the default decoding for unknown encodings
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+class LegacyDigest:
     """
-        This activity will retrieve the whole blob and calculate hash
-        with sha256 algorithm.
+        This class computes, chunk by chunk along the download, the digest the source was identified by before
+        it was hashed as raw bytes: sha256 of `requests.get(url).text.encode()`. That is, the content decoded as
+        requests does (the response charset, ISO-8859-1 for text/* responses without one, or a guess over the
+        whole content otherwise) and encoded again as UTF-8.\n
+        When the response states its encoding the text is decoded along the download. Otherwise the encoding
+        is guessed by a `chardet.UniversalDetector` fed with the same chunks (as `requests.Response.apparent_encoding`),
+        and the spool file is read once more to decode it, unless the content was ASCII only: ASCII content
+        decodes to the same bytes whatever the guess, so its raw sha256 is the legacy digest.
+
+        Args:
+            encoding (str, optional): Response encoding (`requests.Response.encoding`)
+    """
+    def __init__(self, encoding: Optional[str]):
+        self.ascii_only = True
+        self.hash = hashlib.sha256()
+        self.decoder = make_decoder(encoding) if encoding else None
+        self.detector = None if encoding else chardet.UniversalDetector()
+
+    def update(self, chunk: bytes) -> None:
+        if self.decoder is not None:
+            self.hash.update(self.decoder.decode(chunk).encode())
+            return
+        self.hash.update(chunk)
+        self.ascii_only = self.ascii_only and chunk.isascii()
+        if not self.detector.done:
+            self.detector.feed(chunk)
+
+    def hexdigest(self, spool: str) -> str:
+        if self.decoder is not None:
+            self.hash.update(self.decoder.decode(b'', final=True).encode())
+            return self.hash.hexdigest()
+        self.detector.close()
+        if self.ascii_only:
+            return self.hash.hexdigest()
+
+        decoder, h = make_decoder(self.detector.result['encoding']), hashlib.sha256()
+        with open(spool, 'rb') as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                h.update(decoder.decode(chunk).encode())
+        h.update(decoder.decode(b'', final=True).encode())
+        return h.hexdigest()
+
+def spool_and_hash(url: str, algorithm: str, headers: Dict[str, str]) -> Dict[str, Union[str, bool, None]]:
+    """
+        This function streams the blob into a local spool file while its hash is computed chunk by chunk,
+        so the blob is downloaded once and never fully held in memory.\n
+        If the source answers that it was not modified (HTTP 304) nothing is downloaded.
 
         Args:
             url (str): Url to blob
-        
+            algorithm (str): Hash algorithm (one of HASH_ALGORITHMS)
+            headers (dict): Conditional request headers
+
         Returns:
-            str: Blob hash's digest
+            dict: A dictionary with schema:
+                - not_modified (bool): True if the source was not modified since the validators in headers
+                - blob_hash (str): Blob hash's digest (None if not modified)
+                - legacy_hash (str): Legacy sha256 digest (None if not modified or LEGACY_HASH_CHECK is disabled)
+                - spool (str): Path to the spool file (None if not modified)
+                - etag (str): ETag header of the response
+                - last_modified (str): Last-Modified header of the response
     """
-    h = hashlib.sha256()
-    h.update(requests.get(url).text.encode())
-    return h.hexdigest()
+    with requests.get(url, headers=headers, stream=True) as r:
+        etag, last_modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+        if r.status_code == requests.codes.not_modified:
+            return {'not_modified': True, 'blob_hash': None, 'legacy_hash': None, 'spool': None, 'etag': etag, 'last_modified': last_modified}
+        r.raise_for_status()
+        legacy = LegacyDigest(r.encoding) if LEGACY_HASH_CHECK else None
+
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        h = hashlib.new(algorithm)
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=SPOOL_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                h.update(chunk)
+                f.write(chunk)
+                if legacy is not None:
+                    legacy.update(chunk)
+                add('blob_bytes_read', len(chunk))
+
+    # The spool file is named after its digest, so a retried download just replaces it
+    blob_hash = format_digest(h.hexdigest(), algorithm)
+    spool = os.path.join(SPOOL_DIR, f'{h.hexdigest()}.csv')
+    os.replace(tmp_path, spool)
+    logging.debug(f'Blob spooled to {spool}')
+
+    legacy_hash = legacy.hexdigest(spool) if legacy is not None else None
+    return {'not_modified': False, 'blob_hash': blob_hash, 'legacy_hash': legacy_hash, 'spool': spool, 'etag': etag, 'last_modified': last_modified}
+
+@metered
+def main(kwargs: Dict[str, str]) -> Dict[str, Union[str, bool, None]]:
+    """
+        This activity will retrieve the whole blob (streamed into a local spool file for the
+        parsing activity) and calculate its hash.\n
+        If the ETag/Last-Modified validators recorded by the last execution still match the source,
+        the download is skipped and the hash recorded by that execution is returned.
+
+        Args:
+            kwargs (dict): In binding with schema:
+                - url (str): Url to blob
+                - algorithm (str, default=sha256): Hash algorithm, one of HASH_ALGORITHMS
+
+        Returns:
+            dict: Blob hash's digest, spool file path and source validators (check `spool_and_hash`)
+
+        Raises:
+            HashAlgorithmError: This exception is raised when the requested algorithm is not supported
+    """
+    algorithm = kwargs.get('algorithm') or DEFAULT_HASH_ALGORITHM
+    if algorithm not in HASH_ALGORITHMS:
+        raise HashAlgorithmError(f'Hash algorithm {algorithm} not supported. Choose one of {HASH_ALGORITHMS}')
+
+    validators = get_last_execution_validators(DBManager(_type='test'))
+    res = spool_and_hash(kwargs['url'], algorithm, build_conditional_headers(validators))
+
+    if res['not_modified']:
+        logging.info(f'Source not modified since last execution (ETag={validators.get("etag")}, Last-Modified={validators.get("last_modified")})')
+        res['blob_hash'] = validators.get('blob_hash')
+    return res
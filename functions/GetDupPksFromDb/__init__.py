@@ -2,9 +2,12 @@ import logging
 from typing import Dict, List, Tuple
 
 from ..utils.db_manager import DBManager
+from ..utils.metrics import metered, record_rows
 
 GROUP_COUNT_QUERY_INDEX = 3
+DUP_PK_GROUPS_QUERY = 'SELECT ID, MUESTRA, RESULTADO, COUNT(ID) FROM {table} GROUP BY ID, MUESTRA, RESULTADO'
 
+@metered
 def main(kwargs: Dict[str, str]) -> List[Tuple[str, str, str, int]]:
     """
         This functions will query all groups by the implicit composed pk (ID, MUESTRA, RESULTADO).\n
@@ -26,8 +29,9 @@ def main(kwargs: Dict[str, str]) -> List[Tuple[str, str, str, int]]:
     """
     dbm = DBManager(_type=kwargs['database'])
 
-    res = dbm.execute_sql_command(f'SELECT ID, MUESTRA, RESULTADO, COUNT(ID) FROM {kwargs["table"]} GROUP BY ID, MUESTRA, RESULTADO', ret=True)
+    res = dbm.execute_sql_command(DUP_PK_GROUPS_QUERY.format(table=kwargs['table']), ret=True)
 
+    record_rows(len(res))
     dup_pks = []
     for i in res:
         # If group count has more than a single occurence, it means that pk is repeated
@@ -3,7 +3,8 @@ import logging
 from os import dup
 from typing import Dict, List, Union, Tuple
 
-from ..utils.db_manager import DBManager
+from ..utils.async_db_manager import AsyncDBManager
+from ..utils.metrics import metered, record_rows
 
 ID_QUERY_INDEX = 0
 MUESTRA_QUERY_INDEX = 1
@@ -14,10 +15,22 @@ class WrongOutputError(Exception):
     pass
 
 
-def main(kwargs: Dict[str, Union[Dict[str, str], List[List[str]]]]) -> List[List[list]]:
+REGS_PER_PK_QUERY = """
+    SELECT 
+        FECHA_COPIA,
+        MOST_RECENT
+    FROM {table}
+    WHERE
+        ID=? AND MUESTRA=? AND RESULTADO=?
+"""
+
+
+@metered
+async def main(kwargs: Dict[str, Union[Dict[str, str], List[List[str]]]]) -> List[List[list]]:
     """
         This activity will retrieve all the requiered information from each register for each duplicated pk,
         in order to update those registers leaving one of them as the most recent one.\n
+        The queries for every duplicated pk are sent concurrently (check `AsyncDBManager`).\n
         The expected response from the database is a list of tuples with the following schema:\n
         +-------------+\n
         | FECHA_COPIA |\n
@@ -39,22 +52,18 @@ def main(kwargs: Dict[str, Union[Dict[str, str], List[List[str]]]]) -> List[List
                 - The first one will be the duplicated composed pk
                 - The second one will be a list of strs (because the only data required to update fields are the ones on "FECHA_COPIA" field)
     """
-    dbm = DBManager(_type=kwargs['db_config']['database'])
+    query = REGS_PER_PK_QUERY.format(table=kwargs['db_config']['table'])
+    record_rows(len(kwargs['dup_pks']))
     res = []
 
-    for dup_pk in kwargs['dup_pks']:
-        regs = dbm.execute_sql_command(
-            """
-                SELECT 
-                    FECHA_COPIA,
-                    MOST_RECENT
-                FROM {table}
-                WHERE
-                    ID='{id}' AND MUESTRA='{muestra}' AND RESULTADO='{resultado}'
-            """.format(table=kwargs['db_config']['table'], id=dup_pk[ID_QUERY_INDEX], muestra=dup_pk[MUESTRA_QUERY_INDEX], resultado=dup_pk[RESULTADO_QUERY_INDEX]),
-            ret=True
+    # The registers of every duplicated pk are queried concurrently (results keep the dup_pks order)
+    async with AsyncDBManager(_type=kwargs['db_config']['database']) as adbm:
+        regs_per_pk = await adbm.gather(
+            adbm.execute_sql_command(query, ret=True, params=[dup_pk[ID_QUERY_INDEX], dup_pk[MUESTRA_QUERY_INDEX], dup_pk[RESULTADO_QUERY_INDEX]])
+            for dup_pk in kwargs['dup_pks']
         )
 
+    for dup_pk, regs in zip(kwargs['dup_pks'], regs_per_pk):
         # If any register among results for a duplicated pk has MOST_RECENT field value set as True (1 in BIT SQL Server type)
         # It means no operation needs to be done in that group, therefore no operation will be recorded for any of the registers
         # for the given duplicated composed pk
@@ -1,9 +1,59 @@
-import json
 import logging
+from typing import Any, List
+
+import pandas as pd
+import pyarrow as pa
 
 from ..utils.db_manager import DBManager
+from ..utils.claim_check import check_in
+from ..utils.metrics import metered, record_rows
+
+TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
+PKS_TEMP_TABLE = '#new_pks'
+UNIQUE_PKS_QUERY = 'SELECT DISTINCT ID, MUESTRA, RESULTADO FROM {table}'
+
+def build_matching_pks_query(table: str) -> str:
+    # Composed pks within table matching the ones loaded into PKS_TEMP_TABLE
+    _join = ' AND '.join(f't.{pk}=k.{pk}' for pk in TABLE_PK)
+    return f'SELECT DISTINCT {",".join("t." + pk for pk in TABLE_PK)} FROM {table} t INNER JOIN {PKS_TEMP_TABLE} k ON {_join}'
 
-def main(workTable: str) -> str:
+def query_unique_pks(dbm: DBManager, table: str) -> List[tuple]:
+    # Retrieve unique set of composed pks within database (table="Unificado")
+    db_unique_pks = UNIQUE_PKS_QUERY.format(table=table)
+
+    r = dbm.execute_sql_command(db_unique_pks, ret=True)
+    return [tuple(t) for t in r]
+
+def query_matching_pks(dbm: DBManager, table: str, df: pd.DataFrame) -> List[tuple]:
+    """
+        This function retrieves the unique pks within table that match any composed pk of the new data.\n
+        The new data pks are bulk loaded into a session temporary table and joined against table, so only
+        the matching pks (instead of the whole set of pks within table) are retrieved.
+
+        Args:
+            dbm (DBManager): Database manager for the working database
+            table (str): Desired SQL table
+            df (pd.DataFrame): New data (only its composed pk fields are used)
+
+        Returns:
+            list: A list of tuples with the matching composed pks
+    """
+    _pks = ','.join(TABLE_PK)
+
+    with dbm.connection() as conn, conn.cursor() as curr:
+        curr.execute(f'SELECT TOP 0 {_pks} INTO {PKS_TEMP_TABLE} FROM {table}')
+        dbm.bulk_write(f'INSERT INTO {PKS_TEMP_TABLE} ({_pks}) VALUES (?,?,?)', pa.Table.from_pandas(df[TABLE_PK], preserve_index=False),
+                       rows_per_transaction=None, conn=conn)
+
+        curr.execute(build_matching_pks_query(table))
+        r = curr.fetchall()
+        # The session outlives this function (pooled connection)
+        curr.execute(f'DROP TABLE {PKS_TEMP_TABLE}')
+
+    return [tuple(t) for t in r]
+
+@metered
+def main(workTable: str) -> Any:
     """
         This activity will retrieve all unique pks for workTable.
 
@@ -11,12 +61,10 @@ def main(workTable: str) -> str:
             workTable (str): Desired SQL table
         
         Returns:
-            str: Json string with query result
+            dict: {'db_unique_pks': list} with the query result, or a claim check for it if it is too large
+                to go through the orchestration history (check `utils.claim_check`)
     """
     dbm = DBManager(_type='work')
-
-    # Retrieve unique set of composed pks within database (table="Unificado")
-    db_unique_pks = "SELECT DISTINCT ID, MUESTRA, RESULTADO FROM {table}".format(db=dbm.work_db, table=workTable)
-
-    r = dbm.execute_sql_command(db_unique_pks, ret=True)
-    return json.dumps({'db_unique_pks': [tuple(t) for t in r]})
\ No newline at end of file
+    db_unique_pks = query_unique_pks(dbm, workTable)
+    record_rows(len(db_unique_pks))
+    return check_in({'db_unique_pks': db_unique_pks})
@@ -0,0 +1,39 @@
+import logging
+from typing import Dict, Union
+
+from ..utils.blob_manager import BlobManager
+from ..utils.db_manager import DBManager
+from ..GetUniqueSetOfPksFromDb import query_matching_pks
+from ..FusedIngest import ingest_df
+from ..SetStmtPerNewRow import build_pk_index
+from ..utils.metrics import metered, record_rows
+
+@metered
+def main(kwargs: Dict[str, Union[Dict[str, str], str]]) -> Dict[str, int]:
+    """
+        This activity classifies, builds the statements for and uploads a shard of the transformed new data
+        (check the `ShardDf` activity). Shards run in parallel, as they do not share any composed pk.\n
+        Only the pks within database matching the shard pks are retrieved to classify it.
+
+        Args:
+            kwargs (dict): In binding with schema:
+                - df (dict): {'container': str, 'blob': str} (shard of the transformed new data)
+                - table (str): SQL table name
+                - ingest_mode (str): 'statements' or 'staging' (check the `ScheduledIngest` orchestrator)
+
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows for the shard
+    """
+    bm = BlobManager()
+    df = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'])
+    record_rows(len(df))
+    dbm = DBManager(_type='work')
+
+    db_pks = None
+    if kwargs['ingest_mode'] != 'staging':
+        db_unique_pks = query_matching_pks(dbm, kwargs['table'], df)
+        logging.debug(f'{len(db_unique_pks)} pks within database match the shard pks')
+        db_pks = build_pk_index(db_unique_pks)
+
+    # Checkpoints are not saved for shards (bm=None), as the shard itself is already within blob storage
+    return ingest_df(dbm, None, df, kwargs, db_pks)
@@ -1,11 +1,24 @@
+import os
 import logging
 import json
 
 import azure.functions as func
 import azure.durable_functions as df
 
+from ..utils.metrics import call_activity, summarize, save_stage_metrics
+
 DB = 'work'
 TABLE = 'Unificado'
+# 'window': Duplicated groups are fixed within SQL Server by a set-based statement, only over the composed pks loaded
+#           since the last dedup run unless a full rescan is requested (see DedupMostRecent)
+# 'queries': Duplicated groups are retrieved and an update is built per group (one query per duplicated composed pk, always over the whole table)
+DEDUP_MODE = os.environ.get('DEDUP_MODE', 'window')
+NOTHING_TO_UPDATE = 'Registers are marked!\nNo upload operations had been done, because all groups of registers with a duplicated pk contains a tuple with a True (1 in BIT SQL Server data type) value for MOST_RECENT field'
+
+def report_stage_metrics(context: df.DurableOrchestrationContext, stages: list):
+    # Metrics of every activity called (check `utils.metrics`), saved within StageMetrics (if possible) and summarized in the custom status
+    yield from save_stage_metrics(context, 'ModifyDB', stages)
+    context.set_custom_status({'stage_metrics': summarize(stages)})
 
 def orchestrator_function(context: df.DurableOrchestrationContext):
     """
@@ -17,30 +30,43 @@ def orchestrator_function(context: df.DurableOrchestrationContext):
         distintas."\n
 
         Args:
-            This orchestrator does not consume any parameters
+            Orchestrator input (dict, optional): {'full_rescan': bool} ('window' dedup mode only). By default only the
+                composed pks loaded since the last dedup run are re-evaluated (check DedupMostRecent)
         
         Returns:
             This orchestrator does not return any value
     """
     db_config = {'database': DB, 'table': TABLE}
+    stages = []
+    full_rescan = bool((context.get_input() or {}).get('full_rescan'))
+    if DEDUP_MODE == 'window':
+        upload_resume = yield from call_activity(context, stages, 'DedupMostRecent', {**db_config, 'full_rescan': full_rescan})
+        yield from report_stage_metrics(context, stages)
+        return upload_resume if upload_resume['update_rows_uploaded'] else NOTHING_TO_UPDATE
+
+    if full_rescan and not context.is_replaying:
+        logging.warning(f"full_rescan is ignored in '{DEDUP_MODE}' dedup mode, which always rescans the whole {TABLE} table")
+
     # Identify duplicated pks among database (Adding FECHA_COPIA field to distinguish them)
-    dup_pks = yield context.call_activity('GetDupPksFromDb', db_config)
+    dup_pks = yield from call_activity(context, stages, 'GetDupPksFromDb', db_config)
 
     # Gather all registers for each duplicated pk
-    duplicated_registers_to_update = yield context.call_activity('GetRegsWithDupPks', {'db_config': db_config, 'dup_pks': dup_pks})
+    duplicated_registers_to_update = yield from call_activity(context, stages, 'GetRegsWithDupPks', {'db_config': db_config, 'dup_pks': dup_pks})
 
     if duplicated_registers_to_update:
         # Build update queries in order to satisfy requirement
         # DONE: Default value from schema for MOST_RECENT field should be 0, in order to fire an update just for the most recent ones
-        query_strings = yield context.call_activity('BuildUpdateQueriesForEachDupRegInBackup', {'db_config': db_config, 'dup_data': duplicated_registers_to_update})
+        query_strings = yield from call_activity(context, stages, 'BuildUpdateQueriesForEachDupRegInBackup', {'db_config': db_config, 'dup_data': duplicated_registers_to_update})
 
         # Fire the generated queries
-        upload_resume = yield context.call_activity('UpdateBackupData', query_strings)
+        upload_resume = yield from call_activity(context, stages, 'UpdateBackupData', query_strings)
+        yield from report_stage_metrics(context, stages)
         return query_strings, upload_resume
     else:
         # duplicated_registers_to_update has no values, it means that all groups of registers for composed pks (duplicated values)
         # has a tuple with a True (1 in BIT SQL Server data type) in the MOST_RECENT field.
         # This means that no further update is needed
-        return 'Registers are marked!\nNo upload operations had been done, because all groups of registers with a duplicated pk contains a tuple with a True (1 in BIT SQL Server data type) value for MOST_RECENT field'
+        yield from report_stage_metrics(context, stages)
+        return NOTHING_TO_UPDATE
 
 main = df.Orchestrator.create(orchestrator_function)
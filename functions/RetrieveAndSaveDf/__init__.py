@@ -1,39 +1,42 @@
+import os
 import logging
 from io import BytesIO
-from typing import Dict
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, Union
+from urllib.request import urlopen
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 from azure.storage.blob import BlobServiceClient
 
 from ..utils.blob_manager import BlobManager
+from ..utils.schema import pandas_dtypes, read_csv_kwargs, arrow_column_types, arrow_to_pandas, memory_per_row
+from ..utils.metrics import metered, record_rows
 
 STORAGE_CONTAINER = 'intermediate-results'
-DTYPES = {
-    'CHROM': 'str',
-    'POS': 'str',
-    'ID': 'str',
-    'REF': 'str',
-    'ALT': 'str',
-    'QUAL': 'str',
-    'FILTER': 'str',
-    'INFO': 'str',
-    'FORMAT': 'str',
-    'MUESTRA': 'str',
-    'VALOR': 'str',
-    'ORIGEN': 'str',
-    'FECHA_COPIA': 'datetime64[ns]',
-    'RESULTADO': 'str'
-}
+# Dtypes per field (check `utils.schema`)
+DTYPES = pandas_dtypes()
+# 'pandas': pandas C parser (single threaded)
+# 'arrow': pyarrow multithreaded csv reader (parses in blocks of CSV_BLOCK_SIZE bytes, one per core)
+CSV_ENGINES = ('pandas', 'arrow')
+DEFAULT_CSV_ENGINE = 'pandas'
+CSV_BLOCK_SIZE = int(os.environ.get('CSV_BLOCK_SIZE', 16*1024*1024))
 
 
 class FieldNotFoundError(Exception):
     pass
 
 
+class CsvEngineError(Exception):
+    pass
+
+
 def transform_df_dtypes(df: pd.DataFrame, dtypes: dict=DTYPES) -> None:
     """
         This function casts types per field.\n
         Modifications to dataframe are performed inplace, so no df is required to be returned.\n
+        Fields already parsed with the proper dtype (check `read_csv_kwargs`) are left untouched (no copy).\n
         I created this functions because saving a casted dataframe (via df.astype()) to feather file
         does not save casted fields.
         
@@ -46,8 +49,132 @@ def transform_df_dtypes(df: pd.DataFrame, dtypes: dict=DTYPES) -> None:
     for field, dtype in dtypes.items():
         if field not in df.columns:
             raise FieldNotFoundError(f'Field {field} not founded within columns of dataframe')
-        df[field] = df[field].astype(dtype)
+        if df[field].dtype != dtype:
+            df[field] = df[field].astype(dtype)
+
+def resolve_source(kwargs: Dict[str, str]) -> str:
+    """
+        This function returns the local spool file written by `GetBlobHash` if it is available
+        within this worker, otherwise the remote data url is returned (and the data is downloaded again).
+
+        Args:
+            kwargs (dict): Activity parameters (check `main`)
+
+        Returns:
+            str: Path or url to read the csv from
+    """
+    spool = kwargs.get('spool')
+    if spool and os.path.exists(spool):
+        logging.debug(f'Reading spooled data from {spool}')
+        return spool
+
+    logging.warning(f'Spool file {spool} not available in this worker, downloading the data from its url')
+    return kwargs['url']
+
+def get_csv_engine(kwargs: Dict[str, str]) -> str:
+    engine = kwargs.get('csv_engine') or DEFAULT_CSV_ENGINE
+    if engine not in CSV_ENGINES:
+        raise CsvEngineError(f'CSV engine {engine} not supported. Choose one of {CSV_ENGINES}')
+    return engine
+
+@contextmanager
+def open_source(source: str) -> Iterator[Union[str, BinaryIO]]:
+    # The Arrow reader takes paths and file objects, so remote sources are streamed through a file object
+    if source.startswith(('http://', 'https://')):
+        with urlopen(source) as f:
+            yield f
+    else:
+        yield source
+
+def arrow_csv_options(kwargs: Dict[str, str]) -> Dict[str, object]:
+    """
+        This function builds the Arrow csv reader options for the activity parameters (delimiter and quotechar)
+        and the schema (check `utils.schema.arrow_column_types`).
+
+        Args:
+            kwargs (dict): Activity parameters (check `main`)
+
+        Returns:
+            dict: read_options, parse_options and convert_options arguments
+    """
+    return {
+        'read_options': pa_csv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE),
+        'parse_options': pa_csv.ParseOptions(delimiter=kwargs['delimiter'], quote_char=kwargs['quotechar']),
+        # Empty strings (and the rest of the parser default markers) are missing values for every column, as with pandas
+        'convert_options': pa_csv.ConvertOptions(column_types=arrow_column_types(), strings_can_be_null=True)
+    }
 
+def read_source(kwargs: Dict[str, str]) -> pd.DataFrame:
+    """
+        This function retrieves the data from the csv (spool file or url) and casts its fields
+        to the proper data types.
+
+        Args:
+            kwargs (dict): Activity parameters (check `main`)
+
+        Returns:
+            pd.DataFrame: New data
+    """
+    source = resolve_source(kwargs)
+    # Fields are parsed straight into their dtypes (check `utils.schema`)
+    if get_csv_engine(kwargs) == 'arrow':
+        with open_source(source) as f:
+            df = arrow_to_pandas(pa_csv.read_csv(f, **arrow_csv_options(kwargs)))
+    else:
+        df = pd.read_csv(source, delimiter=kwargs['delimiter'], quotechar=kwargs['quotechar'], **read_csv_kwargs())
+    if source != kwargs['url']:
+        # The spool file is only needed until the data is parsed
+        os.remove(source)
+
+    # Check every field is present (and cast any field the parser could not type)
+    transform_df_dtypes(df)
+    logging.debug(f'{len(df)} rows parsed ({memory_per_row(df):.0f} bytes per row)')
+    return df
+
+def iter_arrow_chunks(source: str, kwargs: Dict[str, str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # The streaming reader yields blocks of CSV_BLOCK_SIZE bytes, which are regrouped into chunks of chunk_rows rows
+    with open_source(source) as f:
+        reader = pa_csv.open_csv(f, **arrow_csv_options(kwargs))
+        pending = []
+        n_pending = 0
+        for batch in reader:
+            pending.append(batch)
+            n_pending += batch.num_rows
+            while n_pending >= chunk_rows:
+                table = pa.Table.from_batches(pending)
+                yield arrow_to_pandas(table.slice(0, chunk_rows))
+                rest = table.slice(chunk_rows)
+                pending, n_pending = rest.to_batches(), rest.num_rows
+        if n_pending:
+            yield arrow_to_pandas(pa.Table.from_batches(pending, schema=reader.schema))
+
+def iter_source(kwargs: Dict[str, str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+        This function streams the data from the csv (spool file or url) in chunks of a fixed number
+        of rows, casting the fields of every chunk to the proper data types.\n
+        Only a chunk is held in memory at once.
+
+        Args:
+            kwargs (dict): Activity parameters (check `main`)
+            chunk_rows (int): Number of rows per chunk
+
+        Yields:
+            pd.DataFrame: A chunk of the new data
+    """
+    source = resolve_source(kwargs)
+    if get_csv_engine(kwargs) == 'arrow':
+        yield from iter_arrow_chunks(source, kwargs, chunk_rows)
+    else:
+        with pd.read_csv(source, delimiter=kwargs['delimiter'], quotechar=kwargs['quotechar'], chunksize=chunk_rows, **read_csv_kwargs()) as reader:
+            for chunk in reader:
+                transform_df_dtypes(chunk)
+                yield chunk
+
+    if source != kwargs['url']:
+        # The spool file is only needed until the data is parsed
+        os.remove(source)
+
+@metered
 def main(kwargs: Dict[str, str]) -> bool:
     """
         Main function for this activity.\n
@@ -58,14 +185,13 @@ def main(kwargs: Dict[str, str]) -> bool:
             kwargs: Dictionary of parameters provided by the orchestrator.
                 The schema is:
                     - url: Remote data url
+                    - spool: Local spool file written by `GetBlobHash` (optional, preferred over url)
                     - delimiter: Remote data delimiter
                     - quotechar: Remote data quotechar
+                    - csv_engine: One of CSV_ENGINES (optional, default=DEFAULT_CSV_ENGINE)
     """
-    df = pd.read_csv(kwargs['url'], delimiter=kwargs['delimiter'], quotechar=kwargs['quotechar'])
-    
-    # Cast fields to proper data type, based on db schema
-    logging.debug(f'Dataframe previous dtypes: {df.info()}')
-    transform_df_dtypes(df)
+    df = read_source(kwargs)
+    record_rows(len(df))
 
     bm = BlobManager()
     filename = 'df.ftr'
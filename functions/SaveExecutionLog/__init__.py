@@ -3,29 +3,57 @@ import logging
 from datetime import datetime
 from typing import Dict
 
+from ..utils import hash_cache
 from ..utils.db_manager import DBManager
+from ..utils.metrics import metered
 
+MAX_COPY_DATE_QUERY = 'SELECT MAX(FECHA_COPIA) FROM {table}'
+
+def get_max_copy_date(table: str) -> datetime:
+    # FECHA_COPIA high-water mark of the working table once the new data is loaded (the incremental dedup
+    # of `DedupMostRecent` only re-evaluates the composed pks loaded after the last deduplicated mark)
+    dbm = DBManager(_type='work')
+    return dbm.execute_sql_command(MAX_COPY_DATE_QUERY.format(table=table), ret=True)[0][0]
+
+@metered
 def main(kwargs: Dict[str, str]) -> None:
     """
         This activity will save an execution log within logging database.
-        As the id is not handled by database, an uuid value is generated each time.
+        As the id is not handled by database, an uuid value is generated each time (unless the orchestrator provides it).
 
         Args:
             kwargs (dict): In binding with schema:
+                blob_hash (str): Hash of the loaded blob
                 update_resume (int): Number of updated rows
                 inser_resume (int): Number of new rows
+                etag (str, optional): ETag header of the loaded blob
+                last_modified (str, optional): Last-Modified header of the loaded blob
+                table (str, optional): Working table the blob was loaded into (its FECHA_COPIA high-water mark is recorded)
+                id (str, optional): Execution id (e.g. to relate the execution with its StageMetrics registers)
         
         Returns:
             str: String with all values used for the log (this string will be used for setting up custom orchestrator status)
     """
     dbm = DBManager(_type='test')
-    id = str(uuid.uuid4())
+    id = kwargs.get('id') or str(uuid.uuid4())
     dt_now = datetime.now()
 
-    # Retrieve unique set of composed pks within database (table="Unificado")
-    db_unique_pks = """
-    INSERT INTO Executions VALUES ('{id}', CAST('{dt_now}' AS DATETIME2), '{csv_blob_hash}', {resume_update}, {resume_insert})
-    """.format(id=id, dt_now=dt_now, csv_blob_hash=kwargs['blob_hash'], resume_update=kwargs['update_resume'], resume_insert=kwargs['insert_resume'])
+    log = {
+        'id': id,
+        'execution_date': dt_now,
+        'file_hash': kwargs['blob_hash'],
+        'rows_updated': kwargs['update_resume'],
+        'rows_inserted': kwargs['insert_resume'],
+        # Source validators are recorded to skip the download of an unmodified source in further executions
+        'source_etag': kwargs.get('etag'),
+        'source_last_modified': kwargs.get('last_modified'),
+        # The high-water mark is recorded along with its table (check `DedupMostRecent.get_watermarks`)
+        'table_name': kwargs.get('table'),
+        'max_copy_date': get_max_copy_date(kwargs['table']) if kwargs.get('table') else None
+    }
+    insert_log = 'INSERT INTO Executions ({cols}) VALUES ({placeholders})'.format(cols=','.join(log), placeholders=','.join('?' for _ in log))
 
-    _ = dbm.execute_and_commit_to_db([db_unique_pks])
+    _ = dbm.bulk_write(insert_log, {col: [value] for col, value in log.items()})
+    # Further checks of this hash within this worker will not reach the database
+    hash_cache.remember(kwargs['blob_hash'])
     return str((id, str(dt_now), kwargs['blob_hash'], kwargs['update_resume'], kwargs['insert_resume']))
@@ -0,0 +1,69 @@
+import uuid
+import logging
+from datetime import datetime
+from typing import Any, Dict, List
+
+from ..utils.db_manager import DBManager
+
+# StageMetrics column per activity metric (check `utils.metrics.ActivityMetrics.to_dict`)
+METRIC_COLUMNS = {
+    'stage': 'stage',
+    'seconds': 'seconds',
+    'rows': 'rows_processed',
+    'blob_bytes_read': 'blob_bytes_read',
+    'blob_bytes_written': 'blob_bytes_written',
+    'db_round_trips': 'db_round_trips',
+    'peak_memory_mb': 'peak_memory_mb'
+}
+
+def build_registers(kwargs: Dict[str, Any]) -> Dict[str, List[Any]]:
+    """
+        This function turns the metrics of every activity into StageMetrics column arrays (a register per activity call).
+
+        Args:
+            kwargs (dict): Activity parameters (check `main`)
+
+        Returns:
+            dict: A list of values per StageMetrics column
+    """
+    stages = kwargs['stages']
+    # The orchestration datetime is timezone aware (UTC), while DATETIME is not
+    run_date = datetime.fromisoformat(kwargs['run_date']).replace(tzinfo=None)
+    registers = {
+        'id': [str(uuid.uuid4()) for _ in stages],
+        'execution_id': [kwargs.get('execution_id')] * len(stages),
+        'instance_id': [kwargs['instance_id']] * len(stages),
+        'orchestrator': [kwargs['orchestrator']] * len(stages),
+        'run_date': [run_date] * len(stages),
+        'call_order': list(range(len(stages)))
+    }
+    for key, col in METRIC_COLUMNS.items():
+        registers[col] = [m.get(key) for m in stages]
+    return registers
+
+def main(kwargs: Dict[str, Any]) -> int:
+    """
+        This activity saves the metrics of every activity called by an orchestration within the StageMetrics
+        table of the logging database (next to Executions), a register per activity call.
+
+        Args:
+            kwargs (dict): In binding with schema:
+                orchestrator (str): Orchestrator name
+                instance_id (str): Orchestration instance id
+                run_date (str): Orchestration run date (ISO format)
+                execution_id (str, optional): Executions id of the run (ingests that loaded a blob)
+                stages (list): Metrics of every activity call (check `utils.metrics.call_activity`)
+
+        Returns:
+            int: Number of saved registers
+    """
+    if not kwargs['stages']:
+        return 0
+
+    dbm = DBManager(_type='test')
+    registers = build_registers(kwargs)
+    insert = 'INSERT INTO StageMetrics ({cols}) VALUES ({placeholders})'.format(cols=','.join(registers), placeholders=','.join('?' for _ in registers))
+
+    saved = dbm.bulk_write(insert, registers)
+    logging.debug(f'{saved} stage metrics saved for {kwargs["orchestrator"]} ({kwargs["instance_id"]})')
+    return saved
@@ -1,78 +1,85 @@
 import logging
-from typing import Dict
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
 
 from ..utils.blob_manager import BlobManager
+from ..utils.claim_check import check_out, release
+from ..utils.metrics import metered, record_rows
 
+TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
 DF_SQL_STMT_COL = 'sql_stmt'
-DF_MOST_UPDATED_COL = 'MOST_RECENT'
 
+def build_pk_index(db_unique_pks: List[List[str]]) -> pd.MultiIndex:
+    return pd.MultiIndex.from_frame(pd.DataFrame(db_unique_pks, columns=TABLE_PK))
+
+def label_rows(df: pd.DataFrame, db_pks: pd.MultiIndex) -> None:
+    """
+        This function marks every row of the new data as an 'update' (its composed pk already exists
+        within database) or as an 'insert' (no match with database values), probing every new data pk
+        against the index built over the database pks (hash join).\n
+        Only the new data pks are walked, so the index can be built once and reused for every chunk of the new data.
+        The DF_SQL_STMT_COL field is added to the dataframe inplace.
+
+        Args:
+            df (pd.DataFrame): New data to classify
+            db_pks (pd.MultiIndex): Index built over the composed pks within database with `build_pk_index`
+    """
+    df_pks = pd.MultiIndex.from_frame(df[TABLE_PK])
+    df[DF_SQL_STMT_COL] = np.where(df_pks.isin(db_pks), 'update', 'insert')
+
+def classify_rows(df: pd.DataFrame, db_unique_pks: List[List[str]]) -> List[List[str]]:
+    """
+        This function labels every row of the new data (check `label_rows`) and also returns the database
+        pks matched by the new data, so the whole database pk set is walked as well and the cost grows
+        linearly with rows + database pks. Use `label_rows` when only the labels are needed.
+
+        Args:
+            df (pd.DataFrame): New data to classify
+            db_unique_pks (list): List of tuples with all the composed pks values retrieved from database
+
+        Returns:
+            list: Database pks matched by at least one row of the new data (in the same order as db_unique_pks)
+    """
+    db_pks = build_pk_index(db_unique_pks)
+    label_rows(df, db_pks)
+    df_pks = pd.MultiIndex.from_frame(df[TABLE_PK])
+
+    return [db_unique_pks[i] for i in np.flatnonzero(db_pks.isin(df_pks))]
+
+@metered
 def main(kwargs: Dict[str, str]) -> bool:
     """
-        This activity will prepare the dataframe with extra information in order
-        to prepare all the required queries to ingest.\n
+        This activity will prepare the extra information required to build all the
+        queries to ingest.\n
         Steps:
         \t\n- Mark as "update" those rows with a pk within database
-        \t\n- Mark the remianing rows as "insert", as they had not any match with database values
-        \t\n- Mark every row as the MOST_RECENT one
-        \t\n- Format datetime and object (string) dtype columns
-        \t\n- Render the values section for the insert or update query
+        \t\n- Mark the remianing rows as "insert", as they had not any match with database values\n
+        Only the composed pk columns of the new data are downloaded, and only those columns (plus the mark)
+        are saved, as the remaining fields are read by `GenerateInsUpdStmt` from the transformed new data.
 
         Args:
             kwargs (dict): In binding with schema:
                 - df (dict): {'container': str, 'blob': str}
-                - table (str): SQL table name
-                - db_unique_pks (list): List of tuples with all the composed pks values retrieved from database
+                - db_unique_pks (dict): {'db_unique_pks': list} with all the composed pks values retrieved from database,
+                    or a claim check for it (check `GetUniqueSetOfPksFromDb`)
         
         Returns:
-            dict: A dictionary with dumped dataframe location in blob storage and all the duplicated pks
+            dict: A dictionary with dumped dataframe location in blob storage
     """
     bm = BlobManager()
 
-    # Get transformed new data (dataframe)
-    df = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'])
-    df[DF_SQL_STMT_COL] = ''
-
-    dup_pks = []
-    # Find all matching rows based on unique pks within database
-    for db_pk in kwargs['db_unique_pks']:
-        # Retrieve all row's indexes for any new data pk that matches a unique database pk
-        i_rows_to_update = df.loc[(df['ID'] == db_pk[0]) & (df['MUESTRA'] == db_pk[1]) & (df['RESULTADO'] == db_pk[2])].index.tolist()
-        
-        # Mark each row as an 'update' sql statement (this will be used in the future to build the proper insert or update statements)
-        if i_rows_to_update:
-            dup_pks.append(db_pk)
-            for i_row in i_rows_to_update:
-                df.loc[i_row, DF_SQL_STMT_COL] = 'update'
-    
-    # Mark each remaining row with str('') as value in the new DF_SQL_STMT_COL field as an 'insert' sql statement (this will be used in the future to build the proper insert or update statements)
-    df.loc[df[DF_SQL_STMT_COL] == '', DF_SQL_STMT_COL] = 'insert'
-    
-    # Those registers with update statement will have to update the older dbs
-    # registers with MOST_UPDATED field as 0 (not the most updated register).
-    # On the other hand, all the registers within the new data will be inserted, and so,
-    # all these will be the newest ones.
-    # Therefore... All the new registers need to be marked as the most recent ones
-    df[DF_MOST_UPDATED_COL] = 1
-
-    # Prepare object and datetime dtypes for sql statement
-    for c in df.select_dtypes(include=['object']).columns:
-        if c in ['insert_stmt', 'sql_stmt']:
-            continue
-        df[c] = df[c].map("'{}'".format)
-
-    for c in df.select_dtypes(include=['datetime64']).columns:
-        if c in ['insert_stmt', 'sql_stmt']:
-            continue
-        df[c] = df[c].map("CAST('{}' AS DATETIME2)".format)
+    # Get the composed pks of the transformed new data (dataframe)
+    df = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'], columns=TABLE_PK)
+    record_rows(len(df))
 
-    # Generate values statement for every row
-    aux = []
-    for c in df.columns:
-        if c in ['insert_stmt', 'sql_stmt']:
-            continue
-        aux.append('{' + f'0[{c}]' + '}')
-    agg_str = '(' + ','.join(aux) + ')'
-    df['insert_stmt'] = df.agg(agg_str.format, axis=1)
+    # Mark each row as an 'update' (pk within database) or an 'insert' sql statement (this will be used in the future
+    # to build the proper insert or update statements)
+    label_rows(df, build_pk_index(check_out(kwargs['db_unique_pks'], bm)['db_unique_pks']))
 
-    # Save the modified dataframe in blob storage
-    return {'df': bm.upload_by_chunks(df, kwargs['df']['container'], 'df_stmts.ftr'), 'duplicated_pks': dup_pks}
+    # Save the marked pks in blob storage
+    df_stmts = bm.upload_by_chunks(df, kwargs['df']['container'], 'df_stmts.ftr')
+    # This activity is the only consumer of the database pks
+    release(kwargs['db_unique_pks'], bm)
+    return {'df': df_stmts}
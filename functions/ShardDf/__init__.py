@@ -0,0 +1,51 @@
+import logging
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+from ..utils.blob_manager import BlobManager
+from ..utils.metrics import metered, record_rows
+
+TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
+
+def assign_shards(df: pd.DataFrame, shard_count: int) -> np.ndarray:
+    """
+        This function assigns every row to a shard based on a hash of its composed pk, so all the
+        rows (and registers within database) for a composed pk are handled by the same shard.
+
+        Args:
+            df (pd.DataFrame): New data
+            shard_count (int): Number of shards
+
+        Returns:
+            np.ndarray: Shard number (from 0 to shard_count - 1) for every row
+    """
+    return pd.util.hash_pandas_object(df[TABLE_PK], index=False).values % shard_count
+
+@metered
+def main(kwargs: Dict[str, Union[Dict[str, str], int]]) -> List[Dict[str, str]]:
+    """
+        This activity partitions the transformed new data into shards by a hash of the composed pk
+        (ID, MUESTRA, RESULTADO) and saves every shard within blob storage, so they can be ingested in parallel.
+
+        Args:
+            kwargs (dict): In binding with schema:
+                - df (dict): {'container': str, 'blob': str} (transformed new data)
+                - shard_count (int): Number of shards
+
+        Returns:
+            list: Location of every shard within blob storage ({'container': str, 'blob': str})
+    """
+    bm = BlobManager()
+    df = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'])
+    record_rows(len(df))
+
+    shards = assign_shards(df, kwargs['shard_count'])
+    locations = []
+    for i in range(kwargs['shard_count']):
+        df_shard = df[shards == i]
+        logging.debug(f'Shard {i}: {len(df_shard)} rows')
+        locations.append(bm.upload_by_chunks(df_shard, kwargs['df']['container'], f'df_transformed_shard_{i}.ftr'))
+
+    return locations
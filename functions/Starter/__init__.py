@@ -13,7 +13,12 @@ import azure.durable_functions as df
 
 async def main(req: func.HttpRequest, starter: str) -> func.HttpResponse:
     client = df.DurableOrchestrationClient(starter)
-    instance_id = await client.start_new(req.route_params["functionName"], None, None)
+    # A JSON body (if any) is forwarded as the orchestrator input (e.g. {"full_rescan": true} for ModifyDB)
+    try:
+        client_input = req.get_json()
+    except ValueError:
+        client_input = None
+    instance_id = await client.start_new(req.route_params["functionName"], None, client_input)
 
     logging.info(f"Started orchestration with ID = '{instance_id}'.")
 
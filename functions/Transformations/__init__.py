@@ -1,11 +1,29 @@
 import logging
 import pandas as pd
 from io import BytesIO
-from typing import Dict
+from typing import Dict, Optional
 from datetime import datetime
 
 from ..utils.blob_manager import BlobManager
+from ..utils.metrics import metered, record_rows
 
+def apply_transformations(df: pd.DataFrame, copy_date: Optional[datetime] = None) -> pd.DataFrame:
+    """
+        This function performs every transformation over the new data (inplace).
+
+        Args:
+            df (pd.DataFrame): New data
+            copy_date (datetime, optional): Value for "FECHA_COPIA" field (current datetime if not provided).
+                It has to be provided when the new data is transformed in chunks, so every chunk gets the same value
+
+        Returns:
+            pd.DataFrame: Transformed new data
+    """
+    # Transformation 1 - Fill up "FECHA_COPIA" field with current datetime
+    df['FECHA_COPIA'] = copy_date or datetime.now()
+    return df
+
+@metered
 def main(kwargs: Dict[str, str]) -> bool:
     """
         This activity funtion intends to transform data before uploading to the proper database.\n
@@ -22,9 +40,7 @@ def main(kwargs: Dict[str, str]) -> bool:
                     - blob (str): Name of the feather file blob
     """
     bm = BlobManager()
-    df = bm.download_blob_as_df(kwargs['container'], kwargs['blob'])
-
-    # Transformation 1 - Fill up "FECHA_COPIA" field with current datetime
-    df['FECHA_COPIA'] = datetime.now()
+    df = apply_transformations(bm.download_blob_as_df(kwargs['container'], kwargs['blob']))
+    record_rows(len(df))
 
     return bm.upload_by_chunks(df, kwargs['container'], 'df_transformed.ftr')
@@ -2,7 +2,9 @@ import logging
 from typing import List
 
 from ..utils.db_manager import DBManager
+from ..utils.metrics import metered, record_rows
 
+@metered
 def main(queries: List[str]) -> bool:
     """
         This activity will execute and commit every update previously generated.\n
@@ -13,6 +15,7 @@ def main(queries: List[str]) -> bool:
     dbm = DBManager(_type='work')
     # Iterate and send requests for every update operation detected previously
     update_rows_uploaded = dbm.execute_and_commit_to_db(queries)
+    record_rows(update_rows_uploaded)
 
     # Iterate and send requests for every insert operation
     return {'update_rows_uploaded': update_rows_uploaded}
@@ -1,20 +1,163 @@
+import os
+import uuid
 import logging
-from typing import Dict
+from typing import Dict, List, Optional
 
-from ..utils.db_manager import DBManager
+import pyodbc
+import pyarrow as pa
 
-def main(kwargs: Dict[str, str]) -> bool:
+from ..utils.db_manager import DBManager, BulkData
+from ..utils.async_db_manager import AsyncDBManager
+from ..utils.claim_check import check_out, release
+from ..utils.metrics import metered, record_rows
+
+# Number of connections the new rows are loaded across (check `upload_statements_concurrently`)
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', 1))
+# Prefix of the global temporary tables the new rows are loaded into when UPLOAD_CONCURRENCY is greater than 1
+UPLOAD_STAGING_PREFIX = '##upload_'
+
+def reset_most_recent(dbm: DBManager, conn: pyodbc.Connection, update: Dict) -> int:
+    """
+        This function bulk loads the composed pks to update into a session temporary table and resets the
+        MOST_RECENT field of every matching register with a single set-based update (check `GenerateInsUpdStmt.build_update_batch`).\n
+        Nothing is commited, the caller handles the transaction.
+
+        Args:
+            dbm (DBManager): Database manager for the working database
+            conn (pyodbc.Connection): Opened connection (the temporary table lives within its session)
+            update (dict): MOST_RECENT reset description
+
+        Returns:
+            int: Number of composed pks loaded (new rows which update older registers)
+    """
+    _pks = ','.join(update['pks'])
+    placeholders = ','.join('?' for _ in update['pks'])
+
+    with dbm.uncommited_cursor(conn) as curr:
+        curr.execute(f'SELECT TOP 0 {_pks} INTO {update["temp_table"]} FROM {update["table"]}')
+        update_rows_uploaded = dbm.bulk_write(f'INSERT INTO {update["temp_table"]} ({_pks}) VALUES ({placeholders})', update['columns'],
+                                              rows_per_transaction=None, conn=conn)
+
+        curr.execute(update['sql'])
+        logging.debug(f'{curr.rowcount} registers marked as not MOST_RECENT')
+        curr.execute(f'DROP TABLE {update["temp_table"]}')
+
+    return update_rows_uploaded
+
+def upload_statements(dbm: DBManager, statements: Dict[str, Dict], conn: Optional[pyodbc.Connection] = None) -> Dict[str, int]:
+    """
+        This function resets the MOST_RECENT field of the updated registers and inserts the new rows within a single transaction.
+
+        Args:
+            dbm (DBManager): Database manager for the working database
+            statements (dict): Update and insert batch descriptions (check `GenerateInsUpdStmt`)
+            conn (pyodbc.Connection, optional): Opened connection to reuse. If provided, nothing is commited
+                and the caller handles the transaction (e.g. to upload several chunks within the same one)
+
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows
+    """
+    if conn is None:
+        with dbm.connection() as conn:
+            resume = upload_statements(dbm, statements, conn)
+            conn.commit()
+        logging.debug('Updates and inserts commited')
+        return resume
+
+    # The MOST_RECENT reset has to be done before inserting the new rows. Both go within the same transaction
+    update_rows_uploaded = reset_most_recent(dbm, conn, statements['update'])
+    # Send every insert operation (packed in multi-row statements if requested, check `GenerateInsUpdStmt.build_insert_batches`)
+    insert = statements['insert']
+    if insert.get('strategy') == 'multirow':
+        insert_rows_uploaded = dbm.multirow_insert(insert['table'], insert['columns'], rows_per_statement=insert['rows_per_statement'],
+                                                   rows_per_transaction=None, conn=conn)
+    else:
+        insert_rows_uploaded = dbm.bulk_write(insert['sql'], insert['columns'], rows_per_transaction=None, conn=conn)
+
+    return {'update_rows_uploaded': update_rows_uploaded, 'insert_rows_uploaded': insert_rows_uploaded}
+
+def split_rows(data: BulkData, n: int) -> List[BulkData]:
+    # Contiguous row slices of column arrays (a dict of lists or an Arrow table)
+    n_rows = data.num_rows if isinstance(data, pa.Table) else len(next(iter(data.values()), []))
+    size = -(-n_rows // n) if n_rows else 0
+    if isinstance(data, pa.Table):
+        return [data.slice(start, size) for start in range(0, n_rows, size)] if size else []
+    return [{col: values[start:start + size] for col, values in data.items()} for start in range(0, n_rows, size)] if size else []
+
+def create_upload_staging(dbm: DBManager, table: str, columns: List[str]) -> str:
+    # Global temporary table (session temporary tables are only visible within the session that created it), commited so
+    # the concurrent sessions can load it. It lives until dropped, or until its session is closed
+    staging = f'{UPLOAD_STAGING_PREFIX}{uuid.uuid4().hex}'
+    dbm.execute_sql_command(f'SELECT TOP 0 {",".join(columns)} INTO {staging} FROM {table}')
+    return staging
+
+def reset_and_insert_from_staging(dbm: DBManager, update: Dict, staging: str, columns: List[str]) -> Dict[str, int]:
+    cols = ','.join(columns)
+    with dbm.connection() as conn:
+        # The MOST_RECENT reset has to be done before inserting the new rows. Both go within the same transaction
+        update_rows_uploaded = reset_most_recent(dbm, conn, update)
+        with dbm.uncommited_cursor(conn) as curr:
+            curr.execute(f'INSERT INTO {update["table"]} ({cols}) SELECT {cols} FROM {staging}')
+            insert_rows_uploaded = curr.rowcount
+        conn.commit()
+    logging.debug('Updates and inserts commited')
+
+    return {'update_rows_uploaded': update_rows_uploaded, 'insert_rows_uploaded': insert_rows_uploaded}
+
+async def upload_statements_concurrently(adbm: AsyncDBManager, statements: Dict[str, Dict], concurrency: int) -> Dict[str, int]:
     """
-        This activity will execute and commit every update and insert query
-        previously generated.\n
-        
+        This function loads the new rows, split into concurrency slices, into a global temporary table, every slice
+        concurrently on its own connection. Then the MOST_RECENT field of the updated registers is reset and the staged
+        rows are inserted with a single INSERT ... SELECT, both within a single transaction (as `upload_statements`),
+        so a failure leaves the target table untouched.
+
         Args:
-            kwargs (dict): A dictionary with all the updated and insert statements
+            adbm (AsyncDBManager): Async database manager for the working database
+            statements (dict): Update and insert batch descriptions (check `GenerateInsUpdStmt`)
+            concurrency (int): Number of slices the inserts are split into
+
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows
+    """
+    insert = statements['insert']
+    columns = insert['columns'].schema.names if isinstance(insert['columns'], pa.Table) else list(insert['columns'])
+    staging = await adbm.run(create_upload_staging, adbm.dbm, statements['update']['table'], columns)
+
+    try:
+        # Only the staging table is written (and commited) by the concurrent sessions
+        slices = split_rows(insert['columns'], concurrency)
+        if insert.get('strategy') == 'multirow':
+            await adbm.gather(adbm.multirow_insert(staging, s, rows_per_statement=insert['rows_per_statement']) for s in slices)
+        else:
+            sql = f'INSERT INTO {staging} ({",".join(columns)}) VALUES ({",".join("?" for _ in columns)})'
+            await adbm.gather(adbm.bulk_write(sql, s) for s in slices)
+
+        return await adbm.run(reset_and_insert_from_staging, adbm.dbm, statements['update'], staging, columns)
+    finally:
+        await adbm.execute_sql_command(f'DROP TABLE {staging}')
+
+@metered
+async def main(kwargs: Dict[str, Dict]) -> Dict[str, int]:
     """
-    dbm = DBManager(_type='work')
-    # Iterate and send requests for every update operation detected previously
-    update_rows_uploaded = dbm.execute_and_commit_to_db(kwargs['update_stmts'])
-    insert_rows_uploaded = dbm.execute_and_commit_to_db(kwargs['insert_stmts'])
+        This activity will reset the MOST_RECENT field of the registers updated by the new data (a single
+        set-based update) and insert the new rows, binding their values in batches, within a single transaction.\n
+        If UPLOAD_CONCURRENCY is greater than 1, the new rows are loaded concurrently over that many connections
+        into a staging table first (check `upload_statements_concurrently`).
+
+        Args:
+            kwargs (dict): A dictionary with the update and insert batch descriptions (check `GenerateInsUpdStmt`),
+                or a claim check for it
 
-    # Iterate and send requests for every insert operation
-    return {'update_rows_uploaded': update_rows_uploaded, 'insert_rows_uploaded': insert_rows_uploaded}
\ No newline at end of file
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows
+    """
+    statements = check_out(kwargs)
+    async with AsyncDBManager(_type='work', max_concurrency=UPLOAD_CONCURRENCY) as adbm:
+        if UPLOAD_CONCURRENCY > 1:
+            resume = await upload_statements_concurrently(adbm, statements, UPLOAD_CONCURRENCY)
+        else:
+            resume = await adbm.run(upload_statements, adbm.dbm, statements)
+    # The statements are not needed once uploaded (this activity is their only consumer)
+    release(kwargs)
+    record_rows(sum(resume.values()))
+    return resume
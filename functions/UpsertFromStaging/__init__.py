@@ -0,0 +1,112 @@
+import logging
+from itertools import chain
+from typing import Dict, Iterable, List, Union
+
+import pandas as pd
+import pyarrow as pa
+
+from ..utils.blob_manager import BlobManager
+from ..utils.db_manager import DBManager
+from ..utils.metrics import metered, record_rows
+
+TABLE_PK = ['ID', 'MUESTRA', 'RESULTADO']
+STAGING_TABLE = '#staging'
+DF_MOST_UPDATED_COL = 'MOST_RECENT'
+
+def build_join_clause(pks: List[str], left: str = 't', right: str = 's', sep: str = ' AND ') -> str:
+    return sep.join(f'{left}.{pk}={right}.{pk}' for pk in pks)
+
+def build_staging_statements(table: str, columns: List[str]) -> Dict[str, str]:
+    """
+        This function builds the statements of the staging upsert (check `upsert_through_staging`).
+
+        Args:
+            table (str): Target SQL table
+            columns (list): New data columns
+
+        Returns:
+            dict: A dictionary with the 'create', 'load' (parameterized), 'update_count', 'most_recent_reset', 'insert' and 'drop' statements
+    """
+    cols = ','.join(columns)
+    _join = build_join_clause(TABLE_PK)
+    return {
+        'create': f'SELECT TOP 0 {cols} INTO {STAGING_TABLE} FROM {table}',
+        'load': f'INSERT INTO {STAGING_TABLE} ({cols}) VALUES ({",".join("?" for _ in columns)})',
+        'update_count': f'SELECT COUNT(*) FROM {STAGING_TABLE} s WHERE EXISTS (SELECT 1 FROM {table} t WHERE {_join})',
+        'most_recent_reset': f'UPDATE t SET t.{DF_MOST_UPDATED_COL}=0 FROM {table} t INNER JOIN (SELECT DISTINCT {",".join(TABLE_PK)} FROM {STAGING_TABLE}) s ON {_join}',
+        'insert': f'INSERT INTO {table} ({cols},{DF_MOST_UPDATED_COL}) SELECT {",".join("s." + c for c in columns)},1 FROM {STAGING_TABLE} s',
+        'drop': f'DROP TABLE {STAGING_TABLE}'
+    }
+
+def upsert_through_staging(dbm: DBManager, table: str, df: Union[pd.DataFrame, Iterable[pd.DataFrame]]) -> Dict[str, int]:
+    """
+        This function bulk loads the new data into a session temporary table (with the same column types
+        as the target table) and then classifies and writes it with set-based statements, all within a
+        single transaction:\n
+        \t\n- Count the new rows whose composed pk already exists within the target table (update rows)
+        \t\n- Mark every existing register for those composed pks as not MOST_RECENT
+        \t\n- Insert every new row as the MOST_RECENT one\n
+        The new data may come in chunks (e.g. a csv read in chunks), every one of them is loaded into the
+        same temporary table before anything is classified, so a failure leaves the target table untouched.
+
+        Args:
+            dbm (DBManager): Database manager for the working database
+            table (str): Target SQL table
+            df (pd.DataFrame, iterable of pd.DataFrame): New data to upload (or its chunks, all with the same columns)
+
+        Returns:
+            dict: The number of updated and inserted rows, with the same meaning as the `UploadNewData` activity results
+    """
+    chunks = iter([df] if isinstance(df, pd.DataFrame) else df)
+    first = next(chunks, None)
+    if first is None:
+        return {'update_rows_uploaded': 0, 'insert_rows_uploaded': 0}
+
+    stmts = build_staging_statements(table, list(first.columns))
+
+    with dbm.connection() as conn, conn.cursor() as curr:
+        curr.execute(stmts['create'])
+
+        for chunk in chain([first], chunks):
+            logging.debug(f'Bulk loading {len(chunk)} rows into {STAGING_TABLE}')
+            # The staging load is part of the upsert transaction, so no intermediate commits are issued
+            dbm.bulk_write(stmts['load'], pa.Table.from_pandas(chunk, preserve_index=False), rows_per_transaction=None, conn=conn)
+
+        curr.execute(stmts['update_count'])
+        update_rows_uploaded = curr.fetchone()[0]
+
+        curr.execute(stmts['most_recent_reset'])
+        logging.debug(f'{curr.rowcount} registers marked as not {DF_MOST_UPDATED_COL}')
+
+        curr.execute(stmts['insert'])
+        insert_rows_uploaded = curr.rowcount
+        # The session outlives this function (pooled connection)
+        curr.execute(stmts['drop'])
+
+        curr.commit()
+        logging.debug('Staging upsert commited')
+
+    return {'update_rows_uploaded': update_rows_uploaded, 'insert_rows_uploaded': insert_rows_uploaded}
+
+@metered
+def main(kwargs: Dict[str, str]) -> Dict[str, int]:
+    """
+        This activity is the server-side alternative to the `GetUniqueSetOfPksFromDb` -> `SetStmtPerNewRow` ->
+        `GenerateInsUpdStmt` -> `UploadNewData` chain.\n
+        The new data is staged within SQL Server and the insert/update classification is performed there,
+        so the whole set of composed pks within database never leaves it.
+
+        Args:
+            kwargs (dict): In binding with schema:
+                - df (dict): {'container': str, 'blob': str} (transformed new data)
+                - table (str): SQL table name
+
+        Returns:
+            dict: A dictionary with the number of updated and inserted rows
+    """
+    bm = BlobManager()
+    df = bm.download_blob_as_df(kwargs['df']['container'], kwargs['df']['blob'])
+    record_rows(len(df))
+
+    dbm = DBManager(_type='work')
+    return upsert_through_staging(dbm, kwargs['table'], df)
@@ -0,0 +1,69 @@
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Sequence, Union
+
+from .db_manager import DBManager, BulkData, BULK_ROWS_PER_BATCH, BULK_ROWS_PER_TRANSACTION
+
+# Maximum number of queries in flight at once (every one of them holds a pooled connection, so keep
+# it within SQL_POOL_MAX_SIZE, otherwise the exceeding queries wait for a connection to be released)
+SQL_MAX_CONCURRENCY = int(os.environ.get('SQL_MAX_CONCURRENCY', 4))
+
+
+class AsyncDBManager:
+    def __init__(self, _type: str, max_concurrency: int = SQL_MAX_CONCURRENCY):
+        """
+            Asyncio interface over `DBManager`: every call runs within a thread pool (pyodbc calls are blocking)
+            on its own pooled connection, so independent queries can be awaited concurrently.\n
+            Use it as an async context manager, so the thread pool is shut down once the work is done.
+
+            Args:
+                _type (str): Database type ('work' or 'test')
+                max_concurrency (int, default=SQL_MAX_CONCURRENCY): Maximum number of queries running at once
+        """
+        self.dbm = DBManager(_type=_type)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f'sql-{_type}')
+
+    async def __aenter__(self) -> 'AsyncDBManager':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        # The call runs within a copy of the caller context, so its round-trips are recorded within the activity metrics
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, contextvars.copy_context().run, partial(func, *args, **kwargs))
+
+    async def execute_sql_command(self, sql: str, ret: bool = False, params: Optional[Sequence] = None) -> Union[None, list]:
+        return await self.run(self.dbm.execute_sql_command, sql, ret=ret, params=params)
+
+    async def bulk_write(self, sql: str, data: BulkData, rows_per_batch: int = BULK_ROWS_PER_BATCH,
+                         rows_per_transaction: Optional[int] = BULK_ROWS_PER_TRANSACTION) -> int:
+        return await self.run(self.dbm.bulk_write, sql, data, rows_per_batch, rows_per_transaction)
+
+    async def multirow_insert(self, table: str, data: BulkData, rows_per_statement: Optional[int] = None,
+                              rows_per_transaction: Optional[int] = BULK_ROWS_PER_TRANSACTION) -> int:
+        return await self.run(self.dbm.multirow_insert, table, data, rows_per_statement, rows_per_transaction)
+
+    async def gather(self, aws: Iterable[Awaitable]) -> List[Any]:
+        """
+            This function awaits every query concurrently (at most max_concurrency of them run at once,
+            the rest wait within the thread pool queue).
+
+            Args:
+                aws (iterable): Awaitables created with this manager methods
+
+            Returns:
+                list: Results, in the same order as aws
+        """
+        aws = list(aws)
+        logging.debug(f'Running {len(aws)} queries with up to {self.max_concurrency} at once')
+        return await asyncio.gather(*aws)
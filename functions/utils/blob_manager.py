@@ -1,21 +1,212 @@
 import os
+import base64
 import logging
-from io import BytesIO
-from typing import Dict
+import contextvars
+from io import BytesIO, RawIOBase
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
-from azure.storage.blob import BlobServiceClient
+import pyarrow as pa
+import pyarrow.compute as pc
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from azure.storage.blob import BlobBlock, BlobClient, BlobServiceClient
+
+from . import metrics
 
 # The MyStorageConnectionAppSetting environment variable is setted up in local.settings.json file
 # regarding the functions app
 STORAGE_CONNECTION_STRING = os.environ.get('MyStorageConnectionAppSetting', 'DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;AccountKey=Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;')
 STORAGE_CONTAINER = 'intermediate-results'
+BLOCK_SIZE = 4*1024*1024
+MAX_CONCURRENCY = int(os.environ.get('BLOB_MAX_CONCURRENCY', 4))
+ROWS_PER_BATCH = 64*1024
+READ_AHEAD_SIZE = 64*1024
+# Compression codec of the intermediate feather files ('zstd', 'lz4' or 'none') and its level (codec default if not set).
+# Buffers are decompressed transparently when read, whatever the codec they were written with
+FEATHER_CODECS = ('zstd', 'lz4', 'none')
+FEATHER_COMPRESSION = os.environ.get('FEATHER_COMPRESSION', 'zstd')
+FEATHER_COMPRESSION_LEVEL = int(os.environ['FEATHER_COMPRESSION_LEVEL']) if os.environ.get('FEATHER_COMPRESSION_LEVEL') else None
+FILTER_OPERATORS = {
+    '==': lambda field, value: field == value,
+    '!=': lambda field, value: field != value,
+    '<': lambda field, value: field < value,
+    '<=': lambda field, value: field <= value,
+    '>': lambda field, value: field > value,
+    '>=': lambda field, value: field >= value,
+    'in': lambda field, value: field.isin(value)
+}
+
+# Row filter as a list of (column, operator, value) conditions, all of them must be satisfied
+Filters = List[Tuple[str, str, Any]]
 
 
 class BlobDoesNotExistError(Exception):
     pass
 
 
+class CompressionCodecError(Exception):
+    pass
+
+
+def build_filter_expression(filters: Filters) -> pc.Expression:
+    expression = None
+    for col, op, value in filters:
+        condition = FILTER_OPERATORS[op](pc.field(col), value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def build_ipc_write_options(compression: str = FEATHER_COMPRESSION, level: Optional[int] = FEATHER_COMPRESSION_LEVEL) -> pa.ipc.IpcWriteOptions:
+    """
+        This function builds the Arrow IPC (feather V2) write options for a compression codec.
+
+        Args:
+            compression (str, default=FEATHER_COMPRESSION): One of FEATHER_CODECS
+            level (int, optional): Compression level (codec default if not provided, ignored for 'none')
+
+        Returns:
+            pa.ipc.IpcWriteOptions: Write options (every record batch buffer is compressed on its own)
+
+        Raises:
+            CompressionCodecError: This exception is raised when the codec is not supported
+    """
+    if compression not in FEATHER_CODECS:
+        raise CompressionCodecError(f'Compression codec {compression} not supported. Choose one of {FEATHER_CODECS}')
+    if compression == 'none':
+        return pa.ipc.IpcWriteOptions(compression=None)
+    return pa.ipc.IpcWriteOptions(compression=pa.Codec(compression, compression_level=level))
+
+class BlobRangeReader(RawIOBase):
+    """
+        Readable and seekable file-like object over a blob, where every read is a ranged download.\n
+        Reads shorter than READ_AHEAD_SIZE are extended and cached, as the feather metadata is read in small pieces.
+
+        Attrs:
+            self.blob_client (azure.storage.blob.BlobClient): Client of the blob to read
+            self.size (int): Size of the blob
+    """
+    def __init__(self, blob_client: BlobClient, size: int):
+        self.blob_client = blob_client
+        self.size = size
+        self.downloaded_bytes = 0
+        self._position = 0
+        self._cache_offset = 0
+        self._cache = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        base = {0: 0, 1: self._position, 2: self.size}[whence]
+        self._position = base + offset
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._position
+        size = min(size, self.size - self._position)
+        if size <= 0:
+            return b''
+
+        start = self._position - self._cache_offset
+        if not (0 <= start and start + size <= len(self._cache)):
+            length = min(max(size, READ_AHEAD_SIZE), self.size - self._position)
+            self._cache = self.blob_client.download_blob(offset=self._position, length=length).readall()
+            self._cache_offset = self._position
+            self.downloaded_bytes += length
+            metrics.add('blob_bytes_read', length)
+            start = 0
+
+        self._position += size
+        return self._cache[start:start + size]
+
+
+class BlockBlobWriter(RawIOBase):
+    """
+        Writable file-like object that stages every block written to it as a block of a block blob.\n
+        Blocks are staged concurrently, but no more than max_concurrency blocks are in flight at once
+        (writes wait for a free slot), so the memory held is bounded by (max_concurrency + 1) * block_size.\n
+        Nothing is visible in the blob until `commit` is called. Close it (or use it as a context manager) once done,
+        whether it was commited or not, so the staging threads are stopped.
+
+        Attrs:
+            self.blob_client (azure.storage.blob.BlobClient): Client of the destination blob
+            self.block_size (int): Size of every staged block (except the last one)
+    """
+    def __init__(self, blob_client: BlobClient, block_size: int = BLOCK_SIZE, max_concurrency: int = MAX_CONCURRENCY):
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self._buffer = bytearray()
+        self._position = 0
+        self._block_list: List[BlobBlock] = []
+        self._futures = []
+        self._slots = BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, b) -> int:
+        self._buffer += b
+        self._position += len(b)
+        while len(self._buffer) >= self.block_size:
+            self._stage(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(b)
+
+    def _stage(self, data: bytes) -> None:
+        # Block ids must have the same length within a blob
+        block_id = base64.b64encode(f'{len(self._block_list):08d}'.encode()).decode()
+        self._block_list.append(BlobBlock(block_id=block_id))
+        logging.debug(f'Staging block {len(self._block_list)} ({len(data)} bytes)')
+
+        self._slots.acquire()
+        future = self._executor.submit(self.blob_client.stage_block, block_id, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def commit(self, metadata: Optional[Dict[str, str]] = None) -> int:
+        """
+            This function stages the remaining buffered data, waits for every staged block and commits
+            the block list, replacing the previous content of the blob.
+
+            Args:
+                metadata (dict, optional): Blob metadata to set along with the block list
+
+            Returns:
+                int: Number of bytes written to the blob
+        """
+        if self._buffer:
+            self._stage(bytes(self._buffer))
+            self._buffer.clear()
+        for future in self._futures:
+            # Any staging error is raised here
+            future.result()
+
+        self.blob_client.commit_block_list(self._block_list, metadata=metadata)
+        metrics.add('blob_bytes_written', self._position)
+        logging.debug(f'{len(self._block_list)} blocks commited ({self._position} bytes)')
+        return self._position
+
+    def close(self) -> None:
+        # Blocks in flight are waited for and the pending ones cancelled. Blocks staged but never commited
+        # are not visible, and are discarded by the service
+        if not self.closed:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+
 class BlobManager:
     """
         This class exists to refactor all upload and download functionalities againts blob storage.\n
@@ -27,14 +218,27 @@ class BlobManager:
     def __init__(self):
         self.blob_service_client = BlobServiceClient.from_connection_string(STORAGE_CONNECTION_STRING)
 
-    def download_blob_as_df(self, container: str, blob: str) -> pd.DataFrame:
+    def _read_feather_batches(self, blob_client: BlobClient, size: int, indices: List[int], options: pa.ipc.IpcReadOptions) -> List[pa.RecordBatch]:
+        # Every thread uses its own reader, as ranged reads over a single file object would be serialized
+        with pa.ipc.open_file(pa.PythonFile(BlobRangeReader(blob_client, size), mode='r'), options=options) as reader:
+            return [reader.get_batch(i) for i in indices]
+
+    def download_blob_as_df(self, container: str, blob: str, columns: Optional[List[str]] = None, filters: Optional[Filters] = None,
+                            max_concurrency: int = MAX_CONCURRENCY) -> pd.DataFrame:
         """
             This functions intends to return a DataFrame based on a feather file
-            previously uploaded to blob storage.
+            previously uploaded to blob storage.\n
+            When only some columns (or rows) are needed, just the byte ranges of the requested columns are downloaded
+            (record batches are read in parallel) and only those columns are decoded. Otherwise the whole blob
+            is downloaded with parallel ranged requests.
 
             Args:
                 container (str): Container in where the .ftr blob is located
                 blob (str): Name of the .ftr blob to recreate the dataframe
+                columns (list, optional): Columns to read (all of them if not provided)
+                filters (list, optional): Row filter as (column, operator, value) conditions that every returned row satisfies.
+                    Supported operators are the FILTER_OPERATORS keys. E.g. [('sql_stmt', '==', 'update')]
+                max_concurrency (int, default=MAX_CONCURRENCY): Maximum number of parallel ranged requests
             
             Returns:
                 pd.DataFrame: DataFrame recreated based on .ftr file in blob storage
@@ -46,60 +250,125 @@ class BlobManager:
         container_client = self.blob_service_client.get_container_client(container)
         blob_client = container_client.get_blob_client(blob)
 
-        if not blob_client.exists():
+        try:
+            size = blob_client.get_blob_properties().size
+        except ResourceNotFoundError:
             raise BlobDoesNotExistError(f'The blob {blob} in container {container} does not exists.')
 
-        data = blob_client.download_blob()
-        buffer = BytesIO()
-        data.download_to_stream(buffer)
-        return pd.read_feather(buffer)
+        if columns is None and filters is None:
+            data = blob_client.download_blob(max_concurrency=max_concurrency).readall()
+            metrics.add('blob_bytes_read', len(data))
+            return pd.read_feather(BytesIO(data))
+
+        with pa.ipc.open_file(pa.PythonFile(BlobRangeReader(blob_client, size), mode='r')) as reader:
+            schema = reader.schema
+            num_batches = reader.num_record_batches
 
-    def upload_by_chunks(self, df: pd.DataFrame, container: str, filename: str, chunk_size: int = 4*1024*1024) -> Dict[str, str]:
+        columns = columns if columns is not None else schema.names
+        read_columns = list(dict.fromkeys(columns + [f[0] for f in (filters or [])]))
+        # Decoded batches keep the file column order
+        included_fields = sorted(schema.get_field_index(c) for c in read_columns)
+        options = pa.ipc.IpcReadOptions(included_fields=included_fields)
+
+        # Record batches are spread among the threads, and put back in order afterwards. Every thread runs within
+        # a copy of the caller context, so the bytes it reads are recorded within the activity metrics.
+        # No more threads than batches are used, as every thread opens its own reader (and reads the footer again)
+        n_groups = min(max_concurrency, num_batches)
+        groups = [list(range(i, num_batches, n_groups)) for i in range(n_groups)]
+        batches = {}
+        if groups:
+            with ThreadPoolExecutor(max_workers=n_groups) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, self._read_feather_batches, blob_client, size, indices, options) for indices in groups]
+                results = [future.result() for future in futures]
+            batches = {i: batch for indices, group_batches in zip(groups, results) for i, batch in zip(indices, group_batches)}
+        logging.debug(f'{num_batches} record batches read for columns {read_columns}')
+
+        projected_schema = pa.schema([schema.field(i) for i in included_fields], metadata=schema.metadata)
+        table = pa.Table.from_batches([batches[i] for i in range(num_batches)], schema=projected_schema)
+        if filters:
+            table = table.filter(build_filter_expression(filters))
+
+        return table.select(columns).to_pandas()
+
+    def _write_feather(self, df: pd.DataFrame, blob_client: BlobClient, chunk_size: int, max_concurrency: int, rows_per_batch: int,
+                       compression: str, compression_level: Optional[int]) -> int:
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        options = build_ipc_write_options(compression, compression_level)
+
+        # The writer is closed even if the serialization fails, so its staging threads do not outlive the call
+        with BlockBlobWriter(blob_client, chunk_size, max_concurrency) as writer:
+            # Feather (V2) is the Arrow IPC file format, so record batches can be streamed into the blob one at a time
+            with pa.ipc.new_file(pa.PythonFile(writer, mode='w'), schema, options=options) as ipc_writer:
+                for start in range(0, len(df), rows_per_batch):
+                    ipc_writer.write_batch(pa.RecordBatch.from_pandas(df.iloc[start:start + rows_per_batch], schema=schema, preserve_index=False))
+
+            # The codec is recorded within the blob metadata (besides the feather file itself), so it can be inspected without reading the blob
+            return writer.commit(metadata={'compression': compression, 'compression_level': str(compression_level or 'default')})
+
+    def upload_bytes(self, container: str, blob: str, data: bytes, metadata: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        blob_client = self.blob_service_client.get_container_client(container).get_blob_client(blob)
+        blob_client.upload_blob(data, blob_type='BlockBlob', overwrite=True, metadata=metadata, max_concurrency=MAX_CONCURRENCY)
+        metrics.add('blob_bytes_written', len(data))
+        logging.debug(f'{len(data)} bytes uploaded to {container}/{blob}')
+        return {'container': container, 'blob': blob}
+
+    def download_bytes(self, container: str, blob: str) -> bytes:
+        blob_client = self.blob_service_client.get_container_client(container).get_blob_client(blob)
+        try:
+            data = blob_client.download_blob(max_concurrency=MAX_CONCURRENCY).readall()
+        except ResourceNotFoundError:
+            raise BlobDoesNotExistError(f'The blob {blob} in container {container} does not exists.')
+        metrics.add('blob_bytes_read', len(data))
+        return data
+
+    def delete_blob(self, container: str, blob: str) -> None:
+        blob_client = self.blob_service_client.get_container_client(container).get_blob_client(blob)
+        try:
+            blob_client.delete_blob()
+        except ResourceNotFoundError:
+            logging.debug(f'The blob {blob} in container {container} was already deleted')
+
+    def upload_by_chunks(self, df: pd.DataFrame, container: str, filename: str, chunk_size: int = BLOCK_SIZE,
+                         max_concurrency: int = MAX_CONCURRENCY, rows_per_batch: int = ROWS_PER_BATCH,
+                         compression: str = FEATHER_COMPRESSION, compression_level: Optional[int] = FEATHER_COMPRESSION_LEVEL) -> Dict[str, str]:
         """
             This functions intends to upload a partial result dataframe state to blob storage
             for future function activities usage.\n
-            If the blob already exists, the proper is deleted and created from scratch with this
-            execution data (this is to avoid incosistency within appended blob blocks).
+            The dataframe is serialized as feather record batches straight into blocks of a block blob, which are
+            staged concurrently and committed at the end (replacing the previous blob content, if any).\n
+            The memory used besides the dataframe is bounded by a record batch plus (max_concurrency + 1) blocks.
 
             Args:
                 df (pd.DataFrame): DataFrame to save into blob storage
                 container (str): Destination blob container
-                filename (str): New blob name for what blocks will be appended
-                chunk_size (int, default=4mb): The chunks size for what the feather file buffer
-                    will be read
+                filename (str): New blob name
+                chunk_size (int, default=4mb): The size of every staged block
+                max_concurrency (int, default=MAX_CONCURRENCY): Maximum number of blocks being staged at once
+                rows_per_batch (int, default=ROWS_PER_BATCH): Number of rows per feather record batch
+                compression (str, default=FEATHER_COMPRESSION): Compression codec, one of FEATHER_CODECS
+                compression_level (int, optional): Compression level (codec default if not provided)
             
             Returns:
                 dict: A dictionary in with the destination container and blob name where the dataframe
-                    was dumped is provided
+                    was dumped is provided, along with the compression codec used
         """
         container_client = self.blob_service_client.get_container_client(container)
-        b_buff = BytesIO()
-        df.to_feather(b_buff)
-        
-        chunks_counter = 0
         blob_client = container_client.get_blob_client(filename)
-        if not blob_client.exists():
-            logging.debug('Blob file does not exists in current container, creating a new one...')
-            blob_client.create_append_blob()
-        else:
-            logging.debug(f'Blob {filename} already exists... Deleting to avoid data inconsistency by appending block blobs')
+
+        logging.debug(f'chunk_size: {chunk_size}, max_concurrency: {max_concurrency}')
+        try:
+            uploaded_bytes = self._write_feather(df, blob_client, chunk_size, max_concurrency, rows_per_batch, compression, compression_level)
+        except HttpResponseError as e:
+            # Blobs written by previous versions are append blobs, which cannot be replaced by a block list
+            if e.error_code != 'InvalidBlobType':
+                raise
+            logging.debug(f'Blob {filename} is not a block blob... Deleting it to upload the dataframe again')
             blob_client.delete_blob()
-            blob_client.create_append_blob()
-        
-        logging.debug(f'chunk_size: {chunk_size}')
-        # After writing you need to position the pointer right in the start of the buffer to further reading
-        b_buff.seek(0)
-        while True:
-            chunks_counter += 1
-            logging.debug(f'Uploading chunk: {chunks_counter}')
-            read_data = b_buff.read(chunk_size)
-            if not read_data:
-                logging.debug('Feather file uploaded')
-                # The last "17 bytes" chunk is NOT uploaded due to EOF encounter (this is, b'' or empty byte with the object overhead)
-                break
-            blob_client.append_block(read_data)
+            uploaded_bytes = self._write_feather(df, blob_client, chunk_size, max_concurrency, rows_per_batch, compression, compression_level)
+        logging.debug(f'Feather file uploaded ({uploaded_bytes} bytes)')
         
         return {
             'container': STORAGE_CONTAINER,
-            'blob': filename
+            'blob': filename,
+            'compression': compression
         }
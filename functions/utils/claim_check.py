@@ -0,0 +1,86 @@
+import os
+import json
+import zlib
+import hashlib
+import logging
+from typing import Any, Optional
+
+from .blob_manager import BlobManager, STORAGE_CONTAINER
+
+# Activity inputs/outputs whose JSON serialization is larger than this (bytes) are stored within blob storage,
+# and only a reference to them goes through the orchestration history
+CLAIM_CHECK_THRESHOLD = int(os.environ.get('CLAIM_CHECK_THRESHOLD', 32*1024))
+CLAIM_CHECK_COMPRESSION_LEVEL = int(os.environ.get('CLAIM_CHECK_COMPRESSION_LEVEL', 6))
+CLAIM_CHECK_PREFIX = 'claims'
+CLAIM_CHECK_KEY = '__claim_check__'
+
+
+def is_claim_check(payload: Any) -> bool:
+    return isinstance(payload, dict) and CLAIM_CHECK_KEY in payload
+
+
+def check_in(payload: Any, bm: Optional[BlobManager] = None, threshold: int = CLAIM_CHECK_THRESHOLD) -> Any:
+    """
+        This function replaces a large payload with a claim check: the payload is serialized to JSON, compressed
+        and saved within blob storage. Payloads under threshold are returned as they are.\n
+        Blobs are named after the payload digest, so a replayed or retried activity overwrites the same blob.
+        The last consumer of a claim check deletes its blob once its work is done (check `release`), only the claims
+        of failed orchestrations are left behind under CLAIM_CHECK_PREFIX.
+
+        Args:
+            payload (any): JSON serializable activity input or output
+            bm (BlobManager, optional): Blob manager to upload the payload with
+            threshold (int, default=CLAIM_CHECK_THRESHOLD): Minimum JSON size (bytes) for a payload to be stored
+
+        Returns:
+            any: The payload itself, or a dictionary with schema:
+                - __claim_check__ (dict): {'container': str, 'blob': str, 'size': int} (size of the uncompressed JSON)
+    """
+    data = json.dumps(payload).encode('utf-8')
+    if len(data) < threshold:
+        return payload
+
+    compressed = zlib.compress(data, CLAIM_CHECK_COMPRESSION_LEVEL)
+    blob = f'{CLAIM_CHECK_PREFIX}/{hashlib.sha256(data).hexdigest()}.json.z'
+    location = (bm or BlobManager()).upload_bytes(STORAGE_CONTAINER, blob, compressed, metadata={'uncompressed_size': str(len(data))})
+    logging.debug(f'Payload of {len(data)} bytes checked in as {blob} ({len(compressed)} bytes)')
+
+    return {CLAIM_CHECK_KEY: {**location, 'size': len(data)}}
+
+
+def check_out(payload: Any, bm: Optional[BlobManager] = None) -> Any:
+    """
+        This function resolves a claim check into the payload it stands for (check `check_in`).
+        Any other payload is returned as it is.
+
+        Args:
+            payload (any): Activity input or output, or a claim check
+            bm (BlobManager, optional): Blob manager to download the payload with
+
+        Returns:
+            any: The original payload
+    """
+    if not is_claim_check(payload):
+        return payload
+
+    claim = payload[CLAIM_CHECK_KEY]
+    data = zlib.decompress((bm or BlobManager()).download_bytes(claim['container'], claim['blob']))
+    logging.debug(f'Payload of {len(data)} bytes checked out from {claim["blob"]}')
+    return json.loads(data)
+
+
+def release(payload: Any, bm: Optional[BlobManager] = None) -> None:
+    """
+        This function deletes the blob behind a claim check (check `check_in`). It has to be called by the last
+        consumer of the claim, once its work is done. Any other payload is ignored.
+
+        Args:
+            payload (any): Activity input or output, or a claim check
+            bm (BlobManager, optional): Blob manager to delete the blob with
+    """
+    if not is_claim_check(payload):
+        return
+
+    claim = payload[CLAIM_CHECK_KEY]
+    (bm or BlobManager()).delete_blob(claim['container'], claim['blob'])
+    logging.debug(f'Claim check {claim["blob"]} released')
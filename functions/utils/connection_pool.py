@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+from threading import Condition, Lock
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import pyodbc
+
+# Connections are kept per worker (module level), so every activity invocation within a worker reuses them
+POOL_MAX_SIZE = int(os.environ.get('SQL_POOL_MAX_SIZE', 4))
+# Idle connections older than this (seconds) are closed instead of reused
+POOL_IDLE_TIMEOUT = float(os.environ.get('SQL_POOL_IDLE_TIMEOUT', 300))
+# Maximum time (seconds) to wait for a connection when every one of them is checked out
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('SQL_POOL_CHECKOUT_TIMEOUT', 60))
+HEALTH_CHECK_QUERY = 'SELECT 1'
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, factory: Callable[[], pyodbc.Connection], max_size: int = POOL_MAX_SIZE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, checkout_timeout: float = POOL_CHECKOUT_TIMEOUT):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+
+        # Idle connections along with the time they were released (the most recently released is reused first)
+        self._idle: List[Tuple[pyodbc.Connection, float]] = []
+        self._size = 0
+        self._cond = Condition(Lock())
+        self._metrics = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time': 0.0, 'evictions': 0, 'discarded': 0}
+
+    @staticmethod
+    def _close(conn: pyodbc.Connection) -> None:
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn: pyodbc.Connection) -> bool:
+        try:
+            curr = conn.cursor()
+            try:
+                curr.execute(HEALTH_CHECK_QUERY).fetchone()
+            finally:
+                curr.close()
+            return True
+        except pyodbc.Error as e:
+            logging.debug(f'Pooled connection failed its health check: {e}')
+            return False
+
+    def _evict_idle(self) -> None:
+        # Called with the lock held
+        now = time.monotonic()
+        expired = [c for c, released in self._idle if now - released > self.idle_timeout]
+        if expired:
+            self._idle = [(c, released) for c, released in self._idle if now - released <= self.idle_timeout]
+            self._size -= len(expired)
+            self._metrics['evictions'] += len(expired)
+            for conn in expired:
+                self._close(conn)
+            logging.debug(f'{len(expired)} idle connections evicted')
+
+    def acquire(self) -> pyodbc.Connection:
+        """
+            This function checks out a connection: an idle one (if it passes the health check) or a new one
+            if the pool is not full. Otherwise, it waits until a connection is released.
+
+            Returns:
+                pyodbc.Connection: Opened connection (release it with `release`)
+
+            Raises:
+                PoolExhaustedError: This exception is raised when no connection is released within the checkout timeout
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        start = time.monotonic()
+
+        while True:
+            with self._cond:
+                self._evict_idle()
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    self._metrics['misses'] += 1
+                    conn = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['wait_time'] += time.monotonic() - start
+                        raise PoolExhaustedError(f'No connection was released within {self.checkout_timeout} seconds (pool size {self.max_size})')
+                    if not waited:
+                        self._metrics['waits'] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                    continue
+
+            if waited:
+                with self._cond:
+                    self._metrics['wait_time'] += time.monotonic() - start
+
+            # Connections are opened and checked outside the lock (both are network round-trips)
+            if conn is None:
+                try:
+                    return self.factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(conn):
+                with self._cond:
+                    self._metrics['hits'] += 1
+                return conn
+
+            self._discard(conn)
+
+    def _discard(self, conn: pyodbc.Connection) -> None:
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._metrics['discarded'] += 1
+            self._cond.notify()
+
+    def release(self, conn: pyodbc.Connection, discard: bool = False) -> None:
+        """
+            This function returns a checked out connection to the pool. Any uncommited work is rolled back,
+            so the next checkout starts with a clean transaction.
+
+            Args:
+                conn (pyodbc.Connection): Connection checked out with `acquire`
+                discard (bool): If True, the connection is closed instead (e.g. its session state is unknown after an error)
+        """
+        if not discard:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                discard = True
+
+        if discard:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[pyodbc.Connection]:
+        # The connection is discarded if the block raises, as it may keep session state (e.g. temporary tables)
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+
+    def metrics(self) -> Dict[str, Union[int, float]]:
+        with self._cond:
+            return {**self._metrics, 'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle)}
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_lock = Lock()
+
+
+def get_pool(key: str, factory: Callable[[], pyodbc.Connection]) -> ConnectionPool:
+    """
+        This function retrieves the worker pool for a database type, creating it on first use.
+
+        Args:
+            key (str): Database type ('work' or 'test')
+            factory (callable): Function opening a new connection to the database
+
+        Returns:
+            ConnectionPool: Worker pool for key
+    """
+    with _lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(factory)
+        return _pools[key]
+
+
+def pool_metrics() -> Dict[str, Dict[str, Union[int, float]]]:
+    with _lock:
+        return {key: pool.metrics() for key, pool in _pools.items()}
@@ -1,13 +1,149 @@
 import os
 import pyodbc
 import logging
-from typing import Union, List
+from itertools import chain
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import pyarrow as pa
+
+from . import connection_pool, metrics
+
+BULK_ROWS_PER_BATCH = int(os.environ.get('SQL_BULK_ROWS_PER_BATCH', 10000))
+BULK_ROWS_PER_TRANSACTION = int(os.environ.get('SQL_BULK_ROWS_PER_TRANSACTION', 100000))
+# SQL Server limits for a single statement (rows within a VALUES clause, parameters per request)
+SQL_MAX_VALUES_ROWS = 1000
+SQL_MAX_PARAMETERS = 2100
+
+BulkData = Union[Dict[str, Sequence], pa.Table, pa.RecordBatch, Iterable[pa.RecordBatch]]
 
 
 class EnvVariablesError(Exception):
     pass
 
 
+def iter_row_batches(data: BulkData, rows_per_batch: int) -> Iterator[List[tuple]]:
+    """
+        This function turns column oriented data into batches of rows ready to be bound as
+        parameters with `cursor.executemany`.
+
+        Args:
+            data (dict, pa.Table, pa.RecordBatch, iterable of pa.RecordBatch): Column arrays (a dict with
+                a sequence of values per column, in the parameters order) or Arrow batches
+            rows_per_batch (int): Maximum number of rows per yielded batch
+
+        Yields:
+            list: A list of tuples (one per row) with, at most, rows_per_batch items
+    """
+    if isinstance(data, dict):
+        cols = list(data.values())
+        n_rows = len(cols[0]) if cols else 0
+        for start in range(0, n_rows, rows_per_batch):
+            yield list(zip(*(col[start:start + rows_per_batch] for col in cols)))
+        return
+
+    if isinstance(data, pa.Table):
+        data = data.to_batches(max_chunksize=rows_per_batch)
+    elif isinstance(data, pa.RecordBatch):
+        data = [data]
+
+    for batch in data:
+        for start in range(0, batch.num_rows, rows_per_batch):
+            chunk = batch.slice(start, rows_per_batch)
+            yield list(zip(*(col.to_pylist() for col in chunk.columns)))
+
+
+def max_rows_per_values(n_cols: int) -> int:
+    """
+        This function calculates how many rows fit in a single multi-row VALUES statement without going
+        over the SQL Server limits (1000 rows per VALUES clause and 2100 parameters per request).
+
+        Args:
+            n_cols (int): Number of parameters per row
+
+        Returns:
+            int: Maximum number of rows per statement
+    """
+    # One parameter is left spare, as some drivers count the statement itself as a parameter
+    return max(1, min(SQL_MAX_VALUES_ROWS, (SQL_MAX_PARAMETERS - 1) // n_cols))
+
+def build_multirow_insert(table: str, cols: Sequence[str], n_rows: int) -> str:
+    """
+        This function builds a parameterized insert statement for n_rows rows:\n
+        \t- 'INSERT INTO table (col, col, ...) VALUES (?,?,...),(?,?,...),...'
+
+        Args:
+            table (str): SQL table name
+            cols (list, tuple): Column names, in the parameters order
+            n_rows (int): Number of row groups within the VALUES clause
+
+        Returns:
+            str: Parameterized insert statement
+    """
+    row = '(' + ','.join('?' for _ in cols) + ')'
+    return f'INSERT INTO {table} ({",".join(cols)}) VALUES ' + ','.join(row for _ in range(n_rows))
+
+
+class MeteredCursor:
+    """
+        pyodbc cursor proxy recording every statement execution and commit as a database round-trip within
+        the activity metrics (check `utils.metrics`). Every other attribute is the cursor one.
+    """
+    def __init__(self, cursor: pyodbc.Cursor):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # e.g. fast_executemany
+        setattr(self._cursor, name, value)
+
+    def __enter__(self) -> 'MeteredCursor':
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc) -> Any:
+        return self._cursor.__exit__(*exc)
+
+    def __iter__(self) -> Iterator[pyodbc.Row]:
+        return iter(self._cursor)
+
+    def execute(self, *args) -> 'MeteredCursor':
+        metrics.add('db_round_trips')
+        self._cursor.execute(*args)
+        return self
+
+    def executemany(self, *args) -> None:
+        metrics.add('db_round_trips')
+        self._cursor.executemany(*args)
+
+    def commit(self) -> None:
+        metrics.add('db_round_trips')
+        self._cursor.commit()
+
+
+class MeteredConnection:
+    """
+        pyodbc connection proxy whose cursors and commits are recorded within the activity metrics (check `MeteredCursor`).
+    """
+    def __init__(self, conn: pyodbc.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    def cursor(self) -> MeteredCursor:
+        return MeteredCursor(self._conn.cursor())
+
+    def execute(self, *args) -> MeteredCursor:
+        return self.cursor().execute(*args)
+
+    def commit(self) -> None:
+        metrics.add('db_round_trips')
+        self._conn.commit()
+
+
 class DBManager:
     def __init__(self, _type: str):
         self.server = os.environ.get('SQL_DRIVER_SERVER', None)
@@ -21,6 +157,8 @@ class DBManager:
             raise EnvVariablesError(f'Environment variable missing. Check setup: server={self.server}, username={self.username}, password={self.password}, work_db={self.work_db}, test_db={self.test_db}')
         
         logging.debug('All variable environments were properly setup.')
+        # Connections are reused across DBManager instances within the same worker
+        self.pool = connection_pool.get_pool(self._type, self.create_connection)
     
     def create_connection(self) -> pyodbc.Connection:
         logging.debug(f'Creating a {self._type} connection')
@@ -29,25 +167,172 @@ class DBManager:
         elif self._type == 'test':
             return pyodbc.connect('DRIVER={SQL Server}' + f';SERVER={self.server};DATABASE={self.test_db};UID={self.username};PWD={self.password}')
 
-    def execute_sql_command(self, sql: str, ret: bool = False) -> Union[None, list]:
-        with self.create_connection() as conn:
+    @contextmanager
+    def connection(self) -> Iterator[MeteredConnection]:
+        """
+            This function checks out a connection from the worker pool and returns it once the block exits.\n
+            Uncommited work is rolled back on release, and session scoped objects (e.g. temporary tables)
+            have to be dropped by the block, as the session outlives it.
+
+            Yields:
+                MeteredConnection: Opened connection (its round-trips are recorded within the activity metrics)
+        """
+        with self.pool.connection() as conn:
+            yield MeteredConnection(conn)
+
+    @staticmethod
+    @contextmanager
+    def uncommited_cursor(conn: MeteredConnection) -> Iterator[MeteredCursor]:
+        """
+            This function opens a cursor which is closed, but not commited, once the block exits (exiting a pyodbc
+            cursor used as a context manager commits the transaction), so the caller handles the transaction.
+
+            Args:
+                conn (MeteredConnection): Opened connection
+
+            Yields:
+                MeteredCursor: Opened cursor
+        """
+        curr = conn.cursor()
+        try:
+            yield curr
+        finally:
+            curr.close()
+
+    def pool_metrics(self) -> Dict[str, Union[int, float]]:
+        return self.pool.metrics()
+
+    def execute_sql_command(self, sql: str, ret: bool = False, params: Optional[Sequence] = None) -> Union[None, list]:
+        with self.connection() as conn:
             with conn.cursor() as curr:
                 logging.debug(f'Executing command: {sql}')
-                curr.execute(sql)
+                if params:
+                    curr.execute(sql, params)
+                else:
+                    curr.execute(sql)
 
                 if ret:
                     return curr.fetchall()
     
     def execute_and_commit_to_db(self, stmts: List[str]) -> None:
         counter = 0
-        conn = self.create_connection()
+        with self.connection() as conn:
+            for stmt in stmts:           
+                with conn.cursor() as curr:
+                    logging.debug(f'Executing command: {stmt}')
+                    curr.execute(stmt)
+                    curr.commit()
+                    logging.debug(f'Command commited')
+                counter += 1
 
-        for stmt in stmts:           
-            with conn.cursor() as curr:
-                logging.debug(f'Executing command: {stmt}')
-                curr.execute(stmt)
+        return counter
+
+    def bulk_write(self, sql: str, data: BulkData, rows_per_batch: int = BULK_ROWS_PER_BATCH,
+                   rows_per_transaction: Optional[int] = BULK_ROWS_PER_TRANSACTION, conn: Optional[pyodbc.Connection] = None) -> int:
+        """
+            This function executes a parameterized statement for every row in data, sending the rows
+            to the database in batches (`executemany` with `fast_executemany`, so each batch is a single round-trip).
+
+            Args:
+                sql (str): Parameterized statement (with a `?` placeholder per column in data)
+                data (dict, pa.Table, pa.RecordBatch, iterable of pa.RecordBatch): Column arrays or Arrow batches
+                rows_per_batch (int, default=BULK_ROWS_PER_BATCH): Number of rows sent per round-trip
+                rows_per_transaction (int, default=BULK_ROWS_PER_TRANSACTION): Number of rows after which a commit is issued
+                    (rounded up to whole batches). If None, no commit is issued and the caller handles the transaction
+                conn (pyodbc.Connection, optional): Opened connection to reuse (e.g. to load a session temporary table)
+
+            Returns:
+                int: Number of rows executed
+        """
+        if conn is None:
+            with self.connection() as conn:
+                return self.bulk_write(sql, data, rows_per_batch, rows_per_transaction, conn)
+
+        counter = 0
+        uncommited = 0
+
+        with self.uncommited_cursor(conn) as curr:
+            curr.fast_executemany = True
+            for rows in iter_row_batches(data, rows_per_batch):
+                logging.debug(f'Executing command for {len(rows)} rows: {sql}')
+                curr.executemany(sql, rows)
+                counter += len(rows)
+                uncommited += len(rows)
+
+                if rows_per_transaction and uncommited >= rows_per_transaction:
+                    curr.commit()
+                    logging.debug(f'{uncommited} rows commited')
+                    uncommited = 0
+
+            if rows_per_transaction and uncommited:
+                curr.commit()
+                logging.debug(f'{uncommited} rows commited')
+
+        return counter
+
+    def multirow_insert(self, table: str, data: BulkData, rows_per_statement: Optional[int] = None,
+                        rows_per_transaction: Optional[int] = BULK_ROWS_PER_TRANSACTION, conn: Optional[pyodbc.Connection] = None) -> int:
+        """
+            This function inserts every row in data packing several rows per statement (multi-row VALUES clause),
+            so the server parses one statement per rows_per_statement rows instead of one per row.\n
+            Full statements are sent in batches (`executemany`), while the remaining rows of every batch
+            go within a single shorter statement.
+
+            Args:
+                table (str): SQL table name
+                data (dict, pa.Table, pa.RecordBatch, iterable of pa.RecordBatch): Column arrays or Arrow batches
+                    (column names are taken from the dict keys or the Arrow schema)
+                rows_per_statement (int, optional): Rows per statement (capped by `max_rows_per_values`)
+                rows_per_transaction (int, default=BULK_ROWS_PER_TRANSACTION): Number of rows after which a commit is issued.
+                    If None, no commit is issued and the caller handles the transaction
+                conn (pyodbc.Connection, optional): Opened connection to reuse
+
+            Returns:
+                int: Number of rows inserted
+        """
+        if isinstance(data, dict):
+            cols = list(data.keys())
+        elif isinstance(data, (pa.Table, pa.RecordBatch)):
+            cols = data.schema.names
+        else:
+            data = list(data)
+            if not data:
+                return 0
+            cols = data[0].schema.names
+
+        limit = max_rows_per_values(len(cols))
+        rows_per_statement = min(rows_per_statement or limit, limit)
+        full_sql = build_multirow_insert(table, cols, rows_per_statement)
+        # Every round-trip carries whole statements
+        rows_per_batch = max(1, BULK_ROWS_PER_BATCH // rows_per_statement) * rows_per_statement
+
+        if conn is None:
+            with self.connection() as conn:
+                return self.multirow_insert(table, data, rows_per_statement, rows_per_transaction, conn)
+
+        counter = 0
+        uncommited = 0
+
+        with self.uncommited_cursor(conn) as curr:
+            curr.fast_executemany = True
+            for rows in iter_row_batches(data, rows_per_batch):
+                n_full = len(rows) - len(rows) % rows_per_statement
+                if n_full:
+                    logging.debug(f'Executing {n_full // rows_per_statement} inserts of {rows_per_statement} rows into {table}')
+                    curr.executemany(full_sql, [tuple(chain.from_iterable(rows[i:i + rows_per_statement])) for i in range(0, n_full, rows_per_statement)])
+                if n_full < len(rows):
+                    logging.debug(f'Executing an insert of {len(rows) - n_full} rows into {table}')
+                    curr.execute(build_multirow_insert(table, cols, len(rows) - n_full), tuple(chain.from_iterable(rows[n_full:])))
+
+                counter += len(rows)
+                uncommited += len(rows)
+                if rows_per_transaction and uncommited >= rows_per_transaction:
+                    curr.commit()
+                    logging.debug(f'{uncommited} rows commited')
+                    uncommited = 0
+
+            if rows_per_transaction and uncommited:
                 curr.commit()
-                logging.debug(f'Command commited')
-            counter += 1
+                logging.debug(f'{uncommited} rows commited')
 
         return counter
@@ -0,0 +1,29 @@
+import logging
+from threading import Lock
+
+# Hashes of blobs already loaded into database, as known by this worker.
+# Only positive results are cached: a hash loaded by another worker is always checked against the database.
+MAX_KNOWN_HASHES = 10000
+
+_known_hashes = set()
+_lock = Lock()
+
+
+def is_known(blob_hash: str) -> bool:
+    with _lock:
+        return blob_hash in _known_hashes
+
+
+def remember(blob_hash: str) -> None:
+    """
+        This function records a hash as already loaded within this worker.\n
+        The cache is cleared once it reaches MAX_KNOWN_HASHES, as the hashes are checked again against the database anyway.
+
+        Args:
+            blob_hash (str): Hash of a blob loaded into database
+    """
+    with _lock:
+        if len(_known_hashes) >= MAX_KNOWN_HASHES:
+            logging.debug('Known hashes cache is full, clearing it')
+            _known_hashes.clear()
+        _known_hashes.add(blob_hash)
@@ -0,0 +1,231 @@
+import os
+import sys
+import time
+import logging
+import inspect
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows (peak memory is not reported there unless /proc is)
+    resource = None
+
+# Interval (seconds) between resident memory samples while an activity runs
+METRICS_SAMPLE_INTERVAL = float(os.environ.get('METRICS_SAMPLE_INTERVAL', 0.1))
+# Counters reported by every activity:
+# - rows: rows (or registers, pks, queries) processed by the activity
+# - blob_bytes_read / blob_bytes_written: bytes downloaded from / uploaded to blob storage
+# - db_round_trips: statements executed and commits sent to the database
+COUNTERS = ('rows', 'blob_bytes_read', 'blob_bytes_written', 'db_round_trips')
+# Keys of the activity results wrapped by `metered`
+RESULT_KEY = 'result'
+METRICS_KEY = 'metrics'
+
+# Metrics of the activity invocation running within the current context (None outside a metered activity)
+_current: ContextVar[Optional['ActivityMetrics']] = ContextVar('activity_metrics', default=None)
+
+
+def current_rss() -> Optional[int]:
+    # Resident memory of the worker process in bytes (the peak RSS of the whole process if /proc is not available)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return None
+
+
+class ActivityMetrics:
+    def __init__(self, stage: str, sample_interval: float = METRICS_SAMPLE_INTERVAL):
+        """
+            Performance metrics of an activity invocation: wall time, COUNTERS and peak resident memory
+            (sampled by a background thread while the activity runs).\n
+            Counters are increased through the module level `add` function from anywhere within the invocation
+            (check `metered`), so they are thread safe.
+
+            Args:
+                stage (str): Activity name
+                sample_interval (float, default=METRICS_SAMPLE_INTERVAL): Seconds between memory samples
+        """
+        self.stage = stage
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.seconds = 0.0
+        self.peak_rss = None
+        self._interval = sample_interval
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_until_done, name=f'metrics-{stage}', daemon=True)
+        self._start = None
+
+    def _sample(self) -> None:
+        rss = current_rss()
+        if rss is not None:
+            with self._lock:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def _sample_until_done(self) -> None:
+        while not self._done.wait(self._interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._sample()
+        self._sampler.start()
+        self._start = time.perf_counter()
+
+    def stop(self) -> None:
+        self.seconds = time.perf_counter() - self._start
+        self._done.set()
+        self._sampler.join()
+        self._sample()
+
+    def add(self, counter: str, n: int) -> None:
+        with self._lock:
+            self.counters[counter] += n
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stage': self.stage,
+            'seconds': round(self.seconds, 3),
+            **self.counters,
+            'peak_memory_mb': round(self.peak_rss / 2**20, 1) if self.peak_rss is not None else None
+        }
+
+
+def add(counter: str, n: int = 1) -> None:
+    # Nothing is recorded outside a metered activity (e.g. tools and benchmarks calling the utils directly)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(counter, n)
+
+
+def record_rows(n: int) -> None:
+    add('rows', n)
+
+
+def metered(main: Callable) -> Callable:
+    """
+        This decorator measures every invocation of an activity `main` function (sync or async) and wraps its result
+        along with the metrics: {RESULT_KEY: result, METRICS_KEY: metrics}. Orchestrators unwrap it with `call_activity`.
+
+        Args:
+            main (callable): Activity main function
+
+        Returns:
+            callable: Metered main function (with the same signature, as the functions host binds its parameters by name)
+    """
+    stage = main.__module__.rsplit('.', 1)[-1]
+
+    if inspect.iscoroutinefunction(main):
+        @wraps(main)
+        async def async_wrapper(*args, **kwargs):
+            metrics = ActivityMetrics(stage)
+            token = _current.set(metrics)
+            metrics.start()
+            try:
+                result = await main(*args, **kwargs)
+            finally:
+                metrics.stop()
+                _current.reset(token)
+            return {RESULT_KEY: result, METRICS_KEY: metrics.to_dict()}
+        return async_wrapper
+
+    @wraps(main)
+    def wrapper(*args, **kwargs):
+        metrics = ActivityMetrics(stage)
+        token = _current.set(metrics)
+        metrics.start()
+        try:
+            result = main(*args, **kwargs)
+        finally:
+            metrics.stop()
+            _current.reset(token)
+        return {RESULT_KEY: result, METRICS_KEY: metrics.to_dict()}
+    return wrapper
+
+
+def unwrap(output: Dict[str, Any], stages: List[Dict[str, Any]]) -> Any:
+    # Metrics are collected into stages and the activity result is returned
+    stages.append(output[METRICS_KEY])
+    return output[RESULT_KEY]
+
+
+def call_activity(context, stages: List[Dict[str, Any]], name: str, payload: Any = None) -> Generator:
+    """
+        This function calls a metered activity from an orchestrator, collecting its metrics into stages.
+        Use it with `yield from`, so the orchestrator still yields the activity task:\n
+        \t- result = yield from call_activity(context, stages, 'Activity', payload)
+
+        Args:
+            context (df.DurableOrchestrationContext): Orchestration context
+            stages (list): Metrics of the activities called so far (rebuilt on every replay)
+            name (str): Activity name
+            payload (any, optional): Activity input
+
+        Returns:
+            any: Activity result
+    """
+    output = yield context.call_activity(name, payload)
+    return unwrap(output, stages)
+
+
+def save_stage_metrics(context, orchestrator: str, stages: List[Dict[str, Any]], execution_id: Optional[str] = None) -> Generator:
+    """
+        This function saves the metrics of an orchestration within StageMetrics (check the `SaveStageMetrics` activity).
+        Use it with `yield from`, as `call_activity`.\n
+        Metrics are best effort: if they cannot be saved (e.g. StageMetrics was not created yet or the logging database
+        is not available) the error is logged and the orchestration goes on, as its data was already commited.
+
+        Args:
+            context (df.DurableOrchestrationContext): Orchestration context
+            orchestrator (str): Orchestrator name
+            stages (list): Metrics of every activity called (check `call_activity`)
+            execution_id (str, optional): Executions id of the run
+
+        Returns:
+            bool: True if the metrics were saved, otherwise False
+    """
+    try:
+        yield context.call_activity('SaveStageMetrics', {
+            'orchestrator': orchestrator,
+            'instance_id': context.instance_id,
+            'run_date': context.current_utc_datetime.isoformat(),
+            'execution_id': execution_id,
+            'stages': stages
+        })
+    except Exception as e:
+        if not context.is_replaying:
+            logging.warning(f'Stage metrics of {orchestrator} ({context.instance_id}) could not be saved: {e}')
+        return False
+    return True
+
+
+def summarize(stages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+        This function summarizes the metrics of an orchestration for its custom status.
+
+        Args:
+            stages (list): Metrics of every activity called (check `call_activity`)
+
+        Returns:
+            dict: Seconds per stage (added up if a stage ran more than once), slowest stage, activity seconds
+                added up, peak memory among the activities and COUNTERS added up
+    """
+    seconds_per_stage = {}
+    for m in stages:
+        seconds_per_stage[m['stage']] = round(seconds_per_stage.get(m['stage'], 0) + m['seconds'], 3)
+    peaks = [m['peak_memory_mb'] for m in stages if m['peak_memory_mb'] is not None]
+
+    return {
+        'activity_seconds': round(sum(m['seconds'] for m in stages), 3),
+        'slowest_stage': max(seconds_per_stage, key=seconds_per_stage.get) if seconds_per_stage else None,
+        'seconds_per_stage': seconds_per_stage,
+        'peak_memory_mb': max(peaks) if peaks else None,
+        **{counter: sum(m[counter] for m in stages) for counter in COUNTERS if counter != 'rows'}
+    }
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Arrow backed strings: a single contiguous buffer per column instead of a python object per value
+STRING = 'string[pyarrow]'
+# Dictionary encoded strings for low cardinality columns (one small integer code per value)
+CATEGORY = 'category'
+
+
+class Column(NamedTuple):
+    name: str
+    # Dtype the csv parser produces for the column (its Arrow type within the feather files derives from it)
+    pandas: Any
+    # Type of the column within the working table (checked against it by `python -m tools.migrate check`)
+    sql: str
+
+
+# Schema registry of the new data (in csv order). Every stage reads the types of the new data from here
+SCHEMA = [
+    Column('CHROM', CATEGORY, 'VARCHAR(50)'),
+    Column('POS', 'Int64', 'BIGINT'),
+    Column('ID', STRING, 'VARCHAR(100)'),
+    Column('REF', CATEGORY, 'VARCHAR(500)'),
+    Column('ALT', CATEGORY, 'VARCHAR(500)'),
+    Column('QUAL', 'float64', 'FLOAT'),
+    Column('FILTER', CATEGORY, 'VARCHAR(100)'),
+    Column('INFO', STRING, 'VARCHAR(MAX)'),
+    Column('FORMAT', CATEGORY, 'VARCHAR(100)'),
+    Column('MUESTRA', STRING, 'VARCHAR(100)'),
+    Column('VALOR', STRING, 'VARCHAR(500)'),
+    Column('ORIGEN', CATEGORY, 'VARCHAR(100)'),
+    Column('FECHA_COPIA', 'datetime64[ns]', 'DATETIME2'),
+    Column('RESULTADO', STRING, 'VARCHAR(100)')
+]
+# Values parsed as missing besides the parser defaults (VCF marks a missing quality with a dot)
+NA_VALUES = {'QUAL': ['.']}
+
+
+def pandas_dtypes(schema: List[Column] = SCHEMA) -> Dict[str, Any]:
+    return {col.name: col.pandas for col in schema}
+
+
+def sql_types(schema: List[Column] = SCHEMA) -> Dict[str, str]:
+    return {col.name: col.sql for col in schema}
+
+
+def read_csv_kwargs(schema: List[Column] = SCHEMA) -> Dict[str, Any]:
+    """
+        This function builds the `pd.read_csv` type arguments for the schema, so every column is parsed straight
+        into its final dtype (instead of parsing strings and casting them afterwards).
+
+        Args:
+            schema (list, default=SCHEMA): Columns of the csv
+
+        Returns:
+            dict: dtype, parse_dates and na_values arguments
+    """
+    dates = [col.name for col in schema if str(col.pandas).startswith('datetime64')]
+    return {
+        'dtype': {col.name: col.pandas for col in schema if col.name not in dates},
+        'parse_dates': dates,
+        'na_values': NA_VALUES
+    }
+
+
+def numeric_arrow_type(dtype: str) -> pa.DataType:
+    # Nullable pandas integers ('Int64') share the Arrow type of their numpy counterpart
+    return pa.from_numpy_dtype(np.dtype(str(dtype).lower()))
+
+
+def arrow_column_types(schema: List[Column] = SCHEMA) -> Dict[str, pa.DataType]:
+    """
+        This function maps the schema to the column types of the Arrow csv reader (`pyarrow.csv.ConvertOptions`).\n
+        Columns with extra missing value markers (NA_VALUES) are read as strings, as the reader null values
+        apply to every column (check `arrow_to_pandas`).
+
+        Args:
+            schema (list, default=SCHEMA): Columns of the csv
+
+        Returns:
+            dict: Arrow type per column
+    """
+    types = {}
+    for col in schema:
+        if col.name in NA_VALUES or col.pandas == STRING:
+            types[col.name] = pa.string()
+        elif col.pandas == CATEGORY:
+            types[col.name] = pa.dictionary(pa.int32(), pa.string())
+        elif str(col.pandas).startswith('datetime64'):
+            types[col.name] = pa.timestamp('ns')
+        else:
+            types[col.name] = numeric_arrow_type(col.pandas)
+    return types
+
+
+def arrow_to_pandas(table: pa.Table, schema: List[Column] = SCHEMA) -> pd.DataFrame:
+    """
+        This function converts a table read by the Arrow csv reader (check `arrow_column_types`) into a dataframe
+        with the same dtypes the pandas parser produces (check `read_csv_kwargs`).
+
+        Args:
+            table (pa.Table): Parsed csv
+            schema (list, default=SCHEMA): Columns of the csv
+
+        Returns:
+            pd.DataFrame: Typed dataframe
+    """
+    for col in schema:
+        if col.name in NA_VALUES:
+            i = table.schema.get_field_index(col.name)
+            values = table.column(i)
+            values = pc.if_else(pc.is_in(values, value_set=pa.array(NA_VALUES[col.name])), pa.scalar(None, pa.string()), values)
+            table = table.set_column(i, col.name, values.cast(numeric_arrow_type(col.pandas)))
+
+    dtypes = pandas_dtypes(schema)
+    # Strings and integers are mapped to the pandas extension dtypes of the schema (instead of objects and floats)
+    mapper = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow'), pa.int64(): pd.Int64Dtype()}
+    df = table.to_pandas(types_mapper=mapper.get)
+    for name, dtype in dtypes.items():
+        if name in df.columns and df[name].dtype != dtype:
+            df[name] = df[name].astype(dtype)
+    return df
+
+
+def memory_per_row(df: pd.DataFrame) -> float:
+    # Bytes per row held by the dataframe (python string objects included)
+    return df.memory_usage(index=False, deep=True).sum() / max(len(df), 1)
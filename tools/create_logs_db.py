@@ -10,6 +10,52 @@ class DatabaseCreationError(Exception):
     pass
 
 
+# Indexes over Executions (name, column list)
+EXECUTIONS_INDEXES = [
+    ('IX_Executions_file_hash', 'file_hash')
+]
+# Columns added to Executions after its first release (name, SQL type)
+EXECUTIONS_ADDED_COLUMNS = [
+    ('source_etag', 'VARCHAR(500)'),
+    ('source_last_modified', 'VARCHAR(100)'),
+    ('max_copy_date', 'DATETIME2'),
+    ('table_name', 'VARCHAR(128)')
+]
+# Columns added to DedupRuns after its first release (name, SQL type)
+DEDUP_RUNS_ADDED_COLUMNS = [
+    ('table_name', 'VARCHAR(128)')
+]
+# Watermarks recorded by every dedup run, per deduplicated table (check functions/DedupMostRecent)
+DEDUP_RUNS_SCHEMA = """
+CREATE TABLE {db}.dbo.DedupRuns (
+    id VARCHAR(36) PRIMARY KEY,
+    run_date DATETIME,
+    table_name VARCHAR(128),
+    watermark DATETIME2,
+    full_rescan BIT,
+    rows_updated int
+)
+"""
+# Metrics of every activity called by the orchestrators, a register per call (check functions/SaveStageMetrics)
+STAGE_METRICS_SCHEMA = """
+CREATE TABLE {db}.dbo.StageMetrics (
+    id VARCHAR(36) PRIMARY KEY,
+    execution_id VARCHAR(36),
+    instance_id VARCHAR(100),
+    orchestrator VARCHAR(100),
+    run_date DATETIME,
+    call_order int,
+    stage VARCHAR(100),
+    seconds FLOAT,
+    rows_processed BIGINT,
+    blob_bytes_read BIGINT,
+    blob_bytes_written BIGINT,
+    db_round_trips int,
+    peak_memory_mb FLOAT
+)
+"""
+
+
 class AlterDB:
     def __init__(self):
         self.server = os.environ.get('SQL_DRIVER_SERVER', None)
@@ -48,6 +94,45 @@ class AlterDB:
 
         return self.test_db.strip().lower() in db_names
 
+    def add_missing_columns(self) -> None:
+        for table, added_columns in [('Executions', EXECUTIONS_ADDED_COLUMNS), ('DedupRuns', DEDUP_RUNS_ADDED_COLUMNS)]:
+            r = self.execute_sql_command(f"""select COLUMN_NAME
+            from {self.test_db}.INFORMATION_SCHEMA.COLUMNS
+            where TABLE_NAME='{table}'""", ret=True)
+            cols = [x[0] for x in r]
+            if not cols:
+                # Not created yet (check `create_missing_tables`)
+                continue
+
+            for col, _type in added_columns:
+                if col not in cols:
+                    self.execute_sql_command(f'ALTER TABLE {self.test_db}.dbo.{table} ADD {col} {_type} NULL')
+                    print(f'New column {col} added to {table} table')
+
+    def create_missing_indexes(self) -> None:
+        r = self.execute_sql_command(f"""select i.name
+        from {self.test_db}.sys.indexes i
+        where i.object_id = OBJECT_ID('{self.test_db}.dbo.Executions')""", ret=True)
+        indexes = [x[0] for x in r]
+
+        for index, cols in EXECUTIONS_INDEXES:
+            if index not in indexes:
+                self.execute_sql_command(f'CREATE INDEX {index} ON {self.test_db}.dbo.Executions ({cols})')
+                print(f'New index {index} created over Executions table')
+
+    def create_missing_tables(self) -> None:
+        r = self.execute_sql_command(f"""select TABLE_NAME
+        from {self.test_db}.INFORMATION_SCHEMA.TABLES""", ret=True)
+        tables = [x[0] for x in r]
+
+        if 'DedupRuns' not in tables:
+            self.execute_sql_command(DEDUP_RUNS_SCHEMA.format(db=self.test_db))
+            print('New table DedupRuns created')
+
+        if 'StageMetrics' not in tables:
+            self.execute_sql_command(STAGE_METRICS_SCHEMA.format(db=self.test_db))
+            print('New table StageMetrics created')
+
     def run(self) -> None:
         if not self.check_database_creation():
             print('Starting logging database creation')
@@ -69,12 +154,21 @@ class AlterDB:
                 execution_date DATETIME,
                 file_hash VARCHAR(500),
                 rows_updated int,
-                rows_inserted int
+                rows_inserted int,
+                source_etag VARCHAR(500),
+                source_last_modified VARCHAR(100),
+                max_copy_date DATETIME2,
+                table_name VARCHAR(128)
             )
             """
             self.execute_sql_command(schema)
+            self.create_missing_indexes()
+            self.create_missing_tables()
         else:
-            raise DatabaseCreationError(f'Database {self.restored_db} is already created in database.')
+            print(f'Database {self.test_db} is already created in database, adding missing columns, indexes and tables')
+            self.add_missing_columns()
+            self.create_missing_indexes()
+            self.create_missing_tables()
 
     
 
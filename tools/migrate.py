@@ -0,0 +1,268 @@
+import os
+import re
+import json
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pyodbc
+import pandas as pd
+
+from functions.utils.schema import SCHEMA, sql_types
+from functions.GetUniqueSetOfPksFromDb import TABLE_PK, PKS_TEMP_TABLE, UNIQUE_PKS_QUERY, build_matching_pks_query
+from functions.GetDupPksFromDb import DUP_PK_GROUPS_QUERY
+from functions.GetRegsWithDupPks import REGS_PER_PK_QUERY
+from functions.GenerateInsUpdStmt import UPDATE_PKS_TEMP_TABLE, build_update_batch
+from functions.UpsertFromStaging import STAGING_TABLE, build_staging_statements
+from functions.SaveExecutionLog import MAX_COPY_DATE_QUERY
+from functions.DedupMostRecent import TOUCHED_PKS_TEMP_TABLE, build_dedup_stmt, build_touched_pks_stmt, build_touched_dedup_stmt
+from functions.CheckCurrentBlobHash import HASH_EXISTS_QUERY
+from functions.GetBlobHash import LAST_EXECUTION_VALIDATORS_QUERY
+
+
+class EnvVariablesError(Exception):
+    pass
+
+
+class MigrationError(Exception):
+    pass
+
+
+# Versioned migrations (version, database, description, sql). Applied versions are recorded per database in
+# SchemaMigrations, so every migration runs once and in order. Never edit an applied migration, add a new one instead
+MIGRATIONS = [
+    (1, 'work', 'Composite key index covering FECHA_COPIA and MOST_RECENT (dedup, MOST_RECENT reset and pk lookups)', """
+        CREATE INDEX IX_Unificado_pk_copy ON dbo.Unificado (ID, MUESTRA, RESULTADO, FECHA_COPIA DESC) INCLUDE (MOST_RECENT)
+    """),
+    (2, 'work', 'Filtered index over the most recent registers', """
+        CREATE INDEX IX_Unificado_most_recent ON dbo.Unificado (ID, MUESTRA, RESULTADO) INCLUDE (FECHA_COPIA) WHERE MOST_RECENT = 1
+    """),
+    (3, 'work', 'FECHA_COPIA index (ingest high-water mark and incremental dedup)', """
+        CREATE INDEX IX_Unificado_fecha_copia ON dbo.Unificado (FECHA_COPIA)
+    """),
+    (4, 'test', 'Executions file hash index (already loaded blob checks)', """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Executions_file_hash' AND object_id = OBJECT_ID('dbo.Executions'))
+            CREATE INDEX IX_Executions_file_hash ON dbo.Executions (file_hash)
+    """),
+    (5, 'test', 'Executions execution date index (last execution validators)', """
+        CREATE INDEX IX_Executions_execution_date ON dbo.Executions (execution_date DESC)
+    """)
+]
+
+# Working table, whose column types have to match the ones of the schema registry (`functions/utils/schema.py`)
+WORK_TABLE = 'Unificado'
+# Unificado columns loaded by the ingest (in the csv order of `functions/utils/schema.py`)
+UNIFICADO_COLUMNS = [c.name for c in SCHEMA]
+
+# Indexes expected once every migration is applied (database, table, index name)
+EXPECTED_INDEXES = [
+    ('work', 'Unificado', 'IX_Unificado_pk_copy'),
+    ('work', 'Unificado', 'IX_Unificado_most_recent'),
+    ('work', 'Unificado', 'IX_Unificado_fecha_copia'),
+    ('test', 'Executions', 'IX_Executions_file_hash'),
+    ('test', 'Executions', 'IX_Executions_execution_date')
+]
+
+def bind_literals(sql: str, *params: str) -> str:
+    # SHOWPLAN_XML compiles the statement without running it, so its parameter markers are replaced by representative literals
+    parts = sql.split('?')
+    if len(parts) != len(params) + 1:
+        raise MigrationError(f'{len(parts) - 1} parameter markers but {len(params)} literals for: {sql.strip()}')
+    return parts[0] + ''.join(f"'{param}'{part}" for param, part in zip(params, parts[1:]))
+
+STAGING_STATEMENTS = build_staging_statements(WORK_TABLE, UNIFICADO_COLUMNS)
+
+# Hot queries of the pipeline, built by the activities they come from
+PIPELINE_QUERIES = {
+    'work': {
+        # GetUniqueSetOfPksFromDb
+        'unique_pks': UNIQUE_PKS_QUERY.format(table=WORK_TABLE),
+        # GetUniqueSetOfPksFromDb.query_matching_pks (IngestShard, new data pks loaded into #new_pks)
+        'matching_pks': build_matching_pks_query(WORK_TABLE),
+        # GetDupPksFromDb
+        'dup_pk_groups': DUP_PK_GROUPS_QUERY.format(table=WORK_TABLE),
+        # GetRegsWithDupPks
+        'regs_per_pk': bind_literals(REGS_PER_PK_QUERY.format(table=WORK_TABLE), '', '', ''),
+        # UploadNewData (MOST_RECENT reset of the update pks loaded into #update_pks)
+        'most_recent_reset': build_update_batch(WORK_TABLE, TABLE_PK, pd.DataFrame(columns=TABLE_PK))['sql'],
+        # UpsertFromStaging (new data loaded into #staging)
+        'staging_update_count': STAGING_STATEMENTS['update_count'],
+        'staging_most_recent_reset': STAGING_STATEMENTS['most_recent_reset'],
+        'staging_insert': STAGING_STATEMENTS['insert'],
+        # SaveExecutionLog (FECHA_COPIA high-water mark)
+        'max_copy_date': MAX_COPY_DATE_QUERY.format(table=WORK_TABLE),
+        # DedupMostRecent (range by range rescan)
+        'dedup_range': bind_literals(build_dedup_stmt(WORK_TABLE, ''), '', 'zzzz'),
+        # DedupMostRecent (composed pks loaded since the watermark)
+        'touched_pks': bind_literals(build_touched_pks_stmt(WORK_TABLE, bounded=True), '2000-01-01', '2100-01-01'),
+        # DedupMostRecent (incremental dedup of the pks loaded into #touched_pks)
+        'dedup_touched': build_touched_dedup_stmt(WORK_TABLE)
+    },
+    'test': {
+        # CheckCurrentBlobHash
+        'hash_exists': bind_literals(HASH_EXISTS_QUERY.format(placeholders='?,?'), '', ''),
+        # GetBlobHash
+        'last_execution_validators': LAST_EXECUTION_VALIDATORS_QUERY
+    }
+}
+
+# Session temporary tables joined by the pipeline queries, created as the activities do. SHOWPLAN_XML compiles its
+# batches without running them (a temporary table created within the same batch would not exist yet), so they are
+# created within the same session before it is turned on (check `Migrator.capture_plan`)
+TEMP_TABLES = {
+    **{name: f"SELECT TOP 0 {','.join(TABLE_PK)} INTO {name} FROM {WORK_TABLE}" for name in (PKS_TEMP_TABLE, UPDATE_PKS_TEMP_TABLE, TOUCHED_PKS_TEMP_TABLE)},
+    STAGING_TABLE: STAGING_STATEMENTS['create']
+}
+
+# Physical operators reading a whole table or index
+SCAN_OPERATORS = ('Table Scan', 'Clustered Index Scan', 'Index Scan')
+
+
+class Migrator:
+    def __init__(self):
+        self.server = os.environ.get('SQL_DRIVER_SERVER', None)
+        self.username = os.environ.get('SQL_DRIVER_USERNAME', None)
+        self.password = os.environ.get('SQL_DRIVER_PASSWORD', None)
+        self.databases = {
+            'work': os.environ.get('SQL_DRIVER_WORKING_DATABASE', None),
+            'test': os.environ.get('SQL_DRIVER_TESTING_DATABASE', None)
+        }
+
+        if not self.server or not self.username or not self.password or not all(self.databases.values()):
+            raise EnvVariablesError(f'Environment variable missing. Check setup: server={self.server}, username={self.username}, password={self.password}, databases={self.databases}')
+
+        print('All variable environments were properly setup.')
+
+    def create_connection(self, database: str) -> pyodbc.Connection:
+        print(f'Creating connection to {self.databases[database]}')
+        return pyodbc.connect('DRIVER={SQL Server}' + f';SERVER={self.server};DATABASE={self.databases[database]};UID={self.username};PWD={self.password}', autocommit=True)
+
+    def execute_sql_command(self, database: str, sql: str, ret: bool = False) -> Optional[list]:
+        with self.create_connection(database) as conn:
+            with conn.cursor() as curr:
+                print(f'Executing command: {sql.strip()}')
+                curr.execute(sql)
+
+                if ret:
+                    return curr.fetchall()
+
+    def applied_versions(self, database: str) -> List[int]:
+        self.execute_sql_command(database, """
+            IF OBJECT_ID('dbo.SchemaMigrations') IS NULL
+                CREATE TABLE dbo.SchemaMigrations (version int PRIMARY KEY, description VARCHAR(500), applied_date DATETIME)
+        """)
+        return [r[0] for r in self.execute_sql_command(database, 'SELECT version FROM dbo.SchemaMigrations', ret=True)]
+
+    def migrate(self) -> None:
+        applied = {database: self.applied_versions(database) for database in self.databases}
+
+        for version, database, description, sql in MIGRATIONS:
+            if version in applied[database]:
+                continue
+
+            print(f'Applying migration {version} to {self.databases[database]}: {description}')
+            with self.create_connection(database) as conn:
+                conn.autocommit = False
+                with conn.cursor() as curr:
+                    curr.execute(sql)
+                    curr.execute('INSERT INTO dbo.SchemaMigrations (version, description, applied_date) VALUES (?, ?, ?)', version, description, datetime.now())
+                    curr.commit()
+
+        print('Every migration is applied')
+
+    def check(self) -> None:
+        missing = []
+        for database, table, index in EXPECTED_INDEXES:
+            r = self.execute_sql_command(database, f"SELECT 1 FROM sys.indexes WHERE name = '{index}' AND object_id = OBJECT_ID('dbo.{table}')", ret=True)
+            if not r:
+                missing.append(f'{self.databases[database]}.dbo.{table}.{index}')
+
+        if missing:
+            raise MigrationError(f'Missing indexes: {missing}. Run the migrations first.')
+        print('Every expected index exists')
+
+        self.check_schema()
+
+    @staticmethod
+    def format_sql_type(data_type: str, max_length: Optional[int]) -> str:
+        # INFORMATION_SCHEMA type as written within the schema registry, e.g. BIGINT, VARCHAR(100) or VARCHAR(MAX) (length -1)
+        if max_length is None:
+            return data_type.upper()
+        return f'{data_type.upper()}({"MAX" if max_length == -1 else max_length})'
+
+    def check_schema(self) -> None:
+        r = self.execute_sql_command('work', f"""
+            SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = '{WORK_TABLE}'
+        """, ret=True)
+        table_types = {name: self.format_sql_type(data_type, max_length) for name, data_type, max_length in r}
+
+        mismatches = {name: {'schema': sql, 'table': table_types.get(name)} for name, sql in sql_types().items() if table_types.get(name) != sql}
+        if mismatches:
+            raise MigrationError(f'The schema registry does not match {self.databases["work"]}.dbo.{WORK_TABLE} (table None if missing): {mismatches}')
+        print(f'Every schema registry column matches {WORK_TABLE}')
+
+    def capture_plan(self, database: str, sql: str) -> str:
+        with self.create_connection(database) as conn:
+            with conn.cursor() as curr:
+                for name, create in TEMP_TABLES.items():
+                    # Except the one the query creates itself (e.g. SELECT ... INTO #touched_pks)
+                    if name in sql and f'INTO {name}' not in sql:
+                        curr.execute(create)
+                # SHOWPLAN_XML has to be the only statement within its batch, and the query is compiled but not executed
+                curr.execute('SET SHOWPLAN_XML ON')
+                try:
+                    curr.execute(sql)
+                    return curr.fetchone()[0]
+                finally:
+                    curr.execute('SET SHOWPLAN_XML OFF')
+
+    @staticmethod
+    def summarize_plan(plan: str) -> Dict[str, List[str]]:
+        # Plan XML attributes: <RelOp PhysicalOp="..."> and <Object ... Index="[IX_...]">
+        return {
+            'indexes': sorted(set(re.findall(r'Index="\[([^\]]+)\]"', plan))),
+            'scans': sorted(set(op for op in re.findall(r'PhysicalOp="([^"]+)"', plan) if op in SCAN_OPERATORS))
+        }
+
+    def plans(self, output_dir: str, baseline: Optional[str] = None) -> None:
+        os.makedirs(output_dir, exist_ok=True)
+        summary = {}
+
+        for database, queries in PIPELINE_QUERIES.items():
+            for name, sql in queries.items():
+                plan = self.capture_plan(database, sql)
+                with open(os.path.join(output_dir, f'{name}.sqlplan'), 'w') as f:
+                    f.write(plan)
+                summary[name] = self.summarize_plan(plan)
+                print(f'{name}: indexes={summary[name]["indexes"]} scans={summary[name]["scans"]}')
+
+        with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        if baseline:
+            with open(baseline) as f:
+                previous = json.load(f)
+
+            regressions = [name for name, s in summary.items() if name in previous and (
+                set(previous[name]['indexes']) - set(s['indexes']) or set(s['scans']) - set(previous[name]['scans'])
+            )]
+            if regressions:
+                raise MigrationError(f'Plans regressed against {baseline} (indexes no longer used or new scans): {regressions}')
+            print(f'No plan regressions against {baseline}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Versioned schema migrations, index and column type checks and query plan capture '
+                                                 'for the pipeline databases (run from the repository root: python -m tools.migrate)')
+    parser.add_argument('command', choices=['migrate', 'check', 'plans'], nargs='?', default='migrate')
+    parser.add_argument('--output', default='plans', help='Directory to save the captured plans into (plans command)')
+    parser.add_argument('--baseline', help='summary.json of previously captured plans to compare against (plans command)')
+    args = parser.parse_args()
+
+    m = Migrator()
+    if args.command == 'migrate':
+        m.migrate()
+    elif args.command == 'check':
+        m.check()
+    else:
+        m.plans(args.output, args.baseline)
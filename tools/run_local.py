@@ -0,0 +1,240 @@
+"""
+    Host-free local runner for the orchestrators (ScheduledIngest, ModifyDB).\n
+    The orchestrator generator function is driven in-process: every `call_activity` is resolved to the activity
+    `main` function (awaited if it is async), `task_all` fans out to its activities, timers are skipped and
+    `continue_as_new` starts the next iteration (--iterations). Activities use the usual environment variables,
+    so point them to the local stand-ins of docker-compose.yaml (Azurite and the SQL Server container).\n
+    Activity inputs and results go through JSON, as within the functions host (--no-serialize skips it), so the
+    pipeline cost can be measured apart from the host scheduling overhead, and profiled with --profile (cProfile).
+
+    Usage (from the repository root):
+        docker compose up -d
+        python -m tools.run_local ScheduledIngest --url http://127.0.0.1:10000/devstoreaccount1/challenge/nuevas_filas.csv
+        python -m tools.run_local ModifyDB --input '{"full_rescan": true}'
+        python -m tools.run_local ScheduledIngest --profile ingest.prof
+"""
+import json
+import time
+import uuid
+import pstats
+import asyncio
+import cProfile
+import inspect
+import argparse
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Generator, List, Optional, Tuple
+
+
+class OrchestratorNotFoundError(Exception):
+    pass
+
+
+class LocalTask:
+    def __init__(self, name: str, input_: Any = None):
+        # Activity call, run when the orchestrator yields it
+        self.name = name
+        self.input = input_
+
+
+class LocalTaskSet:
+    def __init__(self, tasks: List[LocalTask]):
+        self.tasks = tasks
+
+
+class LocalTimer:
+    def __init__(self, fire_at: datetime):
+        self.fire_at = fire_at
+
+
+class LocalOrchestrationContext:
+    """
+        In-process stand-in for `df.DurableOrchestrationContext`, with the members the orchestrators use.
+        Tasks are not run when created, but when the orchestrator yields them (check `LocalRunner.resolve`).
+
+        Attrs:
+            self.instance_id (str): Orchestration instance id (the same one across iterations, as within the host)
+            self.custom_status (any): Last custom status set by the orchestrator
+            self.continued (bool): Whether the orchestrator called `continue_as_new`
+            self.next_input (any): Input for the next iteration
+    """
+    def __init__(self, instance_id: str, input_: Any = None):
+        self.instance_id = instance_id
+        self.is_replaying = False
+        self.custom_status = None
+        self.continued = False
+        self.next_input = None
+        self._input = input_
+
+    @property
+    def current_utc_datetime(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def get_input(self) -> Any:
+        return self._input
+
+    def new_uuid(self) -> str:
+        return str(uuid.uuid4())
+
+    def call_activity(self, name: str, input_: Any = None) -> LocalTask:
+        return LocalTask(name, input_)
+
+    def call_activity_with_retry(self, name: str, retry_options: Any, input_: Any = None) -> LocalTask:
+        # Activities are not retried locally, so failures surface straight away
+        return LocalTask(name, input_)
+
+    def task_all(self, tasks: List[LocalTask]) -> LocalTaskSet:
+        return LocalTaskSet(tasks)
+
+    def create_timer(self, fire_at: datetime) -> LocalTimer:
+        return LocalTimer(fire_at)
+
+    def set_custom_status(self, status: Any) -> None:
+        self.custom_status = status
+
+    def continue_as_new(self, input_: Any) -> None:
+        self.continued = True
+        self.next_input = input_
+
+
+class LocalRunner:
+    def __init__(self, serialize: bool = True, fan_out_workers: int = 1):
+        """
+            Runs an orchestrator and its activities within the current process.
+
+            Args:
+                serialize (bool, default=True): Activity inputs and results go through JSON, as within the host
+                fan_out_workers (int, default=1): Threads `task_all` runs its activities with (one at a time by default)
+        """
+        self.serialize = serialize
+        self.fan_out_workers = fan_out_workers
+        # Wall time of every activity call, in call order
+        self.calls: List[Dict[str, Any]] = []
+        # Wall time spent resolving the yielded tasks (concurrent task_all activities are counted once)
+        self.activity_seconds = 0.0
+
+    def _round_trip(self, value: Any) -> Any:
+        return json.loads(json.dumps(value)) if self.serialize else value
+
+    def run_activity(self, name: str, input_: Any) -> Any:
+        main = importlib.import_module(f'functions.{name}').main
+        input_ = self._round_trip(input_)
+
+        start = time.perf_counter()
+        result = main(input_)
+        if inspect.iscoroutine(result):
+            result = asyncio.run(result)
+        seconds = time.perf_counter() - start
+
+        self.calls.append({'activity': name, 'seconds': seconds})
+        # A single write, so lines of concurrent task_all activities do not interleave
+        print(f'{name:<45}{seconds:>10.3f} s\n', end='')
+        return self._round_trip(result)
+
+    def resolve(self, task: Any) -> Any:
+        """
+            This function runs whatever the orchestrator yielded and returns what the host would send back.
+
+            Args:
+                task (LocalTask, LocalTaskSet, LocalTimer): Yielded task
+
+            Returns:
+                any: Activity result, list of results (task_all) or None (timers are skipped)
+        """
+        if isinstance(task, LocalTimer):
+            print(f'Timer until {task.fire_at} skipped')
+            return None
+        if isinstance(task, LocalTaskSet):
+            if self.fan_out_workers > 1:
+                with ThreadPoolExecutor(max_workers=self.fan_out_workers) as executor:
+                    return list(executor.map(self.resolve, task.tasks))
+            return [self.resolve(t) for t in task.tasks]
+        return self.run_activity(task.name, task.input)
+
+    def run_orchestrator(self, name: str, context: LocalOrchestrationContext) -> Any:
+        module = importlib.import_module(f'functions.{name}')
+        if not hasattr(module, 'orchestrator_function'):
+            raise OrchestratorNotFoundError(f'{name} is not an orchestrator (no orchestrator_function within functions/{name})')
+
+        gen: Generator = module.orchestrator_function(context)
+        if not inspect.isgenerator(gen):
+            return gen
+
+        value, error = None, None
+        while True:
+            try:
+                # Activity failures are raised within the orchestrator, as the host does
+                task = gen.throw(error) if error is not None else gen.send(value)
+            except StopIteration as e:
+                return e.value
+            start = time.perf_counter()
+            try:
+                value, error = self.resolve(task), None
+            except Exception as e:
+                value, error = None, e
+            self.activity_seconds += time.perf_counter() - start
+
+    def run(self, name: str, input_: Any = None, iterations: int = 1) -> Tuple[Any, Optional[Any]]:
+        """
+            This function runs the orchestrator until it completes, or for the given number of iterations
+            if it continues as new (e.g. the weekly ScheduledIngest).
+
+            Args:
+                name (str): Orchestrator name (folder within functions)
+                input_ (any, optional): Orchestrator input
+                iterations (int, default=1): Maximum number of `continue_as_new` iterations
+
+            Returns:
+                tuple: Output and custom status of the last iteration
+        """
+        context = LocalOrchestrationContext(instance_id=f'local-{uuid.uuid4().hex}', input_=input_)
+        for i in range(iterations):
+            print(f'Running {name} (iteration {i + 1}, instance {context.instance_id})')
+            start = time.perf_counter()
+            output = self.run_orchestrator(name, context)
+            self.print_summary(time.perf_counter() - start)
+            self.calls, self.activity_seconds = [], 0.0
+
+            if not context.continued or i == iterations - 1:
+                return output, context.custom_status
+            context = LocalOrchestrationContext(instance_id=context.instance_id, input_=context.next_input)
+
+    def print_summary(self, total: float) -> None:
+        print(f'{len(self.calls)} activity calls: {self.activity_seconds:.3f} s within activities, '
+              f'{total - self.activity_seconds:.3f} s within the orchestrator and the runner ({total:.3f} s in total)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('orchestrator', help='Orchestrator name, e.g. ScheduledIngest or ModifyDB')
+    parser.add_argument('--input', type=json.loads, help='Orchestrator input (JSON)')
+    parser.add_argument('--url', help='Source csv url (overrides the URL of the orchestrator module)')
+    parser.add_argument('--iterations', type=int, default=1, help='Maximum number of continue_as_new iterations')
+    parser.add_argument('--fan-out-workers', type=int, default=1, help='Threads task_all runs its activities with')
+    parser.add_argument('--no-serialize', action='store_true', help='Hand activity inputs and results over without JSON')
+    parser.add_argument('--profile', help='Save cProfile stats into this file (and print the top functions)')
+    parser.add_argument('--profile-top', type=int, default=30)
+    args = parser.parse_args()
+
+    if args.url:
+        module = importlib.import_module(f'functions.{args.orchestrator}')
+        if not hasattr(module, 'URL'):
+            parser.error(f'{args.orchestrator} has no source url to override')
+        module.URL = args.url
+
+    runner = LocalRunner(serialize=not args.no_serialize, fan_out_workers=args.fan_out_workers)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        output, custom_status = runner.run(args.orchestrator, args.input, args.iterations)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f'Profile saved into {args.profile}')
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(args.profile_top)
+
+    print(f'Output: {json.dumps(output, default=str)}')
+    print(f'Custom status: {json.dumps(custom_status, default=str, indent=2)}')